@@ -0,0 +1,183 @@
+import os
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import List, Optional
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import JSONResponse, PlainTextResponse
+from pydantic import BaseModel, Field, field_validator
+import model_service
+import telemetry
+from catalog import get_catalog
+from handle_query import get_batcher, recommend_batch
+from startup_bundle import pin_model
+from url_ingest import get_ingestor
+MAX_IN_FLIGHT = int(os.environ.get("SHL_API_MAX_IN_FLIGHT", 64))
+MAX_BATCH = int(os.environ.get("SHL_API_MAX_BATCH", 64))
+REQUEST_TIMEOUT = float(os.environ.get("SHL_API_TIMEOUT", 30))
+class RecommendRequest(BaseModel):
+    query: str = Field(..., min_length=1, description="Job description text or a URL to one")
+    max_duration: Optional[int] = Field(None, ge=1)
+    required_types: List[str] = []
+    tenants: List[str] = Field([], description="Only recommend assessments from these libraries (e.g. \"shl\"); empty means all")
+    top_k: int = Field(10, ge=1, le=50)
+    debug: bool = Field(False, description="Include a per-stage timing breakdown in the response")
+    profile: bool = Field(False, description="Also sample this request's stacks (implies debug)")
+    @field_validator("query")
+    @classmethod
+    def _not_blank(cls, query):
+        if not query.strip():
+            raise ValueError("query must not be blank")
+        return query
+class BatchRequest(BaseModel):
+    requests: List[RecommendRequest]
+def _filters(request):
+    return {"max_duration": request.max_duration, "tenants": request.tenants, "required_types": request.required_types,
+            "top_k": request.top_k}
+def _format(request, results, trace=None):
+    response = {
+        "query": request.query,
+        # score orders the list (fused RRF score when hybrid); similarity is the cosine, null for keyword-only answers
+        "results": [
+            {"name": name, "url": url, "score": round(score, 4), "similarity": None if similarity is None else round(similarity, 4)}
+            for name, url, score, similarity in results
+        ],
+    }
+    if trace is not None and (request.debug or request.profile):
+        response["timings"] = trace.to_dict()
+    return response
+def _trace(request):
+    return telemetry.Trace("api.recommend", profile=True if request.profile else None)
+async def _resolve_text(query, trace=None):
+    query = query.strip()
+    if not query.startswith("http"):
+        return query
+    start = time.perf_counter()
+    text = await asyncio.wrap_future(get_ingestor().submit(query))
+    # Awaited on the event loop, so the fetch stage is recorded by hand rather than with telemetry.stage()
+    elapsed = time.perf_counter() - start
+    telemetry.observe("stage_seconds", elapsed, stage="fetch")
+    if trace is not None:
+        trace.add("fetch", elapsed)
+    if not text:
+        raise HTTPException(status_code=422, detail=f"Failed to extract content from {query}")
+    return text
+def create_app(warm_up=True):
+    # One process holds one resident model, catalog and micro-batcher; concurrent requests share them.
+    # Run several processes with --workers: each loads its own model, while the memory-mapped index
+    # is shared through the OS page cache.
+    # The catalog loads first and queries are admitted ("serving") from then on, answered from the BM25 index
+    # alone until the model is warm; /ready only reports ready once the model is warm too
+    state = {"serving": False, "ready": False, "in_flight": 0, "error": None}
+    pin_model()
+    def _warm_up():
+        try:
+            get_catalog()
+            state["serving"] = True
+            model_service.warm_up()
+            state["ready"] = True
+        except Exception as e:
+            state["error"] = str(e)
+    @asynccontextmanager
+    async def lifespan(app):
+        if warm_up:
+            asyncio.get_running_loop().run_in_executor(None, _warm_up)
+        else:
+            state["serving"] = state["ready"] = True
+        yield
+    app = FastAPI(title="SHL Assessment Recommender", lifespan=lifespan)
+    app.state.service = state
+    batch_pool = ThreadPoolExecutor(thread_name_prefix="recommend-batch")
+    async def _admit(cost, work):
+        # Bounded admission: beyond MAX_IN_FLIGHT queued queries the caller gets 429 instead of waiting.
+        # work(hold) passes the future doing the compute through hold(); the slot is released when that future
+        # finishes, not when a 504 abandons the request, since a batch that already started keeps running.
+        if not state["serving"]:
+            raise HTTPException(status_code=503, detail="Service is warming up")
+        if state["in_flight"] + cost > MAX_IN_FLIGHT:
+            telemetry.inc("api_rejected_total", reason="overload")
+            raise HTTPException(status_code=429, detail="Too many requests in flight; retry later")
+        state["in_flight"] += cost
+        loop = asyncio.get_running_loop()
+        held = []
+        def hold(future):
+            held.append(future)
+            return asyncio.wrap_future(future)
+        def release():
+            state["in_flight"] -= cost
+        def release_from_worker(_):
+            try:
+                loop.call_soon_threadsafe(release)
+            except RuntimeError:
+                # The event loop has shut down, and its admission count with it
+                pass
+        try:
+            return await asyncio.wait_for(work(hold), timeout=REQUEST_TIMEOUT)
+        except asyncio.TimeoutError:
+            telemetry.inc("api_rejected_total", reason="timeout")
+            raise HTTPException(status_code=504, detail="Recommendation timed out")
+        finally:
+            # Work still queued in the micro-batcher was cancelled with the request and finishes at once
+            if held and not held[0].done():
+                held[0].add_done_callback(release_from_worker)
+            else:
+                release()
+    @app.get("/health")
+    async def health():
+        return {"status": "ok"}
+    @app.get("/ready")
+    async def ready():
+        # "serving": queries are being answered; "dense": the embedding model is loaded and warm
+        body = {
+            "ready": state["ready"],
+            "serving": state["serving"],
+            "model": model_service.model_id(),
+            "dense": model_service.is_loaded(),
+            "in_flight": state["in_flight"],
+        }
+        if not state["ready"]:
+            return JSONResponse(dict(body, detail=state["error"] or "warming up"), status_code=503)
+        return body
+    @app.get("/metrics")
+    async def metrics():
+        return PlainTextResponse(telemetry.prometheus_text(), media_type="text/plain; version=0.0.4")
+    @app.post("/recommend")
+    async def recommend(request: RecommendRequest):
+        trace = _trace(request)
+        async def work(hold):
+            text = await _resolve_text(request.query, trace)
+            # Single requests go through the shared micro-batcher without tying up a thread
+            return await hold(get_batcher().submit((text, _filters(request), trace)))
+        start = time.perf_counter()
+        results = await _admit(1, work)
+        trace.finish()
+        return dict(_format(request, results, trace), took_ms=round((time.perf_counter() - start) * 1000, 2))
+    @app.post("/recommend/batch")
+    async def recommend_many(batch: BatchRequest):
+        if not batch.requests:
+            return {"responses": [], "took_ms": 0.0}
+        if len(batch.requests) > MAX_BATCH:
+            raise HTTPException(status_code=413, detail=f"At most {MAX_BATCH} requests per batch")
+        traces = [_trace(r) for r in batch.requests]
+        async def work(hold):
+            texts = await asyncio.gather(*[_resolve_text(r.query, t) for r, t in zip(batch.requests, traces)])
+            return await hold(batch_pool.submit(recommend_batch, list(texts), [_filters(r) for r in batch.requests], traces=traces))
+        start = time.perf_counter()
+        results = await _admit(len(batch.requests), work)
+        for trace in traces:
+            trace.finish()
+        return {
+            "responses": [_format(r, res, t) for r, res, t in zip(batch.requests, results, traces)],
+            "took_ms": round((time.perf_counter() - start) * 1000, 2),
+        }
+    return app
+app = create_app()
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(
+        "api:app",
+        host=os.environ.get("SHL_API_HOST", "0.0.0.0"),
+        port=int(os.environ.get("SHL_API_PORT", 8000)),
+        workers=int(os.environ.get("SHL_API_WORKERS", 1)),
+    )
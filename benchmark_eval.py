@@ -1,113 +1,186 @@
-import json
-import numpy as np
-import pandas as pd
-import faiss
-from datetime import datetime
-from InstructorEmbedding import INSTRUCTOR
-import torch
-def log(msg):
-    print(f"[{datetime.now().strftime('%H:%M:%S')}] {msg}")
-def load_resources():
-    index = faiss.read_index("outputs/faiss_index.idx")
-    with open("outputs/assessment_texts.json", "r", encoding="utf-8") as f:
-        texts = json.load(f)
-    with open("shl_metadata_index_cleaned.json", "r", encoding="utf-8") as f:
-        metadata = json.load(f)
-    return index, texts, metadata
-def load_eval_set(path="query_eval_set.json"):
-    with open(path, "r", encoding="utf-8") as f:
-        return json.load(f)
-def parse_duration(duration_str):
-    if not duration_str:
-        return None
-    try:
-        digits = ''.join(filter(str.isdigit, str(duration_str)))
-        return int(digits) if digits else None
-    except:
-        return None
-def embed_query_instructor(queries, device="cpu"):
-    model = INSTRUCTOR("hkunlp/instructor-xl")
-    model.to(device)
-    instruction = "Represent the task: retrieve relevant assessments based on this job description"
-    pairs = [[instruction, q] for q in queries]
-    vectors = model.encode(pairs, show_progress_bar=True, convert_to_numpy=True, device=device)
-    faiss.normalize_L2(vectors)
-    return vectors
-def evaluate_map_recall(index, texts, metadata, eval_set, k=3, max_duration=None, required_types=None):
-    recall_list = []
-    map_list = []
-    all_outputs = []
-    device = "cuda" if torch.cuda.is_available() else "cpu"
-    queries = [q["query"] for q in eval_set]
-    query_vecs = embed_query_instructor(queries, device=device)
-    for i, entry in enumerate(eval_set):
-        relevant_ids = set(entry["relevant_ids"])
-        # Raw retrieval from FAISS (for debugging)
-        D, I = index.search(np.array([query_vecs[i]]), k * 5)
-        raw_retrieved = [metadata[idx].get("Assessment Name", "Unknown") for idx in I[0]]
-        print("\n====================")
-        print(f"Query: {entry['query']}")
-        print(f"Expected (Relevant IDs): {relevant_ids}")
-        print(f"Raw Retrieved (all candidates): {raw_retrieved}")
-        filtered_results = []
-        for idx, score in zip(I[0], D[0]):
-            item = metadata[idx]
-            name = item.get("Assessment Name", "Unknown")
-            duration = parse_duration(item.get("Duration", ""))
-            # Get the cleaned Test Type as a list (already standardized)
-            std_types = [t.lower() for t in item.get("Test Type", [])]
-            # Check duration: skip if duration is missing or exceeds max_duration.
-            if max_duration is not None and (duration is None or duration > max_duration):
-                print(f"Skipping {name} due to duration: {duration}")
-                continue
-            # Check required test types: Skip if none of the required types match.
-            if required_types:
-                if not any(req.lower() in std_types for req in required_types):
-                    print(f"Skipping {name} due to test type mismatch: {std_types}")
-                    continue
-            adjusted_similarity = 1 - score  # No penalty here; candidate passes filter
-            filtered_results.append((name, adjusted_similarity))
-            if len(filtered_results) == k:
-                break
-        retrieved_names = [name for name, sim in filtered_results]
-        print(f"Filtered Retrieved: {retrieved_names}")
-        hits = [1 if name in relevant_ids else 0 for name, _ in filtered_results]
-        recall = sum(hits) / len(relevant_ids) if relevant_ids else 0
-        recall_list.append(recall)
-        ap = 0.0
-        num_hits = 0
-        for j, hit in enumerate(hits):
-            if hit:
-                num_hits += 1
-                ap += num_hits / (j + 1)
-        ap = ap / min(k, len(relevant_ids)) if relevant_ids else 0
-        map_list.append(ap)
-        all_outputs.append({
-            "Query": entry["query"],
-            "Relevant Assessments": ", ".join(relevant_ids),
-            "Retrieved Assessments": ", ".join([f"{name} ({sim:.4f})" for name, sim in filtered_results]),
-            f"Recall@{k}": round(recall, 4),
-            f"MAP@{k}": round(ap, 4)
-        })
-    metrics = {
-        f"Mean Recall@{k}": round(np.mean(recall_list), 4),
-        f"MAP@{k}": round(np.mean(map_list), 4)
-    }
-    df = pd.DataFrame(all_outputs)
-    df.to_excel("outputs/eval_results.xlsx", index=False)
-    log("Detailed results exported to outputs/eval_results.xlsx")
-    return metrics
-if __name__ == "__main__":
-    log("Loading resources...")
-    index, texts, metadata = load_resources()
-    eval_set = load_eval_set("query_eval_set.json")
-    log("Evaluating MAP@5 and Recall@5 with filters...")
-    metrics = evaluate_map_recall(
-        index, texts, metadata, eval_set,
-        k=5,
-        max_duration=45,
-        required_types=["cognitive", "personality", "technical"]
-    )
-    print("\nEvaluation Metrics:")
-    for key, v in metrics.items():
-        print(f"{key}: {v}")
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+import numpy as np
+import pandas as pd
+import faiss
+from datetime import datetime
+import model_service
+from catalog import Catalog, get_catalog
+from scoring import score_candidates
+from handle_query import hybrid_rank
+def log(msg):
+    print(f"[{datetime.now().strftime('%H:%M:%S')}] {msg}")
+def load_resources():
+    catalog = get_catalog("outputs/faiss_index.idx", "outputs/assessment_texts.json", "shl_metadata_index_cleaned.json")
+    return catalog.index, catalog.texts, catalog
+def load_eval_set(path="query_eval_set.json"):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+def score_retrieval(retrieved_names, relevant_ids, k):
+    # Recall@k and AP@k for one query, given retrieved names in rank order
+    hits = [1 if name in relevant_ids else 0 for name in retrieved_names[:k]]
+    recall = sum(hits) / len(relevant_ids) if relevant_ids else 0
+    ap = 0.0
+    num_hits = 0
+    for j, hit in enumerate(hits):
+        if hit:
+            num_hits += 1
+            ap += num_hits / (j + 1)
+    ap = ap / min(k, len(relevant_ids)) if relevant_ids else 0
+    return recall, ap
+def embed_query_instructor(queries, device="cpu"):
+    vectors = model_service.encode(queries, device=device, show_progress_bar=True)
+    faiss.normalize_L2(vectors)
+    return vectors
+def evaluate_map_recall(index, texts, metadata, eval_set, k=3, max_duration=None, required_types=None, hybrid=False):
+    recall_list = []
+    map_list = []
+    all_outputs = []
+    device = model_service.default_device()
+    queries = [q["query"] for q in eval_set]
+    query_vecs = embed_query_instructor(queries, device=device)
+    catalog = metadata if isinstance(metadata, Catalog) else Catalog.from_metadata(index, texts, metadata)
+    # Hard filters are resolved once against the filter index; each query then searches only eligible rows
+    allowed_rows = catalog.allowed_rows(max_duration, required_types)
+    for i, entry in enumerate(eval_set):
+        relevant_ids = set(entry["relevant_ids"])
+        # Raw retrieval from FAISS (for debugging)
+        D, I = catalog.search(np.array([query_vecs[i]]), k * 5)
+        raw_retrieved = [catalog.names[idx] for idx in I[0] if idx >= 0]
+        print("\n====================")
+        print(f"Query: {entry['query']}")
+        print(f"Expected (Relevant IDs): {relevant_ids}")
+        print(f"Raw Retrieved (all candidates): {raw_retrieved}")
+        if hybrid:
+            # Dense candidates fused with BM25 matches, as served by the app
+            D, I = catalog.search(np.array([query_vecs[i]]), k * 5, allowed_rows)
+            ranked = hybrid_rank(D[0], I[0], query_vecs[i], entry["query"], catalog, top_k=k, allowed=allowed_rows)
+            filtered_results = [(name, score) for name, _, score, _ in ranked]
+        else:
+            D, I = catalog.search(np.array([query_vecs[i]]), k, allowed_rows)
+            # Same scoring path as the app; no type penalty here since candidates passed the hard prefilter
+            rows, similarities = score_candidates(D[0], I[0], catalog, top_k=k)
+            filtered_results = [(catalog.names[row], float(sim)) for row, sim in zip(rows, similarities)]
+        retrieved_names = [name for name, sim in filtered_results]
+        print(f"Filtered Retrieved: {retrieved_names}")
+        recall, ap = score_retrieval(retrieved_names, relevant_ids, k)
+        recall_list.append(recall)
+        map_list.append(ap)
+        all_outputs.append({
+            "Query": entry["query"],
+            "Relevant Assessments": ", ".join(relevant_ids),
+            "Retrieved Assessments": ", ".join([f"{name} ({sim:.4f})" for name, sim in filtered_results]),
+            f"Recall@{k}": round(recall, 4),
+            f"MAP@{k}": round(ap, 4)
+        })
+    metrics = {
+        f"Mean Recall@{k}": round(np.mean(recall_list), 4),
+        f"MAP@{k}": round(np.mean(map_list), 4)
+    }
+    df = pd.DataFrame(all_outputs)
+    df.to_excel("outputs/eval_results.xlsx", index=False)
+    log("Detailed results exported to outputs/eval_results.xlsx")
+    return metrics
+def evaluate_backend(spec, eval_set, k=5, parity_sample=64):
+    # spec looks like "int8", "xl:onnx" or "base:fp32". Reports cosine drift against the stored catalog
+    # vectors, Recall/MAP with catalog and queries embedded by that backend, and its costs. Meant to run
+    # alone in a fresh process (see compare_backends), so the RSS figures belong to this backend only.
+    with open("outputs/assessment_texts.json", "r", encoding="utf-8") as f:
+        stored_texts = json.load(f)
+    stored = np.load("outputs/assessment_embeddings.npy").astype(np.float32)
+    faiss.normalize_L2(stored)
+    catalog = get_catalog()
+    rows = [r for r, text in enumerate(catalog.texts) if text]
+    queries = [q["query"] for q in eval_set]
+    size, _, backend = spec.rpartition(":")
+    model_service.configure(model_name=size or model_service.MODEL_NAME, backend=backend or "fp32")
+    # Peak RSS before the model loads; what the backend adds is measured against it
+    baseline_rss = model_service.process_rss_bytes()
+    model_service.get_model()
+    stats = model_service.model_stats()
+    sample = model_service.encode(stored_texts[:parity_sample])
+    faiss.normalize_L2(sample)
+    drift = None
+    if sample.shape[1] == stored.shape[1]:
+        cosines = (sample * stored[:len(sample)]).sum(axis=1)
+        drift = {"mean": round(float(1 - cosines.mean()), 6), "max": round(float(1 - cosines.min()), 6)}
+    catalog_vecs = model_service.encode([catalog.texts[r] for r in rows])
+    faiss.normalize_L2(catalog_vecs)
+    start = time.perf_counter()
+    query_vecs = model_service.encode(queries)
+    query_ms = (time.perf_counter() - start) * 1000 / len(queries)
+    faiss.normalize_L2(query_vecs)
+    index = faiss.IndexFlatIP(catalog_vecs.shape[1])
+    index.add(catalog_vecs)
+    _, I = index.search(query_vecs, k)
+    scores = [score_retrieval([catalog.names[rows[i]] for i in I[j]], set(entry["relevant_ids"]), k) for j, entry in enumerate(eval_set)]
+    peak_rss = model_service.process_rss_bytes()
+    return {
+        "backend": model_service.model_id(),
+        f"Recall@{k}": round(float(np.mean([r for r, _ in scores])), 4),
+        f"MAP@{k}": round(float(np.mean([ap for _, ap in scores])), 4),
+        "drift_mean": drift["mean"] if drift else None,
+        "drift_max": drift["max"] if drift else None,
+        "query_ms": round(query_ms, 2),
+        "load_s": stats["load_seconds"],
+        "model_mb": round(stats["model_bytes"] / 1e6, 1),
+        "peak_rss_mb": round(peak_rss / 1e6, 1) if peak_rss else None,
+        "backend_rss_mb": round((peak_rss - baseline_rss) / 1e6, 1) if peak_rss and baseline_rss else None,
+    }
+def compare_backends(specs, eval_path="query_eval_set.json", k=5, parity_sample=64, output_path="outputs/backend_comparison.json"):
+    # Each backend is evaluated in its own interpreter: peak RSS only ever grows within a process and
+    # model_service keeps every loaded model cached, so a shared process would credit memory to run order
+    results = []
+    for spec in specs:
+        log(f"Evaluating encoder backend {spec} in a fresh process...")
+        completed = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--backend-worker", spec, "--eval-set", eval_path,
+             "-k", str(k), "--parity-sample", str(parity_sample)],
+            capture_output=True, text=True,
+        )
+        if completed.returncode != 0:
+            raise RuntimeError(f"Backend {spec} failed:\n{completed.stderr.strip()}")
+        results.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+    with open(output_path, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    log(f"Backend comparison exported to {output_path}")
+    return results
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Evaluate SHL recommendations against query_eval_set.json.")
+    parser.add_argument("--backends", nargs="+", metavar="SPEC",
+                        help="compare encoder backends instead, e.g. fp32 int8 onnx base:fp32 large:int8")
+    parser.add_argument("--hybrid", action="store_true", help="fuse dense results with BM25 matches before scoring")
+    parser.add_argument("--eval-set", default="query_eval_set.json")
+    parser.add_argument("-k", type=int, default=5, help="cutoff for --backends")
+    parser.add_argument("--parity-sample", type=int, default=64, help="stored texts re-embedded to measure drift")
+    # Internal: evaluates one backend and prints its result as the last stdout line
+    parser.add_argument("--backend-worker", metavar="SPEC", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.backend_worker:
+        print(json.dumps(evaluate_backend(args.backend_worker, load_eval_set(args.eval_set), args.k, args.parity_sample)))
+        raise SystemExit
+    if args.backends:
+        results = compare_backends(args.backends, args.eval_set, args.k, args.parity_sample)
+        print(pd.DataFrame(results).to_string(index=False))
+        raise SystemExit
+
+    log("Loading resources...")
+    index, texts, metadata = load_resources()
+    eval_set = load_eval_set(args.eval_set)
+    log("Evaluating MAP@5 and Recall@5 with filters...")
+    metrics = evaluate_map_recall(
+        index, texts, metadata, eval_set,
+        k=5,
+        max_duration=45,
+        required_types=["cognitive", "personality", "technical"],
+        hybrid=args.hybrid
+    )
+    print("\nEvaluation Metrics:")
+    for key, v in metrics.items():
+        print(f"{key}: {v}")
+    stats = model_service.model_stats()
+    print(f"Model load: {stats['load_seconds']}s | Encode: {stats['encode_seconds_total']:.2f}s over {stats['texts_encoded']} queries")
@@ -0,0 +1,290 @@
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+import faiss
+import model_service
+from benchmark_eval import load_eval_set, log
+from catalog import ID_MAP_NAME, Catalog, assessment_id, get_catalog, load_id_map
+from index_factory import INDEX_KINDS, RERANKED_KINDS, RerankedIndex, build_index, index_memory_bytes
+from scoring import score_candidates
+from url_ingest import UrlIngestor
+# Relative slowdown (or throughput drop) against a baseline run that counts as a regression
+REGRESSION_THRESHOLD = 0.10
+# Runs in a fresh interpreter so imports, catalog open and model load are all cold; argv: mode, query
+STARTUP_PROBE = """
+import sys, json, time
+start = time.perf_counter()
+import handle_query
+imported = time.perf_counter()
+catalog = handle_query.get_catalog()
+opened = time.perf_counter()
+if sys.argv[1] == "embed":
+    handle_query.recommend_batch([sys.argv[2]], catalog=catalog)
+else:
+    handle_query.lexical_rank(sys.argv[2], catalog)
+done = time.perf_counter()
+print(json.dumps({"import_ms": (imported - start) * 1000, "catalog_ms": (opened - imported) * 1000,
+                  "first_recommendation_ms": (done - opened) * 1000, "pandas_imported": "pandas" in sys.modules}))
+"""
+def percentiles(samples_ms):
+    samples = np.asarray(samples_ms, dtype=np.float64)
+    if not len(samples):
+        return {"n": 0}
+    return {
+        "n": int(len(samples)),
+        "mean_ms": round(float(samples.mean()), 4),
+        "p50_ms": round(float(np.percentile(samples, 50)), 4),
+        "p95_ms": round(float(np.percentile(samples, 95)), 4),
+        "p99_ms": round(float(np.percentile(samples, 99)), 4),
+    }
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, (time.perf_counter() - start) * 1000
+def run_metadata(index_kind):
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=5).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": commit or None,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "faiss": getattr(faiss, "__version__", None),
+        "numpy": np.__version__,
+        "model": model_service.model_id(),
+        "index": index_kind,
+    }
+def bench_model_load(device):
+    # Only meaningful in a fresh process; a model loaded earlier in this run is reported as-is
+    start = time.perf_counter()
+    model_service.get_model(device)
+    return {"load_s": model_service.model_stats()["load_seconds"] or round(time.perf_counter() - start, 3)}
+def bench_fetch(urls, concurrency):
+    # Cold fetch + extraction, then a warm pass served from the ingestor's cache
+    ingestor = UrlIngestor(max_workers=concurrency)
+    try:
+        results = {}
+        for phase in ("cold", "warm"):
+            start = time.perf_counter()
+            futures = [(ingestor.submit(url), time.perf_counter()) for url in urls]
+            latencies = []
+            for future, submitted in futures:
+                future.result()
+                latencies.append((time.perf_counter() - submitted) * 1000)
+            results[phase] = dict(percentiles(latencies), urls_per_s=round(len(urls) / (time.perf_counter() - start), 2))
+        results["counters"] = ingestor.stats()
+        return results
+    finally:
+        ingestor.close()
+def bench_embed(queries, batch_sizes, device, repeats=3):
+    # Straight to the encoder: the query embedding cache would otherwise hide the cost
+    results = {}
+    for batch_size in batch_sizes:
+        latencies = []
+        for _ in range(repeats):
+            for start in range(0, len(queries), batch_size):
+                _, ms = timed(model_service.encode, queries[start:start + batch_size], device=device)
+                latencies.append(ms)
+        stats = percentiles(latencies)
+        stats["queries_per_s"] = round(batch_size * 1000 / stats["mean_ms"], 2) if stats["n"] else None
+        results[str(batch_size)] = stats
+    return results
+def bench_startup(query, embed=True, repeats=3):
+    # Time-to-first-recommendation of a new process, loading from the JSON files and from the startup bundle
+    results = {}
+    for source, use_bundle in (("files", "0"), ("bundle", "1")):
+        runs = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            completed = subprocess.run(
+                [sys.executable, "-c", STARTUP_PROBE, "embed" if embed else "lexical", query],
+                capture_output=True, text=True, env=dict(os.environ, SHL_BUNDLE=use_bundle),
+            )
+            wall_ms = (time.perf_counter() - start) * 1000
+            if completed.returncode != 0:
+                raise RuntimeError(f"Startup probe failed ({source}):\n{completed.stderr.strip()}")
+            runs.append(dict(json.loads(completed.stdout.strip().splitlines()[-1]), process_ms=wall_ms))
+        results[source] = {
+            key: round(float(np.median([r[key] for r in runs])), 1) for key in ("import_ms", "catalog_ms", "first_recommendation_ms", "process_ms")
+        }
+        results[source]["pandas_imported"] = runs[-1]["pandas_imported"]
+    return results
+def synthetic_catalog(base, base_vectors, size, kind="flat", noise=0.05, seed=0):
+    # Scales the real catalog up to size entries: records are repeated with unique URLs and their vectors
+    # jittered, so filters, duplicates-of-a-theme and score distributions look like production data
+    rng = np.random.default_rng(seed)
+    source = np.arange(size) % len(base)
+    records = []
+    for i, j in enumerate(source):
+        record = dict(base[j])
+        if i >= len(base):
+            record["URL"] = f"{record.get('URL', '')}#synthetic-{i}"
+            record["Assessment Name"] = f"{record.get('Assessment Name', '')} #{i}"
+        records.append(record)
+    vectors = base_vectors[source] + rng.standard_normal((size, base_vectors.shape[1])).astype(np.float32) * noise
+    faiss.normalize_L2(vectors)
+    ids = np.array([assessment_id(r) for r in records], dtype=np.int64)
+    start = time.perf_counter()
+    index, config = build_index(vectors, ids, kind)
+    build_s = time.perf_counter() - start
+    if kind in RERANKED_KINDS:
+        # Re-ranks against the in-memory vectors here; served catalogs memory-map them from disk
+        index = RerankedIndex(index, vectors, ids)
+    texts = [f"{r.get('Assessment Name', '')} | Original Type: {r.get('Test Type')}" for r in records]
+    catalog = Catalog.from_records(index, texts, records, ids=ids)
+    return catalog, {"entries": size, "build_s": round(build_s, 3), "index_mb": round(index_memory_bytes(index) / 1e6, 2),
+                     "factory": config["factory"]}
+def query_once(catalog, query_vec, k, max_duration, required_types):
+    # One request's search path, split into its stages
+    allowed, filter_ms = timed(catalog.allowed_rows, max_duration)
+    (D, I), search_ms = timed(catalog.search, query_vec[None, :], k * 5, allowed)
+    _, rerank_ms = timed(score_candidates, D[0], I[0], catalog, k, required_types)
+    return filter_ms, search_ms, rerank_ms
+def bench_search(catalog, query_vecs, k, batch_sizes, concurrency_levels, max_duration=45, required_types=None,
+                 lexical_queries=None, min_seconds=2.0):
+    results = {}
+    stages = {"filter": [], "search": [], "rerank": []}
+    for q in query_vecs:
+        for name, ms in zip(stages, query_once(catalog, q, k, max_duration, required_types)):
+            stages[name].append(ms)
+    results["stages"] = {name: percentiles(samples) for name, samples in stages.items()}
+    if lexical_queries:
+        _, build_ms = timed(catalog.lexical_index)
+        latencies = [timed(catalog.lexical_search, text, k * 5)[1] for text in lexical_queries]
+        results["stages"]["lexical"] = dict(percentiles(latencies), build_s=round(build_ms / 1000, 3))
+    batched = {}
+    for batch_size in batch_sizes:
+        latencies = []
+        for start in range(0, len(query_vecs), batch_size):
+            _, ms = timed(catalog.search, query_vecs[start:start + batch_size], k * 5)
+            latencies.append(ms)
+        stats = percentiles(latencies)
+        stats["queries_per_s"] = round(batch_size * 1000 / stats["mean_ms"], 2) if stats["n"] else None
+        batched[str(batch_size)] = stats
+    results["batched_search"] = batched
+    concurrent = {}
+    for workers in concurrency_levels:
+        # Each worker replays the query set end to end (filter, search, re-rank) for at least min_seconds
+        def worker(offset):
+            latencies, deadline, i = [], time.perf_counter() + min_seconds, offset
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                query_once(catalog, query_vecs[i % len(query_vecs)], k, max_duration, required_types)
+                latencies.append((time.perf_counter() - start) * 1000)
+                i += 1
+            return latencies
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            latencies = [ms for chunk in pool.map(worker, range(workers)) for ms in chunk]
+        elapsed = time.perf_counter() - start
+        concurrent[str(workers)] = dict(percentiles(latencies), qps=round(len(latencies) / elapsed, 2))
+    results["concurrent"] = concurrent
+    return results
+def flatten(results, prefix=""):
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}.{key}" if prefix else key
+        if isinstance(value, dict):
+            flat.update(flatten(value, name))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+def compare(current, baseline, threshold=REGRESSION_THRESHOLD):
+    # Latencies (*_ms, *_s) regress when they grow, throughputs (*_per_s, qps) when they shrink
+    now, before = flatten(current["results"]), flatten(baseline["results"])
+    rows = []
+    for name in sorted(set(now) & set(before)):
+        if not before[name] or name.endswith(".n"):
+            continue
+        change = (now[name] - before[name]) / before[name]
+        higher_is_better = name.endswith("per_s") or name.endswith("qps")
+        if not (name.endswith("_ms") or name.endswith("_s") or name.endswith("_mb") or higher_is_better):
+            continue
+        regressed = -change > threshold if higher_is_better else change > threshold
+        rows.append({"metric": name, "baseline": before[name], "current": now[name], "change": f"{change:+.1%}",
+                     "regression": regressed})
+    return rows
+def run(sizes, kind="flat", k=10, batch_sizes=(1, 8, 32), concurrency_levels=(1, 4, 8), embed=True, urls=None,
+        lexical=True, min_seconds=2.0, startup_repeats=3):
+    device = model_service.default_device()
+    eval_set = load_eval_set("query_eval_set.json")
+    queries = [q["query"] for q in eval_set]
+    report = {"meta": run_metadata(kind), "results": {}}
+    catalog = get_catalog()
+    base = [catalog[row] for row in range(len(catalog))]
+    base_vectors = np.load(os.path.join("outputs", "assessment_embeddings.npy")).astype(np.float32)
+    faiss.normalize_L2(base_vectors)
+    if len(base_vectors) != len(base):
+        # Embedding rows follow assessment_texts.json; map them back to metadata rows through the ids
+        _, vector_ids = load_id_map(os.path.join("outputs", ID_MAP_NAME), len(catalog))
+        vector_of = dict(zip(vector_ids.tolist(), base_vectors))
+        keep = [row for row in range(len(catalog)) if int(catalog.ids[row]) in vector_of]
+        base = [base[row] for row in keep]
+        base_vectors = np.stack([vector_of[int(catalog.ids[row])] for row in keep])
+    if startup_repeats:
+        # Before this process loads the model, so the probes do not compete with it for memory
+        log("Timing time-to-first-recommendation in fresh processes...")
+        report["results"]["startup"] = bench_startup(queries[0], embed, startup_repeats)
+    if embed:
+        log("Timing model load and query embedding...")
+        report["results"]["model"] = bench_model_load(device)
+        report["results"]["embed"] = bench_embed(queries, batch_sizes, device)
+        query_vecs = model_service.encode(queries, device=device)
+        faiss.normalize_L2(query_vecs)
+    else:
+        # Without the model, catalog vectors stand in for queries so search costs can still be measured
+        query_vecs = base_vectors[np.random.default_rng(1).choice(len(base_vectors), len(queries))]
+    if urls:
+        log(f"Timing fetch + extraction for {len(urls)} URLs...")
+        report["results"]["fetch"] = bench_fetch(urls, max(concurrency_levels))
+    for size in sizes:
+        log(f"Building a synthetic {size}-entry catalog ({kind})...")
+        synthetic, info = synthetic_catalog(base, base_vectors, size, kind)
+        log(f"Timing search at {size} entries...")
+        info.update(bench_search(synthetic, query_vecs, k, batch_sizes, concurrency_levels,
+                                 lexical_queries=queries if lexical else None, min_seconds=min_seconds))
+        report["results"][f"catalog_{size}"] = info
+        del synthetic
+    rss = model_service.process_rss_bytes()
+    report["results"]["peak_rss_mb"] = round(rss / 1e6, 1) if rss else None
+    return report
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Latency and throughput benchmark for the recommendation path.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000], help="synthetic catalog sizes")
+    parser.add_argument("--index", default="flat", choices=INDEX_KINDS)
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--seconds", type=float, default=2.0, help="duration of each concurrency run")
+    parser.add_argument("--no-embed", action="store_true", help="skip the model; use catalog vectors as queries")
+    parser.add_argument("--no-lexical", action="store_true", help="skip building and timing the BM25 index")
+    parser.add_argument("--startup-repeats", type=int, default=3, help="fresh-process startup runs per catalog source (0 skips)")
+    parser.add_argument("--urls", nargs="*", help="job-description URLs to time fetch + extraction on")
+    parser.add_argument("--output", default="outputs/benchmark_perf.json")
+    parser.add_argument("--baseline", help="earlier --output file to compare against; exits 1 on regressions")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD)
+    args = parser.parse_args()
+    report = run(args.sizes, args.index, args.k, args.batch_sizes, args.concurrency, embed=not args.no_embed,
+                 urls=args.urls, lexical=not args.no_lexical, min_seconds=args.seconds,
+                 startup_repeats=args.startup_repeats)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    log(f"Benchmark results saved to {args.output}")
+    print(pd.Series(flatten(report["results"])).to_string())
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            rows = compare(report, json.load(f), args.threshold)
+        print(pd.DataFrame(rows).to_string(index=False))
+        if any(row["regression"] for row in rows):
+            log("Performance regressions found.")
+            raise SystemExit(1)
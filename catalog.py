@@ -0,0 +1,313 @@
+import os
+import json
+import hashlib
+import threading
+import time
+import numpy as np
+from clean_metadata import NO_DURATION, TYPE_BITS, UNKNOWN_NAME, typed_columns
+from lexical_index import LEXICAL_INDEX_NAME, LexicalIndex
+from index_factory import (
+    INDEX_PARAMS_NAME, RERANKED_KINDS, RerankedIndex, apply_search_params, load_index_params, read_index_mmap, search_ids,
+)
+from sharded_search import SHARDS_DIR_NAME, SHARDS_MANIFEST_NAME, ShardedIndex, read_shards_manifest
+INDEX_PATH = "outputs/faiss_index.idx"
+TEXTS_PATH = "outputs/assessment_texts.json"
+METADATA_PATH = "shl_metadata_index_cleaned.json"
+FILTER_INDEX_NAME = "filter_index.npz"
+ID_MAP_NAME = "id_map.npz"
+# Full-precision vectors; reduced-precision indexes re-rank against them memory-mapped
+EMBEDDINGS_NAME = "assessment_embeddings.npy"
+# Present in the output directory while a refresh is swapping new files in
+PUBLISH_MARKER = ".publishing"
+# Records without a "Tenant" field belong to the SHL catalog itself
+DEFAULT_TENANT = "shl"
+# SHL_SHARDS=local searches the shards built by generate_embeddings.py --shards in one worker process each;
+# host:port,host:port uses shard servers instead. Unset: the single full index.
+SHARDS = os.environ.get("SHL_SHARDS", "")
+# SHL_BUNDLE=0 always loads from the JSON/side files even when an up-to-date startup bundle exists
+USE_BUNDLE = os.environ.get("SHL_BUNDLE", "1") != "0"
+def assessment_id(item):
+    # Stable 63-bit id derived from the product URL, so FAISS labels survive reordering and partial rebuilds.
+    # Tenant libraries may list the same product URL, so their ids are also keyed by tenant.
+    key = item.get("URL") or item.get("Assessment Name", "")
+    tenant = item.get("Tenant") or DEFAULT_TENANT
+    if tenant != DEFAULT_TENANT:
+        key = f"{tenant}\x00{key}"
+    return int.from_bytes(hashlib.sha1(key.encode("utf-8")).digest()[:8], "big") & 0x7FFFFFFFFFFFFFFF
+def types_to_mask(types):
+    mask = 0
+    for t in types or []:
+        mask |= TYPE_BITS.get(str(t).lower(), 0)
+    return mask
+def mask_to_types(mask):
+    return [name for name, bit in TYPE_BITS.items() if mask & bit]
+def build_filter_index(durations, type_masks):
+    # Sorted duration column plus one packed bitset per test type; a filter becomes a
+    # searchsorted plus a few bitwise ORs instead of a scan over every record
+    known = np.flatnonzero(durations != NO_DURATION)
+    order = known[np.argsort(durations[known], kind="stable")]
+    type_bitsets = np.stack([np.packbits((type_masks & bit) != 0) for bit in TYPE_BITS.values()])
+    return {
+        "duration_order": order.astype(np.int64),
+        "duration_sorted": durations[order].astype(np.int32),
+        "type_bitsets": type_bitsets,
+        "type_names": np.array(list(TYPE_BITS)),
+        "size": np.array(len(durations)),
+    }
+def write_filter_index(filter_index, path):
+    np.savez(path, **filter_index)
+def load_filter_index(path, size):
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as data:
+        filter_index = {key: data[key] for key in data.files}
+    if int(filter_index["size"]) != size or list(filter_index["type_names"]) != list(TYPE_BITS):
+        return None
+    return filter_index
+def write_id_map(record_ids, vector_ids, path):
+    # record_ids follow the metadata file order; vector_ids follow assessment_texts.json / the embedding rows
+    np.savez(path, record_ids=np.asarray(record_ids, dtype=np.int64), vector_ids=np.asarray(vector_ids, dtype=np.int64))
+def load_id_map(path, size):
+    if not os.path.exists(path):
+        return None, None
+    with np.load(path) as data:
+        record_ids, vector_ids = data["record_ids"], data["vector_ids"]
+    if len(record_ids) != size:
+        return None, None
+    return record_ids, vector_ids
+def watched_paths(index_path, texts_path, metadata_path):
+    # Required files plus the optional side files written next to the index
+    output_dir = os.path.dirname(index_path)
+    optional = [os.path.join(output_dir, name) for name in (FILTER_INDEX_NAME, ID_MAP_NAME, INDEX_PARAMS_NAME, LEXICAL_INDEX_NAME)]
+    optional.append(os.path.join(output_dir, SHARDS_DIR_NAME, SHARDS_MANIFEST_NAME))
+    return [index_path, texts_path, metadata_path] + optional
+def open_index(index_path, source_path=None):
+    # The sharded index when SHL_SHARDS is set and the shards next to source_path (the full index they were
+    # split from; index_path itself unless that is a copy) are still current, else the index file itself
+    source_path = source_path or index_path
+    if SHARDS:
+        shards_dir = os.path.join(os.path.dirname(source_path), SHARDS_DIR_NAME)
+        manifest = read_shards_manifest(shards_dir)
+        if manifest is not None and manifest.get("source") == list(file_signature([source_path])[0] or []):
+            return ShardedIndex.open(shards_dir, SHARDS)
+    return read_index_mmap(index_path)
+def tenant_columns(items):
+    # Tenant code per record plus the tenant names the codes index into
+    names, codes = np.unique([item.get("Tenant") or DEFAULT_TENANT for item in items] or [DEFAULT_TENANT], return_inverse=True)
+    return codes[:len(items)].astype(np.uint16), [str(name) for name in names]
+def is_publishing(output_dir):
+    return os.path.exists(os.path.join(output_dir, PUBLISH_MARKER))
+def file_signature(paths, use_hash=False):
+    signature = []
+    for path in paths:
+        if not os.path.exists(path):
+            signature.append(None)
+            continue
+        stat = os.stat(path)
+        if use_hash:
+            digest = hashlib.sha1()
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    digest.update(chunk)
+            signature.append(digest.hexdigest())
+        else:
+            signature.append((stat.st_mtime_ns, stat.st_size))
+    return tuple(signature)
+class Catalog:
+    # Resident, read-only view of the FAISS index plus columnar assessment metadata.
+    # Indexing a Catalog returns a record dict, so it can stand in for the old metadata list.
+    def __init__(self, index, texts, names, urls, durations, type_masks, remote, adaptive, signature=None,
+                 filter_index=None, ids=None, lexical=None, tenants=None, tenant_names=None):
+        self.index = index
+        self.texts = texts
+        self.names = names
+        self.urls = urls
+        self.durations = durations
+        self.type_masks = type_masks
+        self.remote = remote
+        self.adaptive = adaptive
+        self.signature = signature
+        self.filter_index = filter_index or build_filter_index(durations, type_masks)
+        self.lexical = lexical
+        self.tenants = np.zeros(len(names), dtype=np.uint16) if tenants is None else np.asarray(tenants, dtype=np.uint16)
+        self.tenant_names = list(tenant_names or [DEFAULT_TENANT])
+        # Without an id map the index is positional (legacy builds): FAISS label == metadata row
+        self.ids = np.arange(len(names), dtype=np.int64) if ids is None else np.asarray(ids, dtype=np.int64)
+        self._row_of = {int(assessment_id): row for row, assessment_id in enumerate(self.ids)}
+        self._id_order = np.argsort(self.ids, kind="stable")
+        self._sorted_ids = self.ids[self._id_order]
+    @classmethod
+    def from_files(cls, index_path=INDEX_PATH, texts_path=TEXTS_PATH, metadata_path=METADATA_PATH, use_hash=False):
+        paths = [index_path, texts_path, metadata_path]
+        if not all(map(os.path.exists, paths)):
+            raise FileNotFoundError("Required files not found in 'outputs/' folder.")
+        output_dir = os.path.dirname(index_path)
+        filter_path = os.path.join(output_dir, FILTER_INDEX_NAME)
+        id_map_path = os.path.join(output_dir, ID_MAP_NAME)
+        signature = file_signature(watched_paths(index_path, texts_path, metadata_path), use_hash)
+        index = open_index(index_path)
+        config = load_index_params(output_dir)
+        with open(texts_path, "r", encoding="utf-8") as f:
+            texts = json.load(f)
+        with open(metadata_path, "r", encoding="utf-8") as f:
+            metadata = json.load(f)
+        record_ids, vector_ids = load_id_map(id_map_path, len(metadata))
+        if config and config.get("kind") in RERANKED_KINDS and not isinstance(index, ShardedIndex):
+            index = RerankedIndex.open(index, os.path.join(output_dir, EMBEDDINGS_NAME), vector_ids)
+        if config and not isinstance(index, ShardedIndex):
+            apply_search_params(index, config.get("search"))
+        if record_ids is not None:
+            # Re-align texts with metadata rows; records that were skipped at embedding time get ""
+            text_of = dict(zip(vector_ids.tolist(), texts))
+            texts = [text_of.get(assessment_id, "") for assessment_id in record_ids.tolist()]
+        filter_index = load_filter_index(filter_path, len(metadata))
+        lexical = LexicalIndex.load(os.path.join(output_dir, LEXICAL_INDEX_NAME), len(metadata))
+        return cls.from_records(index, texts, metadata, signature, filter_index, record_ids, lexical)
+    @classmethod
+    def from_records(cls, index, texts, metadata, signature=None, filter_index=None, ids=None, lexical=None):
+        # Durations, test types and flags are parsed once here; filters and scoring only compare arrays
+        columns = typed_columns(metadata)
+        tenants, tenant_names = tenant_columns(metadata)
+        return cls(
+            index=index,
+            texts=texts,
+            names=[item.get("Assessment Name") or UNKNOWN_NAME for item in metadata],
+            urls=[item.get("URL", "N/A") for item in metadata],
+            durations=columns["duration_minutes"],
+            type_masks=columns["type_mask"],
+            remote=columns["remote"],
+            adaptive=columns["adaptive"],
+            signature=signature,
+            filter_index=filter_index,
+            ids=ids,
+            lexical=lexical,
+            tenants=tenants,
+            tenant_names=tenant_names,
+        )
+    @classmethod
+    def from_metadata(cls, index, texts, metadata, output_dir=os.path.dirname(INDEX_PATH)):
+        # A metadata list for an index the caller opened itself: rows are matched to the index labels through
+        # the id map written with them, as in from_files (positional only for legacy builds without one)
+        record_ids, vector_ids = load_id_map(os.path.join(output_dir, ID_MAP_NAME), len(metadata))
+        if record_ids is not None and texts is not None:
+            text_of = dict(zip(vector_ids.tolist(), texts))
+            texts = [text_of.get(assessment_id, "") for assessment_id in record_ids.tolist()]
+        return cls.from_records(index, texts, metadata, ids=record_ids)
+    def __len__(self):
+        return len(self.names)
+    def __getitem__(self, idx):
+        duration = int(self.durations[idx])
+        return {
+            "Assessment Name": self.names[idx],
+            "URL": self.urls[idx],
+            "Duration": duration if duration != NO_DURATION else None,
+            "Test Type": mask_to_types(int(self.type_masks[idx])),
+            "Remote Testing Support": "Yes" if self.remote[idx] else "No",
+            "Adaptive/IRT Support": "Yes" if self.adaptive[idx] else "No",
+            "Tenant": self.tenant_names[int(self.tenants[idx])],
+        }
+    def lexical_index(self):
+        # Built from texts and names on first use when no precomputed index was saved next to the FAISS index
+        if self.lexical is None:
+            self.lexical = LexicalIndex.build(self.texts or [""] * len(self), self.names)
+        return self.lexical
+    def lexical_search(self, query, k, rows=None):
+        # BM25 (scores, metadata rows), best first, restricted to rows when given
+        return self.lexical_index().search(query, k, rows)
+    def set_search_params(self, **search_params):
+        # Runtime recall/latency knobs, e.g. efSearch for HNSW or nprobe for IVF
+        if isinstance(self.index, ShardedIndex):
+            self.index.set_search_params(search_params)
+        else:
+            apply_search_params(self.index, search_params)
+    def row_for_id(self, assessment_id):
+        return self._row_of.get(int(assessment_id), -1)
+    def rows_for_ids(self, ids):
+        # Vectorized id -> metadata row; unknown ids (and FAISS's -1 padding) map to -1
+        ids = np.asarray(ids, dtype=np.int64)
+        if not len(self._sorted_ids):
+            return np.full(ids.shape, -1, dtype=np.int64)
+        pos = np.searchsorted(self._sorted_ids, ids).clip(0, len(self._sorted_ids) - 1)
+        return np.where(self._sorted_ids[pos] == ids, self._id_order[pos], -1)
+    def allowed_rows(self, max_duration=None, required_types=None, tenants=None):
+        # Metadata rows passing the hard filters, or None when nothing is filtered
+        if max_duration is None and not required_types and not tenants:
+            return None
+        fi = self.filter_index
+        allowed = np.ones(len(self), dtype=bool)
+        if max_duration is not None:
+            allowed[:] = False
+            end = np.searchsorted(fi["duration_sorted"], max_duration, side="right")
+            allowed[fi["duration_order"][:end]] = True
+        if required_types:
+            wanted = {str(t).lower() for t in required_types}
+            rows = [i for i, name in enumerate(fi["type_names"]) if name in wanted]
+            if rows:
+                bits = np.bitwise_or.reduce(fi["type_bitsets"][rows], axis=0)
+                allowed &= np.unpackbits(bits, count=len(self)).astype(bool)
+            else:
+                allowed[:] = False
+        if tenants:
+            codes = [code for code, name in enumerate(self.tenant_names) if name in set(tenants)]
+            allowed &= np.isin(self.tenants, codes)
+        return np.flatnonzero(allowed)
+    def search(self, query_vecs, k, rows=None):
+        # Searches only the given rows, so a tight filter still yields a full top-k; returns metadata rows
+        if rows is None:
+            D, I = self.index.search(query_vecs, k)
+            return D, self.rows_for_ids(I)
+        k = min(k, len(rows))
+        if k == 0:
+            return np.empty((len(query_vecs), 0), dtype=np.float32), np.empty((len(query_vecs), 0), dtype=np.int64)
+        if isinstance(self.index, (ShardedIndex, RerankedIndex)):
+            D, I = self.index.search(query_vecs, k, ids=self.ids[rows])
+        else:
+            D, I = search_ids(self.index, query_vecs, k, self.ids[rows])
+        return D, self.rows_for_ids(I)
+_catalogs = {}
+_catalog_lock = threading.Lock()
+def get_catalog(index_path=INDEX_PATH, texts_path=TEXTS_PATH, metadata_path=METADATA_PATH, use_hash=False):
+    # Returns the process-wide catalog, rebuilding it only when one of the files on disk has changed
+    key = (index_path, texts_path, metadata_path)
+    paths = list(key)
+    if not all(map(os.path.exists, paths)):
+        raise FileNotFoundError("Required files not found in 'outputs/' folder.")
+    signature = file_signature(watched_paths(index_path, texts_path, metadata_path), use_hash)
+    catalog = _catalogs.get(key)
+    if catalog is not None and (catalog.signature == signature or is_publishing(os.path.dirname(index_path))):
+        # Mid-publish the files on disk can be a mix of two builds, so the loaded catalog keeps serving
+        return catalog
+    with _catalog_lock:
+        catalog = _catalogs.get(key)
+        if catalog is None or catalog.signature != signature:
+            catalog = _load_consistent(index_path, texts_path, metadata_path, use_hash)
+            _catalogs[key] = catalog
+    return catalog
+def load_catalog(index_path=INDEX_PATH, texts_path=TEXTS_PATH, metadata_path=METADATA_PATH, use_hash=False):
+    # The startup bundle when it was built from exactly the files on disk, otherwise the files themselves
+    if USE_BUNDLE:
+        from startup_bundle import bundle_dir_for, is_current, open_bundle
+        bundle_dir = bundle_dir_for(index_path)
+        if is_current(bundle_dir, index_path, texts_path, metadata_path):
+            signature = file_signature(watched_paths(index_path, texts_path, metadata_path), use_hash)
+            try:
+                return open_bundle(bundle_dir, signature)
+            except (OSError, KeyError, ValueError, RuntimeError):
+                pass
+    return Catalog.from_files(index_path, texts_path, metadata_path, use_hash)
+def _load_consistent(index_path, texts_path, metadata_path, use_hash, attempts=20):
+    # A refresh replaces files one at a time; a load that overlapped a publish is retried
+    output_dir = os.path.dirname(index_path)
+    paths = watched_paths(index_path, texts_path, metadata_path)
+    for _ in range(attempts):
+        if not is_publishing(output_dir):
+            try:
+                catalog = load_catalog(index_path, texts_path, metadata_path, use_hash)
+            except RuntimeError:
+                # Shard workers came up on a shard set swapped in after its manifest was read
+                time.sleep(0.05)
+                continue
+            if not is_publishing(output_dir) and file_signature(paths, use_hash) == catalog.signature:
+                return catalog
+        time.sleep(0.05)
+    return Catalog.from_files(index_path, texts_path, metadata_path, use_hash)
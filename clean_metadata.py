@@ -1,49 +1,141 @@
-import json
-import re
-#Standardized test type categories
-STANDARD_TYPES = {
-    "cognitive": ["ability", "aptitude", "g+", "verify"],
-    "personality": ["personality", "behavior", "behaviour"],
-    "technical": ["knowledge", "skills", "developer", "engineering"],
-    "behavioral": ["competencies", "competency"],
-    "situational": ["situational judgement", "biodata"],
-    "simulation": ["simulation"],
-}
-def extract_duration(raw):
-    if raw is None:
-        return None
-    if isinstance(raw, int):
-        return raw
-    try:
-        match = re.search(r"(\d{1,3})\s*(min|minutes)?", str(raw).lower())
-        return int(match.group(1)) if match else None
-    except:
-        return None
-def map_test_types(raw):
-    if not raw:
-        return []
-    raw = raw.lower()
-    matched_types = set()
-    for standard, keywords in STANDARD_TYPES.items():
-        if any(keyword in raw for keyword in keywords):
-            matched_types.add(standard)
-    return sorted(list(matched_types))
-def clean_metadata(input_path="shl_metadata_index.json", output_path="shl_metadata_index_cleaned.json"):
-    with open(input_path, "r", encoding="utf-8") as f:
-        data = json.load(f)
-    cleaned_count = 0
-    for item in data:
-        raw_duration = item.get("Duration", "")
-        raw_type = item.get("Test Type", "")
-        cleaned_duration = extract_duration(raw_duration)
-        cleaned_types = map_test_types(raw_type)
-        item["Duration"] = cleaned_duration if cleaned_duration is not None else None
-        item["Test Type"] = cleaned_types if cleaned_types else []
-        if cleaned_duration or cleaned_types:
-            cleaned_count += 1
-    with open(output_path, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2, ensure_ascii=False)
-    print(f"Cleaned metadata saved to {output_path}")
-    print(f"Total records cleaned: {cleaned_count} / {len(data)}")
-if __name__ == "__main__":
-    clean_metadata()
+import json
+import re
+import numpy as np
+# pandas is imported inside the functions that build frames: the catalog imports this module for its
+# constants, and a catalog opened from the startup bundle never needs pandas at all
+#Standardized test type categories
+STANDARD_TYPES = {
+    "cognitive": ["ability", "aptitude", "g+", "verify"],
+    "personality": ["personality", "behavior", "behaviour"],
+    "technical": ["knowledge", "skills", "developer", "engineering"],
+    "behavioral": ["competencies", "competency"],
+    "situational": ["situational judgement", "biodata"],
+    "simulation": ["simulation"],
+}
+# Duration value stored for assessments without a known duration
+NO_DURATION = -1
+# One bit per standardized test type, in a fixed order so masks stay stable between builds
+TYPE_BITS = {name: 1 << i for i, name in enumerate(sorted(STANDARD_TYPES))}
+# Compiled once: one keyword alternation per standard type, applied to raw scraped type strings only.
+# Already-cleaned lists of standard names are looked up in TYPE_BITS instead ("behavioral" is not "behavior").
+TYPE_PATTERNS = {
+    standard: re.compile("|".join(re.escape(k) for k in keywords), re.I)
+    for standard, keywords in STANDARD_TYPES.items()
+}
+DURATION_PATTERN = re.compile(r"(\d+(?:\.\d+)?)\s*(?:min|minutes)?", re.I)
+# Name given to records scraped without one, e.g. from icon-only links
+UNKNOWN_NAME = "UNKNOWN"
+# Typed columns every cleaned frame must carry; "text" accepts object or string dtypes
+SCHEMA = {
+    "Assessment Name": "text",
+    "URL": "text",
+    "duration_minutes": "int32",
+    "type_mask": "uint16",
+    "remote": "bool",
+    "adaptive": "bool",
+}
+TYPED_COLUMNS = ("duration_minutes", "type_mask", "remote", "adaptive")
+def extract_duration(raw):
+    if raw is None or isinstance(raw, bool):
+        return None
+    if isinstance(raw, int):
+        return raw
+    if isinstance(raw, float):
+        return round(raw) if raw == raw else None
+    match = DURATION_PATTERN.search(str(raw))
+    return round(float(match.group(1))) if match else None
+def is_standard_types(raw):
+    return isinstance(raw, list) and all(str(t).strip().lower() in TYPE_BITS for t in raw)
+def map_test_types(raw):
+    if not raw:
+        return []
+    if is_standard_types(raw):
+        return sorted({str(t).strip().lower() for t in raw})
+    if isinstance(raw, list):
+        raw = ", ".join(map(str, raw))
+    return sorted(standard for standard, pattern in TYPE_PATTERNS.items() if pattern.search(raw))
+def _column(frame, name, default=None):
+    import pandas as pd
+    return frame[name] if name in frame else pd.Series(default, index=frame.index, dtype=object)
+def clean_frame(raw):
+    # One vectorized pass over all records: duration minutes, test-type bitmask and remote/adaptive flags
+    import pandas as pd
+    frame = raw.reset_index(drop=True).copy()
+    durations = _column(frame, "Duration")
+    as_text = durations.astype(str).where(durations.notna(), "")
+    # Free text contributes its first number; "1000.0" is 1000 minutes, not 100
+    minutes = pd.to_numeric(as_text.str.extract(DURATION_PATTERN, expand=False), errors="coerce")
+    frame["duration_minutes"] = minutes.round().fillna(NO_DURATION).astype(np.int32)
+    types = _column(frame, "Test Type")
+    standard = types.map(is_standard_types).to_numpy()
+    is_list = types.map(type).eq(list)
+    type_text = types.where(~is_list, types[is_list].map(lambda v: ", ".join(map(str, v)))).fillna("").astype(str)
+    type_mask = np.zeros(len(frame), dtype=np.uint16)
+    for name, pattern in TYPE_PATTERNS.items():
+        type_mask[~standard & type_text.str.contains(pattern).to_numpy()] |= TYPE_BITS[name]
+    for row in np.flatnonzero(standard):
+        for name in types.iat[row]:
+            type_mask[row] |= TYPE_BITS[str(name).strip().lower()]
+    frame["type_mask"] = type_mask
+    frame["remote"] = _column(frame, "Remote Testing Support").eq("Yes").to_numpy()
+    frame["adaptive"] = _column(frame, "Adaptive/IRT Support").eq("Yes").to_numpy()
+    if "Assessment Name" not in frame:
+        frame["Assessment Name"] = UNKNOWN_NAME
+    names = frame["Assessment Name"]
+    unnamed = names.isna() | names.astype(str).str.strip().eq("")
+    if unnamed.any():
+        print(f"Warning: {int(unnamed.sum())} record(s) without an assessment name kept as '{UNKNOWN_NAME}'.")
+        frame.loc[unnamed, "Assessment Name"] = UNKNOWN_NAME
+    if "URL" not in frame:
+        frame["URL"] = "N/A"
+    validate_schema(frame)
+    return frame
+def validate_schema(frame):
+    import pandas as pd
+    problems = []
+    for column, dtype in SCHEMA.items():
+        if column not in frame:
+            problems.append(f"missing column '{column}'")
+        elif dtype == "text":
+            if not pd.api.types.is_string_dtype(frame[column]) and frame[column].dtype != object:
+                problems.append(f"column '{column}' is {frame[column].dtype}, expected text")
+        elif str(frame[column].dtype) != dtype:
+            problems.append(f"column '{column}' is {frame[column].dtype}, expected {dtype}")
+    if not problems:
+        if (frame["duration_minutes"] < NO_DURATION).any():
+            problems.append("negative durations")
+        if (frame["type_mask"] >= 1 << len(TYPE_BITS)).any():
+            problems.append("unknown test-type bits")
+        names = frame["Assessment Name"]
+        if names.isna().any() or names.astype(str).str.strip().eq("").any():
+            problems.append("records without an assessment name")
+    if problems:
+        raise ValueError(f"Cleaned metadata does not match the schema: {'; '.join(problems)}.")
+def typed_columns(records):
+    # Typed arrays for a list of (raw or cleaned) records, as used by the resident catalog
+    frame = clean_frame(_frame(list(records)))
+    return {column: frame[column].to_numpy() for column in TYPED_COLUMNS}
+def to_records(frame):
+    # Back to the cleaned JSON layout: integer minutes or null, and a sorted list of standard types
+    import pandas as pd
+    names_for_mask = [[name for name, bit in TYPE_BITS.items() if mask & bit] for mask in range(1 << len(TYPE_BITS))]
+    out = frame.drop(columns=list(TYPED_COLUMNS)).astype(object)
+    out = out.where(out.notna(), None)
+    out["Duration"] = pd.Series([int(d) if d != NO_DURATION else None for d in frame["duration_minutes"]], dtype=object)
+    out["Test Type"] = pd.Series([names_for_mask[m] for m in frame["type_mask"]], dtype=object)
+    return out.to_dict("records")
+def _frame(records):
+    import pandas as pd
+    return pd.DataFrame(records)
+def clean_records(records):
+    return to_records(clean_frame(_frame(records)))
+def clean_metadata(input_path="shl_metadata_index.json", output_path="shl_metadata_index_cleaned.json"):
+    with open(input_path, "r", encoding="utf-8") as f:
+        frame = clean_frame(_frame(json.load(f)))
+    cleaned_count = int(((frame["duration_minutes"] > 0) | (frame["type_mask"] > 0)).sum())
+    with open(output_path, "w", encoding="utf-8") as f:
+        json.dump(to_records(frame), f, indent=2, ensure_ascii=False)
+    print(f"Cleaned metadata saved to {output_path}")
+    print(f"Total records cleaned: {cleaned_count} / {len(frame)}")
+if __name__ == "__main__":
+    clean_metadata()
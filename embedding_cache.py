@@ -0,0 +1,117 @@
+import os
+import re
+import time
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+import numpy as np
+_whitespace = re.compile(r"\s+")
+def normalize_query(text):
+    # Pasted job descriptions differ mostly in unicode forms and whitespace, not content
+    return _whitespace.sub(" ", unicodedata.normalize("NFKC", text or "")).strip()
+def cache_key(text, instruction, model_id):
+    raw = "\x00".join([model_id, instruction, normalize_query(text)])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+class EmbeddingCache:
+    # Bounded in-memory LRU with TTL, optionally backed by a SQLite file that survives restarts
+    # and can be shared by several worker processes (WAL mode allows concurrent readers).
+    def __init__(self, max_entries=1024, ttl_seconds=24 * 3600, persist_path=None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.persist_path = persist_path
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        self.counters = {"hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0, "expirations": 0}
+        if persist_path:
+            self._open_db(persist_path)
+    def _open_db(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, created REAL NOT NULL, dtype TEXT NOT NULL, vector BLOB NOT NULL)"
+        )
+        self._db.commit()
+    def _expired(self, created, now):
+        return self.ttl_seconds is not None and now - created > self.ttl_seconds
+    def _remember(self, key, created, vector):
+        self._entries[key] = (created, vector)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.counters["evictions"] += 1
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if not self._expired(entry[0], now):
+                    self._entries.move_to_end(key)
+                    self.counters["hits"] += 1
+                    return entry[1]
+                del self._entries[key]
+                self.counters["expirations"] += 1
+            if self._db is not None:
+                row = self._db.execute("SELECT created, dtype, vector FROM embeddings WHERE key = ?", (key,)).fetchone()
+                if row is not None and not self._expired(row[0], now):
+                    vector = np.frombuffer(row[2], dtype=row[1])
+                    self._remember(key, row[0], vector)
+                    self.counters["disk_hits"] += 1
+                    return vector
+            self.counters["misses"] += 1
+            return None
+    def put(self, key, vector):
+        created = time.time()
+        vector = np.ascontiguousarray(vector).copy()
+        vector.setflags(write=False)
+        with self._lock:
+            self._remember(key, created, vector)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO embeddings (key, created, dtype, vector) VALUES (?, ?, ?, ?)",
+                    (key, created, vector.dtype.str, vector.tobytes()),
+                )
+                self._db.commit()
+    def purge_expired(self):
+        if self.ttl_seconds is None:
+            return
+        cutoff = time.time() - self.ttl_seconds
+        with self._lock:
+            for key in [k for k, (created, _) in self._entries.items() if created < cutoff]:
+                del self._entries[key]
+                self.counters["expirations"] += 1
+            if self._db is not None:
+                self._db.execute("DELETE FROM embeddings WHERE created < ?", (cutoff,))
+                self._db.commit()
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM embeddings")
+                self._db.commit()
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats["entries"] = len(self._entries)
+        lookups = stats["hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = round((stats["hits"] + stats["disk_hits"]) / lookups, 4) if lookups else None
+        return stats
+_cache = None
+_cache_lock = threading.Lock()
+def get_cache():
+    # Process-wide query cache configured from the environment; set SHL_EMBED_CACHE_DB
+    # (e.g. outputs/query_embeddings.sqlite) to enable the persistent tier
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            ttl = float(os.environ.get("SHL_EMBED_CACHE_TTL", 24 * 3600))
+            _cache = EmbeddingCache(
+                max_entries=int(os.environ.get("SHL_EMBED_CACHE_SIZE", 1024)),
+                ttl_seconds=ttl if ttl > 0 else None,
+                persist_path=os.environ.get("SHL_EMBED_CACHE_DB") or None,
+            )
+    return _cache
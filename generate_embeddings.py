@@ -1,73 +1,237 @@
-import os
-import json
-import numpy as np
-import faiss
-from datetime import datetime
-from InstructorEmbedding import INSTRUCTOR
-import torch
-def log(msg):
-    print(f"[{datetime.now().strftime('%H:%M:%S')}] {msg}")
-def load_assessments(json_path):
-    log("Loading cleaned SHL assessment metadata...")
-    with open(json_path, "r", encoding="utf-8") as f:
-        assessments = json.load(f)
-    log(f"Loaded {len(assessments)} assessments.")
-    return assessments
-def create_textual_representation(item):
-    try:
-        return (
-            f"{item['Assessment Name']} | "
-            f"Standard Type: {item.get('Standardized Test Type', 'unknown')} | "
-            f"Original Type: {item.get('Test Type', 'N/A')} | "
-            f"Duration: {item.get('Duration', 'N/A')} mins | "
-            f"Remote: {item.get('Remote Testing Support', 'N/A')} | "
-            f"Adaptive: {item.get('Adaptive/IRT Support', 'N/A')}"
-        )
-    except KeyError as e:
-        log(f"Warning: Missing key {e} in item: {item}")
-        return ""
-def prepare_texts(assessments):
-    log("Preparing textual representations for embedding...")
-    texts = [create_textual_representation(a) for a in assessments]
-    texts = [t for t in texts if t.strip()]
-    log(f"Prepared {len(texts)} valid texts.")
-    return texts
-def embed_texts_instructor(texts, device="cpu"):
-    log(f"Loading instructor-xl on {device}...")
-    model = INSTRUCTOR("hkunlp/instructor-xl")
-    model.to(device)
-    instruction = "Represent the task: retrieve relevant assessments based on this job description"
-    input_pairs = [[instruction, text] for text in texts]
-    log("Encoding all assessments with Instructor XL...")
-    embeddings = model.encode(
-        input_pairs,
-        show_progress_bar=True,
-        convert_to_numpy=True,
-        device=device
-    )
-    log(f"Generated {len(embeddings)} embeddings.")
-    return embeddings
-def save_outputs(embeddings, texts, output_dir="outputs"):
-    os.makedirs(output_dir, exist_ok=True)
-    np.save(os.path.join(output_dir, "assessment_embeddings.npy"), embeddings)
-    with open(os.path.join(output_dir, "assessment_texts.json"), "w", encoding="utf-8") as f:
-        json.dump(texts, f, indent=2, ensure_ascii=False)
-    log("Embeddings and texts saved.")
-def save_faiss_index(embeddings, output_dir="outputs"):
-    log("Fitting FAISS index...")
-    dim = embeddings.shape[1]
-    faiss.normalize_L2(embeddings)
-    index = faiss.IndexFlatL2(dim)
-    index.add(embeddings)
-    faiss.write_index(index, os.path.join(output_dir, "faiss_index.idx"))
-    log("FAISS index saved.")
-if __name__ == "__main__":
-    # Automatically fallback to CPU if CUDA isn't available
-    device = "cuda" if torch.cuda.is_available() else "cpu"
-    json_input_path = "shl_metadata_index_cleaned.json"  # Use cleaned metadata
-    assessments = load_assessments(json_input_path)
-    texts = prepare_texts(assessments)
-    embeddings = embed_texts_instructor(texts, device=device)
-    save_outputs(embeddings, texts)
-    save_faiss_index(embeddings)
-    log("[✓] All done! Embedding pipeline complete.")
+import os
+import json
+import argparse
+import hashlib
+import numpy as np
+import faiss
+from datetime import datetime
+import model_service
+from index_factory import (
+    INDEX_KINDS, build_index, index_memory_bytes, load_index_params, read_index, save_index_params, supports_in_place_update,
+    write_index,
+)
+from catalog import (
+    DEFAULT_TENANT, Catalog, FILTER_INDEX_NAME, ID_MAP_NAME, METADATA_PATH, assessment_id, build_filter_index,
+    file_signature, write_filter_index, write_id_map,
+)
+from clean_metadata import clean_records
+from sharded_search import SHARD_BY, SHARDS_DIR_NAME, write_shards
+from lexical_index import LEXICAL_INDEX_NAME, LexicalIndex
+from startup_bundle import build_bundle
+MANIFEST_NAME = "embedding_manifest.json"
+def log(msg):
+    print(f"[{datetime.now().strftime('%H:%M:%S')}] {msg}")
+def load_assessments(json_path):
+    log("Loading cleaned SHL assessment metadata...")
+    with open(json_path, "r", encoding="utf-8") as f:
+        assessments = json.load(f)
+    log(f"Loaded {len(assessments)} assessments.")
+    return assessments
+def merge_libraries(assessments, libraries):
+    # libraries: tenant name -> path of that tenant's assessment records (raw or cleaned). A tenant's previous
+    # records are replaced, so re-running with the same library is idempotent. The merged catalog is published
+    # together with the index it was embedded into (see save_metadata).
+    for tenant, path in libraries.items():
+        if tenant == DEFAULT_TENANT:
+            raise ValueError(f"'{DEFAULT_TENANT}' is the SHL catalog itself; give the library another tenant name.")
+        with open(path, "r", encoding="utf-8") as f:
+            records = clean_records(json.load(f))
+        assessments = [a for a in assessments if (a.get("Tenant") or DEFAULT_TENANT) != tenant]
+        assessments += [dict(record, Tenant=tenant) for record in records]
+        log(f"Merged {len(records)} assessments from the '{tenant}' library.")
+    return assessments
+def save_metadata(assessments, output_dir, json_path=METADATA_PATH):
+    with open(os.path.join(output_dir, os.path.basename(json_path)), "w", encoding="utf-8") as f:
+        json.dump(assessments, f, indent=2, ensure_ascii=False)
+def create_textual_representation(item):
+    try:
+        return (
+            f"{item['Assessment Name']} | "
+            f"Standard Type: {item.get('Standardized Test Type', 'unknown')} | "
+            f"Original Type: {item.get('Test Type', 'N/A')} | "
+            f"Duration: {item.get('Duration', 'N/A')} mins | "
+            f"Remote: {item.get('Remote Testing Support', 'N/A')} | "
+            f"Adaptive: {item.get('Adaptive/IRT Support', 'N/A')}"
+        )
+    except KeyError as e:
+        log(f"Warning: Missing key {e} in item: {item}")
+        return ""
+def prepare_texts(assessments):
+    # Returns the non-empty texts together with the stable assessment id of each one,
+    # so skipped records no longer shift the FAISS rows of everything after them
+    log("Preparing textual representations for embedding...")
+    texts, ids = [], []
+    for a in assessments:
+        text = create_textual_representation(a)
+        if text.strip():
+            texts.append(text)
+            ids.append(assessment_id(a))
+    if len(set(ids)) != len(ids):
+        log("Warning: duplicate assessment URLs found; later entries will shadow earlier ones.")
+    log(f"Prepared {len(texts)} valid texts.")
+    return texts, ids
+def embed_texts_instructor(texts, device="cpu"):
+    model_service.get_model(device)
+    log(f"Encoding {len(texts)} assessments with Instructor XL...")
+    embeddings = model_service.encode(texts, device=device, show_progress_bar=True)
+    log(f"Generated {len(embeddings)} embeddings.")
+    return embeddings
+def text_hash(text, model_name=None, instruction=None):
+    # A stored vector is only reusable for the same text, model and instruction
+    raw = "\x00".join([model_name or model_service.model_id(), instruction or model_service.INSTRUCTION, text])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+def load_manifest(output_dir="outputs"):
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    embeddings_path = os.path.join(output_dir, "assessment_embeddings.npy")
+    if not (os.path.exists(manifest_path) and os.path.exists(embeddings_path)):
+        return None
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    manifest["vectors"] = np.load(embeddings_path)
+    if len(manifest["hashes"]) != len(manifest["vectors"]):
+        log("Warning: manifest does not match stored embeddings; ignoring it.")
+        return None
+    return manifest
+def embed_texts_incremental(texts, ids, device="cpu", output_dir="outputs", full=False):
+    hashes = [text_hash(t) for t in texts]
+    manifest = None if full else load_manifest(output_dir)
+    previous = dict(zip(manifest["hashes"], manifest["vectors"])) if manifest else {}
+    missing = [i for i, h in enumerate(hashes) if h not in previous]
+    log(f"Reusing {len(texts) - len(missing)} stored embeddings; {len(missing)} new or changed texts to embed.")
+    fresh = embed_texts_instructor([texts[i] for i in missing], device=device) if missing else []
+    fresh = dict(zip(missing, fresh))
+    embeddings = np.stack([fresh[i] if i in fresh else previous[h] for i, h in enumerate(hashes)]).astype(np.float32)
+    # Id-level diff against the previous build, used to patch the FAISS index in place
+    changes = None
+    if manifest and manifest.get("ids"):
+        previous_hash_of = dict(zip(manifest["ids"], manifest["hashes"]))
+        current_hash_of = dict(zip(ids, hashes))
+        changes = {
+            "remove": [i for i, h in previous_hash_of.items() if current_hash_of.get(i) != h],
+            "add": [row for row, (i, h) in enumerate(zip(ids, hashes)) if previous_hash_of.get(i) != h],
+        }
+        log(f"Index changes: {len(changes['add'])} to add, {len(changes['remove'])} to remove.")
+    return embeddings, hashes, changes
+def save_manifest(ids, hashes, output_dir="outputs"):
+    manifest = {
+        "model": model_service.model_id(),
+        "instruction": model_service.INSTRUCTION,
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "ids": ids,
+        "hashes": hashes,
+    }
+    with open(os.path.join(output_dir, MANIFEST_NAME), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    log("Embedding manifest saved.")
+def save_outputs(embeddings, texts, output_dir="outputs"):
+    os.makedirs(output_dir, exist_ok=True)
+    np.save(os.path.join(output_dir, "assessment_embeddings.npy"), embeddings)
+    with open(os.path.join(output_dir, "assessment_texts.json"), "w", encoding="utf-8") as f:
+        json.dump(texts, f, indent=2, ensure_ascii=False)
+    log("Embeddings and texts saved.")
+def save_faiss_index(embeddings, ids, output_dir="outputs", changes=None, kind="flat", build_params=None, search_params=None,
+                     source_dir=None):
+    # source_dir holds the published index that is patched; the result goes to output_dir (normally a staging
+    # directory), because serving processes mmap the published file and must never see it rewritten
+    source_dir = source_dir or output_dir
+    source_path = os.path.join(source_dir, "faiss_index.idx")
+    ids = np.asarray(ids, dtype=np.int64)
+    faiss.normalize_L2(embeddings)
+    previous = load_index_params(source_dir)
+    index = None
+    # Patch the existing index only when it was built with the same configuration and can drop vectors
+    if (changes is not None and os.path.exists(source_path) and previous and previous["kind"] == kind
+            and previous.get("metric") == "ip" and not build_params):
+        index = read_index(source_path)
+        if index.d != embeddings.shape[1] or not supports_in_place_update(index):
+            index = None
+    if index is not None:
+        log("Updating FAISS index in place...")
+        if changes["remove"]:
+            index.remove_ids(np.asarray(changes["remove"], dtype=np.int64))
+        if changes["add"]:
+            index.add_with_ids(embeddings[changes["add"]], ids[changes["add"]])
+        if index.ntotal != len(ids):
+            log("Warning: in-place update left the index out of sync; rebuilding.")
+            index = None
+        config = dict(previous, search=dict(previous["search"], **(search_params or {})))
+    if index is None:
+        log(f"Fitting FAISS index ({kind})...")
+        index, config = build_index(embeddings, ids, kind, build_params, search_params)
+    write_index(index, os.path.join(output_dir, "faiss_index.idx"))
+    save_index_params(config, output_dir)
+    log(f"FAISS index saved ({config['factory']}, {index_memory_bytes(index) / 1e6:.1f} MB).")
+def save_shards(embeddings, ids, assessments, n_shards, by="hash", output_dir="outputs", kind="flat", build_params=None,
+                search_params=None):
+    # Split copies of the full index; tagged with its signature so a later rebuild makes them stale
+    tenant_of = {assessment_id(a): a.get("Tenant") or DEFAULT_TENANT for a in assessments}
+    tenants = [tenant_of.get(i, DEFAULT_TENANT) for i in ids]
+    source = list(file_signature([os.path.join(output_dir, "faiss_index.idx")])[0])
+    log(f"Splitting the FAISS index into {n_shards} shards by {by}...")
+    write_shards(embeddings, ids, tenants, os.path.join(output_dir, SHARDS_DIR_NAME), n_shards, by, kind,
+                 build_params, search_params, source, "assessment_embeddings.npy")
+def save_id_map(assessments, ids, output_dir="outputs"):
+    write_id_map([assessment_id(a) for a in assessments], ids, os.path.join(output_dir, ID_MAP_NAME))
+    log("Id map saved.")
+def save_filter_index(assessments, output_dir="outputs"):
+    log("Building duration/test-type filter index...")
+    columns = Catalog.from_records(None, None, assessments)
+    filter_index = build_filter_index(columns.durations, columns.type_masks)
+    write_filter_index(filter_index, os.path.join(output_dir, FILTER_INDEX_NAME))
+    log("Filter index saved.")
+def save_lexical_index(assessments, texts, ids, output_dir="outputs"):
+    # BM25 postings are keyed by metadata row, like the filter index, so texts are re-aligned by id first
+    log("Building BM25 lexical index...")
+    text_of = dict(zip(ids, texts))
+    row_texts = [text_of.get(assessment_id(a), "") for a in assessments]
+    names = [a.get("Assessment Name", "") for a in assessments]
+    LexicalIndex.build(row_texts, names).save(os.path.join(output_dir, LEXICAL_INDEX_NAME))
+    log("Lexical index saved.")
+def parse_index_params(pairs):
+    params = {}
+    for pair in pairs or []:
+        key, _, value = pair.partition("=")
+        params[key] = int(value) if value.isdigit() else value
+    return params
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Embed the cleaned SHL catalog and build the FAISS index.")
+    parser.add_argument("--full", action="store_true", help="re-embed every assessment instead of only new or changed ones")
+    parser.add_argument("--index", default="flat", choices=INDEX_KINDS, help="FAISS index type")
+    parser.add_argument("--build-param", action="append", metavar="KEY=VALUE", help="index build parameter, e.g. M=32, nlist=64, m=48, nbits=8")
+    parser.add_argument("--library", action="append", metavar="TENANT=PATH", help="merge a tenant's assessment library into the catalog")
+    parser.add_argument("--shards", type=int, default=0, help="also split the index into this many shards (searched with SHL_SHARDS)")
+    parser.add_argument("--shard-by", default="hash", choices=SHARD_BY, help="spread vectors by id hash or keep each tenant together")
+    parser.add_argument("--search-param", action="append", metavar="KEY=VALUE", help="saved search knob, e.g. efSearch=128 or nprobe=16")
+    args = parser.parse_args()
+    # Automatically fallback to CPU if CUDA isn't available
+    device = model_service.default_device()
+    json_input_path = METADATA_PATH  # Use cleaned metadata
+    assessments = load_assessments(json_input_path)
+    if args.library:
+        assessments = merge_libraries(assessments, dict(pair.split("=", 1) for pair in args.library))
+    texts, ids = prepare_texts(assessments)
+    # Only new or changed texts are re-embedded unless --full is given
+    embeddings, hashes, changes = embed_texts_incremental(texts, ids, device=device, full=args.full)
+    # Every output is written to a staging directory and swapped in as one set, as the refresh pipeline does;
+    # imported here because refresh_pipeline itself imports this module
+    from refresh_pipeline import STAGING_DIR, publish, reset_staging
+    reset_staging(STAGING_DIR)
+    save_outputs(embeddings, texts, STAGING_DIR)
+    save_faiss_index(
+        embeddings, ids, STAGING_DIR, changes=changes, kind=args.index,
+        build_params=parse_index_params(args.build_param),
+        search_params=parse_index_params(args.search_param),
+        source_dir="outputs",
+    )
+    save_filter_index(assessments, STAGING_DIR)
+    save_lexical_index(assessments, texts, ids, STAGING_DIR)
+    save_id_map(assessments, ids, STAGING_DIR)
+    save_manifest(ids, hashes, STAGING_DIR)
+    save_metadata(assessments, STAGING_DIR, json_input_path)
+    publish(STAGING_DIR, metadata_path=json_input_path)
+    if args.shards:
+        save_shards(embeddings, ids, assessments, args.shards, args.shard_by, kind=args.index,
+                    build_params=parse_index_params(args.build_param), search_params=parse_index_params(args.search_param))
+    # Serving processes open this instead of re-parsing the JSON files
+    build_bundle()
+    log("[✓] All done! Embedding pipeline complete.")
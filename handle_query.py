@@ -1,88 +1,196 @@
-import os
-import json
-import numpy as np
-import trafilatura
-import faiss
-from InstructorEmbedding import INSTRUCTOR
-import torch
-def extract_text_from_url(url):
-    downloaded = trafilatura.fetch_url(url)
-    return trafilatura.extract(downloaded) if downloaded else ""
-def load_index_and_metadata(index_path, texts_path, metadata_path):
-    if not all(map(os.path.exists, [index_path, texts_path, metadata_path])):
-        raise FileNotFoundError("Required files not found in 'outputs/' folder.")
-    index = faiss.read_index(index_path)
-    with open(texts_path, "r", encoding="utf-8") as f:
-        texts = json.load(f)
-    with open(metadata_path, "r", encoding="utf-8") as f:
-        metadata = json.load(f)
-    return index, texts, metadata
-def embed_query_instructor(query, device="cpu"):
-    model = INSTRUCTOR("hkunlp/instructor-xl")
-    model.to(device)
-    instruction = "Represent the task: retrieve relevant assessments based on this job description"
-    embedding = model.encode([[instruction, query]], convert_to_numpy=True, device=device)
-    faiss.normalize_L2(embedding)
-    return embedding
-def parse_duration(duration_str):
-    if not duration_str:
-        return None
-    try:
-        digits = ''.join(filter(str.isdigit, str(duration_str)))
-        return int(digits) if digits else None
-    except:
-        return None
-def search_similar_fuzzy(query_vector, index, metadata, top_k=10, max_duration=None, required_types=None, type_penalty=0.8):
-    D, I = index.search(query_vector, top_k * 5)
-    candidates = []
-    for idx, score in zip(I[0], D[0]):
-        item = metadata[idx]
-        name = item.get("Assessment Name", "UNKNOWN")
-        url = item.get("URL", "N/A")
-        duration = parse_duration(item.get("Duration", ""))
-        std_type = item.get("Standardized Test Type", "").lower()  # using cleaned field
-        if max_duration is not None and (duration is None or duration > max_duration):
-            continue
-        # Calculate raw similarity (lower FAISS L2 means higher similarity)
-        similarity = 1 - score
-        if required_types:
-            if not any(req.lower() in std_type for req in required_types):
-                similarity *= type_penalty
-        candidates.append((name, url, similarity))
-    # Sort candidates by adjusted similarity (descending)
-    candidates.sort(key=lambda x: x[2], reverse=True)
-    return candidates[:top_k]
-if __name__ == "__main__":
-    print("=== SHL Assessment Recommender ===")
-    user_input = input("Enter a job description or a URL: ").strip()
-    if user_input.startswith("http"):
-        print("Extracting content from URL...")
-        text = extract_text_from_url(user_input)
-        if not text:
-            print("Failed to extract content from URL.")
-            exit()
-    else:
-        text = user_input
-    print("Embedding your query...")
-    device = "cuda" if torch.cuda.is_available() else "cpu"
-    query_vec = embed_query_instructor(text, device=device)
-    print("Loading SHL assessment data...")
-    # Make sure to load cleaned metadata here!
-    index, texts, metadata = load_index_and_metadata(
-        "outputs/faiss_index.idx",
-        "outputs/assessment_texts.json",
-        "shl_metadata_index_cleaned.json"
-    )
-    print("Finding top relevant assessments...")
-    filtered_results = search_similar_fuzzy(
-        query_vec,
-        index,
-        metadata,
-        top_k=10,
-        max_duration=45,
-        required_types=["technical", "cognitive", "personality"]  # required types as needed
-    )
-    print("\nTop Matches:")
-    for name, url, score in filtered_results:
-        print(f"- {name} (Adjusted Similarity: {score:.4f})")
-        print(f"  {url}\n")
+import os
+import threading
+import numpy as np
+from concurrent.futures import TimeoutError as FutureTimeoutError
+import model_service
+import telemetry
+from catalog import Catalog, get_catalog
+from scoring import apply_type_penalty, reciprocal_rank_fusion, score_candidates
+from micro_batcher import MicroBatcher
+from embedding_cache import cache_key, get_cache, normalize_query
+from url_ingest import get_ingestor
+# Fuse BM25 with the dense ranking unless a query's filters say otherwise
+HYBRID = os.environ.get("SHL_HYBRID", "1") != "0"
+def extract_text_from_url(url, timeout=30):
+    # Fetched on the shared ingestion pool; repeat URLs are served from its extracted-text cache
+    with telemetry.stage("fetch"):
+        try:
+            return get_ingestor().submit(url).result(timeout=timeout)
+        except FutureTimeoutError:
+            telemetry.inc("fetch_timeouts_total")
+            return ""
+def load_index_and_metadata(index_path, texts_path, metadata_path):
+    # Served from the resident catalog; files are only re-read when they change on disk
+    with telemetry.stage("load_catalog"):
+        catalog = get_catalog(index_path, texts_path, metadata_path)
+    return catalog.index, catalog.texts, catalog
+def embed_query_instructor(query, device="cpu"):
+    return embed_queries_instructor([query], device=device)
+@telemetry.timed("embed")
+def embed_queries_instructor(queries, device="cpu"):
+    # Repeat queries come from the embedding cache; the rest share one encode call
+    cache = get_cache()
+    texts = [normalize_query(q) for q in queries]
+    keys = [cache_key(t, model_service.INSTRUCTION, model_service.model_id()) for t in texts]
+    vectors = [cache.get(key) for key in keys]
+    pending = {}
+    for i, vector in enumerate(vectors):
+        if vector is None:
+            pending.setdefault(keys[i], []).append(i)
+    telemetry.inc("embed_cache_hits_total", len(queries) - sum(map(len, pending.values())))
+    telemetry.inc("embed_cache_misses_total", sum(map(len, pending.values())))
+    if pending:
+        rows = [positions[0] for positions in pending.values()]
+        with telemetry.stage("encode"):
+            embeddings = model_service.encode([texts[i] for i in rows], device=device)
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        embeddings /= np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+        for (key, positions), vector in zip(pending.items(), embeddings):
+            cache.put(key, vector)
+            for i in positions:
+                vectors[i] = vector
+    return np.stack(vectors).astype(np.float32)
+# Every ranker returns (name, url, score, similarity) tuples in descending score order. score is what the list
+# is ranked by; similarity is the (type-adjusted) cosine, or None when the query has no vector yet.
+def rank_candidates(scores, rows, catalog, top_k=10, required_types=None, type_penalty=0.8):
+    # rows come from a duration-prefiltered search, so only the soft type penalty is applied here
+    rows, similarities = score_candidates(scores, rows, catalog, top_k, required_types, type_penalty)
+    return [(catalog.names[row], catalog.urls[row], float(sim), float(sim)) for row, sim in zip(rows, similarities)]
+def hybrid_rank(scores, rows, query_vector, query_text, catalog, top_k=10, required_types=None, type_penalty=0.8, allowed=None):
+    # Dense and BM25 candidates over the same eligible rows, fused by reciprocal rank. The score is the fused
+    # RRF score; rows only the lexical side found get their cosine from a search restricted to them.
+    dense_rows, dense_sims = score_candidates(scores, rows, catalog, len(rows), required_types, type_penalty)
+    with telemetry.stage("lexical"):
+        lexical_scores, lexical_rows = catalog.lexical_search(query_text, len(rows), allowed)
+    lexical_scores = apply_type_penalty(lexical_scores, lexical_rows, catalog, required_types, type_penalty)
+    lexical_rows = lexical_rows[np.argsort(-lexical_scores, kind="stable")]
+    fused_rows, fused_scores = reciprocal_rank_fusion([dense_rows, lexical_rows])
+    fused_rows, fused_scores = fused_rows[:top_k].tolist(), fused_scores[:top_k].tolist()
+    similarity = dict(zip(dense_rows.tolist(), dense_sims.tolist()))
+    missing = np.array([row for row in fused_rows if row not in similarity], dtype=np.int64)
+    if len(missing):
+        D, I = catalog.search(np.asarray(query_vector, dtype=np.float32).reshape(1, -1), len(missing), missing)
+        similarity.update(zip(*(a.tolist() for a in score_candidates(D[0], I[0], catalog, len(missing), required_types, type_penalty))))
+    return [(catalog.names[row], catalog.urls[row], float(score), float(similarity.get(row, 0.0)))
+            for row, score in zip(fused_rows, fused_scores)]
+def lexical_rank(query_text, catalog, top_k=10, required_types=None, type_penalty=0.8, allowed=None):
+    # BM25-only ranking for when no query vector is available yet; scores are relative to the best match
+    with telemetry.stage("lexical"):
+        scores, rows = catalog.lexical_search(query_text, top_k * 5, allowed)
+    scores = apply_type_penalty(scores, rows, catalog, required_types, type_penalty)
+    order = np.argsort(-scores, kind="stable")[:top_k]
+    top = float(scores[order[0]]) if len(order) else 1.0
+    return [(catalog.names[row], catalog.urls[row], float(score) / top, None) for row, score in zip(rows[order], scores[order])]
+def search_similar_fuzzy(query_vector, index, metadata, top_k=10, max_duration=None, required_types=None, type_penalty=0.8,
+                         query_text=None, tenants=None):
+    # With query_text the dense results are fused with BM25 matches on the same text; tenants is a hard filter
+    catalog = metadata if isinstance(metadata, Catalog) else Catalog.from_metadata(index, None, metadata)
+    with telemetry.stage("filter"):
+        allowed = catalog.allowed_rows(max_duration, tenants=tenants)
+    with telemetry.stage("search"):
+        D, I = catalog.search(query_vector, top_k * 5, allowed)
+    with telemetry.stage("rerank"):
+        if query_text:
+            return hybrid_rank(D[0], I[0], query_vector, query_text, catalog, top_k, required_types, type_penalty, allowed)
+        return rank_candidates(D[0], I[0], catalog, top_k, required_types, type_penalty)
+def recommend_batch(queries, filters=None, top_k=10, device=None, catalog=None, traces=None):
+    # filters: one dict shared by all queries or a list with one dict per query;
+    # recognised keys are max_duration, tenants, required_types, type_penalty, top_k and hybrid.
+    # max_duration and tenants are hard filters; required_types only penalizes mismatches.
+    # traces: optional telemetry.Trace per query; shared stages are recorded into every trace of the
+    # queries they served, per-query ranking only into that query's trace.
+    if not queries:
+        return []
+    if filters is None or isinstance(filters, dict):
+        filters = [filters or {}] * len(queries)
+    if len(filters) != len(queries):
+        raise ValueError("filters must be a dict or a list with one entry per query.")
+    traces = traces or [None] * len(queries)
+    telemetry.inc("batches_total")
+    with telemetry.activate(traces):
+        with telemetry.stage("load_catalog"):
+            catalog = catalog or get_catalog()
+        # While a warm-up is still loading the model, answer from the lexical index instead of blocking on it
+        lexical_only = model_service.is_warming_up(device)
+        query_vecs = None if lexical_only else embed_queries_instructor(queries, device=device)
+    # Queries sharing their hard filters share one search call over the same eligible rows
+    groups = {}
+    for i, f in enumerate(filters):
+        groups.setdefault((f.get("max_duration"), tuple(sorted(f.get("tenants") or ()))), []).append(i)
+    results = [None] * len(queries)
+    for (max_duration, tenants), members in groups.items():
+        fetch_k = max(filters[i].get("top_k", top_k) for i in members) * 5
+        with telemetry.activate([traces[i] for i in members]):
+            with telemetry.stage("filter"):
+                allowed = catalog.allowed_rows(max_duration, tenants=tenants)
+            if not lexical_only:
+                with telemetry.stage("search"):
+                    D, I = catalog.search(query_vecs[members], fetch_k, allowed)
+        for j, i in enumerate(members):
+            f = filters[i]
+            options = dict(top_k=f.get("top_k", top_k), required_types=f.get("required_types"), type_penalty=f.get("type_penalty", 0.8))
+            mode = "lexical" if lexical_only else "hybrid" if f.get("hybrid", HYBRID) else "dense"
+            telemetry.inc("queries_total", mode=mode)
+            with telemetry.activate([traces[i]]), telemetry.stage("rerank"):
+                if mode == "lexical":
+                    results[i] = lexical_rank(queries[i], catalog, allowed=allowed, **options)
+                elif mode == "hybrid":
+                    results[i] = hybrid_rank(D[j], I[j], query_vecs[i], queries[i], catalog, allowed=allowed, **options)
+                else:
+                    results[i] = rank_candidates(D[j], I[j], catalog, **options)
+    return results
+_batcher = None
+_batcher_lock = threading.Lock()
+def get_batcher(max_batch_size=None, max_wait_ms=None):
+    # Process-wide micro-batcher so concurrent sessions share model.encode and index.search calls
+    global _batcher
+    with _batcher_lock:
+        if _batcher is None:
+            _batcher = MicroBatcher(
+                lambda items: recommend_batch([q for q, _, _ in items], [f for _, f, _ in items], traces=[t for _, _, t in items]),
+                max_batch_size=max_batch_size or int(os.environ.get("SHL_BATCH_SIZE", 16)),
+                max_wait_ms=max_wait_ms or float(os.environ.get("SHL_BATCH_WAIT_MS", 5)),
+            )
+    return _batcher
+def recommend(query, filters=None, timeout=None, trace=None):
+    # trace: optional telemetry.Trace that receives this request's stage timings (and profile, if sampled)
+    return get_batcher()((query, dict(filters or {}), trace), timeout=timeout)
+if __name__ == "__main__":
+    print("=== SHL Assessment Recommender ===")
+    device = model_service.default_device()
+    # Load the model while the user is typing, from the snapshot the startup bundle pins if there is one
+    from startup_bundle import pin_model
+    pin_model()
+    model_service.warm_up(device, background=True)
+    user_input = input("Enter a job description or a URL: ").strip()
+    if user_input.startswith("http"):
+        print("Extracting content from URL...")
+        text = extract_text_from_url(user_input)
+        if not text:
+            print("Failed to extract content from URL.")
+            exit()
+    else:
+        text = user_input
+    print("Embedding your query...")
+    query_vec = embed_query_instructor(text, device=device)
+    print("Loading SHL assessment data...")
+    # Make sure to load cleaned metadata here!
+    index, texts, metadata = load_index_and_metadata(
+        "outputs/faiss_index.idx",
+        "outputs/assessment_texts.json",
+        "shl_metadata_index_cleaned.json"
+    )
+    print("Finding top relevant assessments...")
+    filtered_results = search_similar_fuzzy(
+        query_vec,
+        index,
+        metadata,
+        top_k=10,
+        max_duration=45,
+        required_types=["technical", "cognitive", "personality"],  # required types as needed
+        query_text=text if HYBRID else None
+    )
+    print("\nTop Matches:")
+    for name, url, score, similarity in filtered_results:
+        print(f"- {name} (Score: {score:.4f}, Adjusted Similarity: {similarity:.4f})")
+        print(f"  {url}\n")
@@ -0,0 +1,233 @@
+import os
+import json
+import math
+import numpy as np
+import faiss
+INDEX_PARAMS_NAME = "index_params.json"
+INDEX_KINDS = ("flat", "hnsw", "ivf_flat", "ivf_pq", "opq_ivf_pq", "sq_fp16", "sq8", "binary")
+# Reduced-precision first passes: the index holds a 2x (fp16), 4x (int8) or 32x (sign bits) smaller copy
+# of the vectors, and the top "rerank" candidates are re-scored exactly against the fp32 embeddings on disk
+RERANKED_KINDS = ("sq_fp16", "sq8", "binary")
+RERANK_CANDIDATES = 200
+OPQ_MIN_TRAINING_POINTS = 39 * 256
+DEFAULT_SEARCH_PARAMS = {
+    "hnsw": {"efSearch": 64}, "ivf_flat": {"nprobe": 8}, "ivf_pq": {"nprobe": 8}, "opq_ivf_pq": {"nprobe": 8},
+    "sq_fp16": {"rerank": RERANK_CANDIDATES}, "sq8": {"rerank": RERANK_CANDIDATES}, "binary": {"rerank": RERANK_CANDIDATES},
+}
+def default_build_params(kind, dim, n):
+    # Sized for the catalog at hand: nlist ~ 4*sqrt(n) but with >= 39 training points per list,
+    # PQ sub-quantizers dividing dim, and fewer PQ bits when there is too little data to train 256 centroids
+    params = {}
+    if kind == "hnsw":
+        params["M"] = 32
+    if kind.startswith("ivf") or kind.startswith("opq"):
+        params["nlist"] = max(1, min(int(4 * math.sqrt(n)), n // 39))
+    if kind.endswith("pq"):
+        m = max(d for d in range(1, max(dim // 16, 1) + 1) if dim % d == 0)
+        params["m"] = m
+        params["nbits"] = max(4, min(8, int(math.log2(max(n // 39, 16)))))
+    return params
+def factory_string(kind, params):
+    if kind == "flat":
+        return "IDMap2,Flat"
+    if kind == "hnsw":
+        # HNSW cannot take external ids itself, so it is wrapped in an id map
+        return f"IDMap2,HNSW{params['M']},Flat"
+    if kind == "ivf_flat":
+        return f"IVF{params['nlist']},Flat"
+    if kind == "ivf_pq":
+        return f"IVF{params['nlist']},PQ{params['m']}x{params['nbits']}"
+    if kind == "opq_ivf_pq":
+        return f"OPQ{params['m']},IVF{params['nlist']},PQ{params['m']}x{params['nbits']}"
+    if kind == "sq_fp16":
+        return "IDMap2,SQfp16"
+    if kind == "sq8":
+        return "IDMap2,SQ8"
+    if kind == "binary":
+        return "BIDMap2,BFlat"
+    raise ValueError(f"Unknown index kind '{kind}'; expected one of {', '.join(INDEX_KINDS)}.")
+def build_index(embeddings, ids, kind="flat", build_params=None, search_params=None, metric=faiss.METRIC_INNER_PRODUCT):
+    # embeddings must already be normalized, so inner product scores are true cosines;
+    # returns the populated index and its saved configuration
+    n, dim = embeddings.shape
+    if kind == "opq_ivf_pq" and n < OPQ_MIN_TRAINING_POINTS:
+        # OPQ trains a full 256-centroid PQ internally and crashes on tiny training sets
+        raise ValueError(f"opq_ivf_pq needs at least {OPQ_MIN_TRAINING_POINTS} vectors to train; got {n}.")
+    params = dict(default_build_params(kind, dim, n), **(build_params or {}))
+    description = factory_string(kind, params)
+    if kind == "binary":
+        # Sign hashing: one bit per dimension, searched by Hamming distance
+        index = faiss.IndexBinaryIDMap2(faiss.IndexBinaryFlat(dim))
+        index.add_with_ids(binary_codes(embeddings), ids)
+    else:
+        index = faiss.index_factory(dim, description, metric)
+        if not index.is_trained:
+            index.train(embeddings)
+        index.add_with_ids(embeddings, ids)
+    config = {
+        "kind": kind,
+        "factory": description,
+        "metric": "ip" if metric == faiss.METRIC_INNER_PRODUCT else "l2",
+        "build": params,
+        "search": dict(DEFAULT_SEARCH_PARAMS.get(kind, {}), **(search_params or {})),
+    }
+    apply_search_params(index, config["search"])
+    return index, config
+def binary_codes(vectors):
+    return np.packbits(np.asarray(vectors) > 0, axis=1)
+def apply_search_params(index, search_params):
+    # efSearch / nprobe / rerank are runtime knobs, so they are re-applied every time an index is loaded
+    search_params = dict(search_params or {})
+    rerank = search_params.pop("rerank", None)
+    if isinstance(index, RerankedIndex):
+        if rerank is not None:
+            index.rerank = int(rerank)
+        index = index.index
+    if isinstance(index, faiss.IndexBinary):
+        return
+    space = faiss.ParameterSpace()
+    for name, value in search_params.items():
+        space.set_index_parameter(index, name, value)
+def supports_in_place_update(index):
+    # HNSW graphs cannot drop vectors; flat and IVF indexes can. Binary codes are rebuilt from the embeddings.
+    if isinstance(index, faiss.IndexBinary):
+        return False
+    return "HNSW" not in type(faiss.downcast_index(getattr(index, "index", index))).__name__
+def selector_search_params(index, selector, nprobe=None):
+    # IVF indexes reject plain SearchParameters, and their nprobe has to be carried over explicitly
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        return faiss.SearchParametersIVF(sel=selector, nprobe=nprobe or ivf.nprobe)
+    return faiss.SearchParameters(sel=selector)
+def search_ids(index, query_vecs, k, ids):
+    # Top-k among the given external ids only. Index types without IDSelector support fall back to an
+    # exact product over just those vectors.
+    ids = np.asarray(ids, dtype=np.int64)
+    k = min(k, len(ids))
+    try:
+        selector = faiss.IDSelectorBatch(ids)
+        D, I = index.search(query_vecs, k, params=selector_search_params(index, selector))
+    except (AttributeError, TypeError, RuntimeError):
+        return exact_search_ids(index, query_vecs, k, ids)
+    # HNSW and IVF only visit part of the index, so a selective filter can leave a query with fewer than k
+    # hits even though k eligible vectors exist. Those queries are searched again completely: IVF probes
+    # every list, HNSW is scored exactly over the eligible ids it holds.
+    ivf = faiss.try_extract_index_ivf(index)
+    hnsw = "HNSW" in type(faiss.downcast_index(getattr(index, "index", index))).__name__
+    short = np.flatnonzero((I >= 0).sum(axis=1) < k) if ivf is not None or hnsw else []
+    if len(short) and ivf is not None:
+        D[short], I[short] = index.search(query_vecs[short], k, params=selector_search_params(index, selector, ivf.nlist))
+    elif len(short):
+        held = ids[np.isin(ids, faiss.vector_to_array(index.id_map))]
+        exact_D, exact_I = exact_search_ids(index, query_vecs[short], k, held)
+        D[short], I[short] = -np.inf if index.metric_type == faiss.METRIC_INNER_PRODUCT else np.inf, -1
+        D[short, :exact_I.shape[1]], I[short, :exact_I.shape[1]] = exact_D, exact_I
+    return D, I
+def exact_search_ids(index, query_vecs, k, ids):
+    ids = np.asarray(ids, dtype=np.int64)
+    vectors = index.reconstruct_batch(ids)
+    if index.metric_type == faiss.METRIC_INNER_PRODUCT:
+        scores = query_vecs @ vectors.T
+        order = np.argsort(-scores, axis=1)[:, :k]
+    else:
+        scores = (query_vecs ** 2).sum(1)[:, None] - 2 * query_vecs @ vectors.T + (vectors ** 2).sum(1)[None, :]
+        order = np.argsort(scores, axis=1)[:, :k]
+    return np.take_along_axis(scores, order, axis=1).astype(np.float32), ids[order]
+class RerankedIndex:
+    # Two-stage search over a reduced-precision index: the first pass over-fetches "rerank" candidates, which
+    # are re-scored by exact inner product against the fp32 vectors. Those stay memory-mapped, so only the
+    # pages of the rows actually re-ranked become resident. Scores returned are exact cosines.
+    # The mapping relies on the vectors file only ever being replaced with os.replace (see refresh_pipeline.publish):
+    # an open index keeps the old inode, while a file truncated in place would crash the process with SIGBUS.
+    metric_type = faiss.METRIC_INNER_PRODUCT
+    def __init__(self, index, vectors, vector_ids, rerank=RERANK_CANDIDATES, vectors_path=None):
+        self.index = index
+        self.vectors = vectors
+        self.vectors_path = vectors_path
+        self.vector_ids = np.asarray(vector_ids, dtype=np.int64)
+        self.rerank = int(rerank)
+        self.d = index.d
+        self._order = np.argsort(self.vector_ids, kind="stable")
+        self._sorted_ids = self.vector_ids[self._order]
+    @classmethod
+    def open(cls, index, vectors_path, vector_ids=None, rerank=RERANK_CANDIDATES):
+        vectors = np.load(vectors_path, mmap_mode="r")
+        if vector_ids is None:
+            vector_ids = np.arange(len(vectors), dtype=np.int64)
+        if len(vector_ids) != len(vectors):
+            raise ValueError(f"'{vectors_path}' holds {len(vectors)} vectors but the index expects {len(vector_ids)}.")
+        return cls(index, vectors, vector_ids, rerank, vectors_path)
+    @property
+    def ntotal(self):
+        return self.index.ntotal
+    def set_search_params(self, search_params):
+        apply_search_params(self, search_params)
+    def _first_pass(self, query_vecs, k, ids=None):
+        if isinstance(self.index, faiss.IndexBinary):
+            codes = binary_codes(query_vecs)
+            if ids is None:
+                return self.index.search(codes, k)
+            return self.index.search(codes, k, params=faiss.SearchParameters(sel=faiss.IDSelectorBatch(ids)))
+        if ids is None:
+            return self.index.search(query_vecs, k)
+        return search_ids(self.index, query_vecs, k, ids)
+    def search(self, query_vecs, k, ids=None):
+        query_vecs = np.ascontiguousarray(query_vecs, dtype=np.float32)
+        n_candidates = max(k, self.rerank)
+        if ids is not None:
+            n_candidates = min(n_candidates, len(ids))
+        _, candidates = self._first_pass(query_vecs, n_candidates, ids)
+        valid = candidates >= 0
+        positions = np.searchsorted(self._sorted_ids, np.where(valid, candidates, 0))
+        rows = self._order[np.minimum(positions, len(self._order) - 1)]
+        # Sorted gather keeps mmap reads sequential
+        unique_rows, inverse = np.unique(rows[valid], return_inverse=True)
+        vectors = np.asarray(self.vectors[unique_rows], dtype=np.float32)
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        scores = np.full(candidates.shape, -np.inf, dtype=np.float32)
+        query_rows = np.nonzero(valid)[0]
+        scores[valid] = np.einsum("ij,ij->i", vectors[inverse], query_vecs[query_rows])
+        order = np.argsort(-scores, axis=1, kind="stable")[:, :k]
+        D = np.take_along_axis(scores, order, axis=1)
+        I = np.where(np.isfinite(D), np.take_along_axis(candidates, order, axis=1), -1)
+        if I.shape[1] < k:
+            D = np.pad(D, ((0, 0), (0, k - I.shape[1])), constant_values=-np.inf)
+            I = np.pad(I, ((0, 0), (0, k - I.shape[1])), constant_values=-1)
+        return D, I
+def read_index(index_path, flags=0):
+    try:
+        return faiss.read_index(index_path, flags)
+    except RuntimeError:
+        # Binary indexes have their own reader; it is tried second so float indexes keep a single read
+        return faiss.read_index_binary(index_path, flags)
+def write_index(index, index_path):
+    if isinstance(index, RerankedIndex):
+        index = index.index
+    if isinstance(index, faiss.IndexBinary):
+        faiss.write_index_binary(index, index_path)
+    else:
+        faiss.write_index(index, index_path)
+def read_index_mmap(index_path):
+    # Memory-mapped indexes live in the OS page cache, so worker processes on one box share a single copy
+    for flag in (faiss.IO_FLAG_MMAP_IFC, faiss.IO_FLAG_MMAP):
+        try:
+            return read_index(index_path, flag | faiss.IO_FLAG_READ_ONLY)
+        except (RuntimeError, AttributeError):
+            continue
+    return read_index(index_path)
+def save_index_params(config, output_dir="outputs"):
+    with open(os.path.join(output_dir, INDEX_PARAMS_NAME), "w", encoding="utf-8") as f:
+        json.dump(config, f, indent=2)
+def load_index_params(output_dir="outputs"):
+    path = os.path.join(output_dir, INDEX_PARAMS_NAME)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+def index_memory_bytes(index):
+    # Resident size only: a re-ranked index counts its first pass, not the memory-mapped fp32 vectors
+    if isinstance(index, RerankedIndex):
+        index = index.index
+    if isinstance(index, faiss.IndexBinary):
+        return len(faiss.serialize_index_binary(index))
+    return len(faiss.serialize_index(index))
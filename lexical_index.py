@@ -0,0 +1,99 @@
+import os
+import re
+import numpy as np
+LEXICAL_INDEX_NAME = "lexical_index.npz"
+# Keeps skill tokens such as ".net", "c#", "c++" and "node.js" intact
+TOKEN_PATTERN = re.compile(r"\.?[a-z0-9][a-z0-9+#]*(?:\.[a-z0-9]+)*")
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or our should that the their this to "
+    "we who will with you your".split()
+)
+# Assessment names are short and precise, so their terms count this many times in a document
+NAME_BOOST = 2
+def tokenize(text):
+    tokens = []
+    for token in TOKEN_PATTERN.findall((text or "").lower()):
+        if token in STOPWORDS:
+            continue
+        tokens.append(token)
+        if "." in token[1:]:
+            # "ado.net" also matches "ado" and ".net"
+            head, *rest = token.split(".")
+            tokens.extend(([head] if head else []) + ["." + part for part in rest])
+    return tokens
+class LexicalIndex:
+    # BM25 over a CSR inverted index. Each posting already stores its full BM25 weight (IDF and length
+    # normalization included), so a query is a dictionary lookup plus one bincount over the postings.
+    def __init__(self, terms, indptr, doc_rows, weights, size):
+        self.terms = terms
+        self.indptr = indptr
+        self.doc_rows = doc_rows
+        self.weights = weights
+        self.size = int(size)
+        self._term_ids = {term: i for i, term in enumerate(terms.tolist())}
+    @classmethod
+    def build(cls, texts, names=None, k1=1.2, b=0.75):
+        docs = []
+        for i, text in enumerate(texts):
+            tokens = tokenize(text)
+            if names is not None:
+                tokens += tokenize(names[i]) * NAME_BOOST
+            docs.append(tokens)
+        lengths = np.array([len(tokens) for tokens in docs], dtype=np.float32)
+        avg_length = float(lengths.mean()) if len(docs) and lengths.mean() > 0 else 1.0
+        postings = {}
+        for row, tokens in enumerate(docs):
+            counts = {}
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            for token, tf in counts.items():
+                postings.setdefault(token, []).append((row, tf))
+        terms = sorted(postings)
+        indptr = np.zeros(len(terms) + 1, dtype=np.int64)
+        doc_rows, weights = [], []
+        n = len(docs)
+        for t, term in enumerate(terms):
+            rows, tfs = zip(*postings[term])
+            rows = np.array(rows, dtype=np.int32)
+            tfs = np.array(tfs, dtype=np.float32)
+            idf = np.log(1 + (n - len(rows) + 0.5) / (len(rows) + 0.5))
+            norm = k1 * (1 - b + b * lengths[rows] / avg_length)
+            doc_rows.append(rows)
+            weights.append((idf * tfs * (k1 + 1) / (tfs + norm)).astype(np.float32))
+            indptr[t + 1] = indptr[t] + len(rows)
+        return cls(
+            terms=np.array(terms),
+            indptr=indptr,
+            doc_rows=np.concatenate(doc_rows) if doc_rows else np.empty(0, dtype=np.int32),
+            weights=np.concatenate(weights) if weights else np.empty(0, dtype=np.float32),
+            size=n,
+        )
+    def save(self, path):
+        np.savez(path, terms=self.terms, indptr=self.indptr, doc_rows=self.doc_rows, weights=self.weights, size=np.array(self.size))
+    @classmethod
+    def load(cls, path, size):
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            if int(data["size"]) != size:
+                return None
+            return cls(data["terms"], data["indptr"], data["doc_rows"], data["weights"], data["size"])
+    def scores(self, query):
+        term_ids = {self._term_ids[t] for t in tokenize(query) if t in self._term_ids}
+        if not term_ids:
+            return np.zeros(self.size, dtype=np.float32)
+        slices = [np.arange(self.indptr[t], self.indptr[t + 1]) for t in term_ids]
+        postings = np.concatenate(slices)
+        return np.bincount(self.doc_rows[postings], weights=self.weights[postings], minlength=self.size).astype(np.float32)
+    def search(self, query, k, rows=None):
+        # Top-k (scores, rows) among documents sharing at least one term with the query, best first
+        scores = self.scores(query)
+        if rows is not None:
+            allowed = np.zeros(self.size, dtype=bool)
+            allowed[rows] = True
+            scores[~allowed] = 0
+        candidates = np.flatnonzero(scores > 0)
+        if len(candidates) > k:
+            candidates = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        order = candidates[np.argsort(-scores[candidates], kind="stable")]
+        return scores[order], order.astype(np.int64)
@@ -0,0 +1,238 @@
+import os
+import re
+import threading
+import time
+from datetime import datetime
+import numpy as np
+# torch and InstructorEmbedding are imported on first use: importing this module (every Streamlit rerun,
+# CLI --help, the lexical-only warm-up path) should not pay for them before a model is actually needed
+# Smaller Instructor checkpoints can be selected by size instead of the full hub name
+MODEL_ALIASES = {
+    "base": "hkunlp/instructor-base",
+    "large": "hkunlp/instructor-large",
+    "xl": "hkunlp/instructor-xl",
+}
+# fp32: stock PyTorch; int8: dynamically quantized Linear layers (CPU); onnx: encoder run by ONNX Runtime (CPU)
+BACKENDS = ("fp32", "int8", "onnx")
+MODEL_NAME = MODEL_ALIASES.get(os.environ.get("SHL_MODEL_NAME", "xl"), os.environ.get("SHL_MODEL_NAME"))
+BACKEND = os.environ.get("SHL_ENCODER_BACKEND", "fp32")
+# Pinned local snapshot of MODEL_NAME's files; loading from it skips hub/cache resolution. model_id() stays
+# MODEL_NAME, so caches and manifests keyed by the model name keep matching.
+MODEL_PATH = os.environ.get("SHL_MODEL_PATH") or None
+NUM_THREADS = int(os.environ["SHL_NUM_THREADS"]) if os.environ.get("SHL_NUM_THREADS") else None
+ONNX_DIR = os.path.join("outputs", "onnx")
+INSTRUCTION = "Represent the task: retrieve relevant assessments based on this job description"
+# One model per (name, backend, device) for the whole process; shared by Streamlit sessions, CLI and scripts
+_models = {}
+_load_lock = threading.Lock()
+# Devices with a warm-up in progress; callers may serve a cheaper fallback meanwhile
+_warming = set()
+# Fast tokenizers are not safe to call from several threads at once, so encodes are serialized
+_encode_lock = threading.Lock()
+_stats = {
+    "model_name": MODEL_NAME,
+    "model_path": MODEL_PATH,
+    "backend": BACKEND,
+    "device": None,
+    "load_seconds": None,
+    "encode_calls": 0,
+    "texts_encoded": 0,
+    "encode_seconds_total": 0.0,
+    "last_encode_seconds": None,
+    "model_bytes": None,
+}
+def log(msg):
+    print(f"[{datetime.now().strftime('%H:%M:%S')}] {msg}")
+def default_device():
+    if BACKEND != "fp32":
+        return "cpu"
+    import torch
+    return "cuda" if torch.cuda.is_available() else "cpu"
+def model_id():
+    # Identifies the embedding space; vectors from different ids must not be mixed in caches or manifests
+    return MODEL_NAME if BACKEND == "fp32" else f"{MODEL_NAME}:{BACKEND}"
+def configure(model_name=None, backend=None, num_threads=None, model_path=None):
+    # Switches checkpoint/backend for subsequent encodes; already loaded models stay cached by key
+    global MODEL_NAME, BACKEND, NUM_THREADS, MODEL_PATH
+    if backend is not None:
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown encoder backend '{backend}'; expected one of {', '.join(BACKENDS)}.")
+        BACKEND = backend
+    if model_name is not None:
+        MODEL_NAME = MODEL_ALIASES.get(model_name, model_name)
+        MODEL_PATH = None
+    if model_path is not None:
+        MODEL_PATH = model_path or None
+    if num_threads is not None:
+        NUM_THREADS = num_threads
+    _stats.update(model_name=MODEL_NAME, model_path=MODEL_PATH, backend=BACKEND, load_seconds=None, model_bytes=None)
+def model_memory_bytes(model):
+    params = sum(p.numel() * p.element_size() for p in model.parameters())
+    buffers = sum(b.numel() * b.element_size() for b in model.buffers())
+    # Dynamically quantized Linear layers keep their int8 weights in packed params, outside parameters()
+    for module in model.modules():
+        packed = getattr(module, "_packed_params", None)
+        if packed is not None:
+            weight, _ = packed._weight_bias()
+            params += weight.numel() * weight.element_size()
+    return params + buffers
+def process_rss_bytes():
+    # Peak resident set size of this process; None where the resource module is unavailable (Windows)
+    try:
+        import resource
+    except ImportError:
+        return None
+    import sys
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == "darwin" else rss * 1024
+_EncoderOutputs = _OnnxEncoder = None
+def onnx_path(model_name):
+    return os.path.join(ONNX_DIR, re.sub(r"[^A-Za-z0-9_.-]+", "_", model_name), "encoder.onnx")
+def _torch_modules():
+    # The ONNX shims subclass torch.nn.Module, so they are defined once torch has been imported
+    global _EncoderOutputs, _OnnxEncoder
+    if _EncoderOutputs is None:
+        import torch
+        class _EncoderOutputs(torch.nn.Module):
+            # Wraps the HF encoder so the ONNX graph has plain tensor inputs and a single tensor output
+            def __init__(self, encoder):
+                super().__init__()
+                self.encoder = encoder
+            def forward(self, input_ids, attention_mask):
+                return self.encoder(input_ids=input_ids, attention_mask=attention_mask, return_dict=False)[0]
+        class _OnnxEncoder(torch.nn.Module):
+            # Drop-in replacement for INSTRUCTOR_Transformer.auto_model backed by an ONNX Runtime session
+            def __init__(self, session, config):
+                super().__init__()
+                self.session = session
+                self.config = config
+            def forward(self, input_ids=None, attention_mask=None, return_dict=False, **kwargs):
+                outputs = self.session.run(None, {
+                    "input_ids": input_ids.cpu().numpy().astype(np.int64),
+                    "attention_mask": attention_mask.cpu().numpy().astype(np.int64),
+                })
+                return (torch.from_numpy(outputs[0]),)
+    return _EncoderOutputs, _OnnxEncoder
+def export_onnx(model, path):
+    import torch
+    encoder_outputs, _ = _torch_modules()
+    transformer = model[0]
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    sample = transformer.tokenizer(["export sample"], return_tensors="pt")
+    log(f"Exporting encoder to {path}...")
+    with torch.no_grad():
+        torch.onnx.export(
+            encoder_outputs(transformer.auto_model).eval(),
+            (sample["input_ids"], sample["attention_mask"]),
+            path,
+            input_names=["input_ids", "attention_mask"],
+            output_names=["last_hidden_state"],
+            dynamic_axes={
+                "input_ids": {0: "batch", 1: "sequence"},
+                "attention_mask": {0: "batch", 1: "sequence"},
+                "last_hidden_state": {0: "batch", 1: "sequence"},
+            },
+            opset_version=14,
+        )
+def _apply_backend(model, backend):
+    if backend == "int8":
+        import torch
+        return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    if backend == "onnx":
+        import onnxruntime
+        path = onnx_path(MODEL_NAME)
+        if not os.path.exists(path):
+            export_onnx(model, path)
+        options = onnxruntime.SessionOptions()
+        if NUM_THREADS:
+            options.intra_op_num_threads = NUM_THREADS
+        session = onnxruntime.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        transformer = model[0]
+        _, onnx_encoder = _torch_modules()
+        transformer.auto_model = onnx_encoder(session, transformer.auto_model.config)
+    return model
+def resolve_snapshot(model_name=None, revision=None):
+    # Local directory of the model's files at one hub commit (downloaded into the HF cache if missing); the
+    # directory name is the commit hash, so the startup bundle pins exactly the weights it was built against
+    from huggingface_hub import snapshot_download
+    model_name = MODEL_ALIASES.get(model_name, model_name) if model_name else MODEL_NAME
+    if os.path.isdir(model_name):
+        return os.path.abspath(model_name)
+    return snapshot_download(model_name, revision=revision)
+def is_loaded(device=None):
+    # Without a device: loaded on any device, which needs no torch import to answer
+    if device is None:
+        return any(key[:2] == (MODEL_NAME, BACKEND) for key in _models)
+    return (MODEL_NAME, BACKEND, device) in _models
+def get_model(device=None):
+    device = device or default_device()
+    key = (MODEL_NAME, BACKEND, device)
+    model = _models.get(key)
+    if model is not None:
+        return model
+    with _load_lock:
+        model = _models.get(key)
+        if model is None:
+            if BACKEND not in BACKENDS:
+                raise ValueError(f"Unknown encoder backend '{BACKEND}'; expected one of {', '.join(BACKENDS)}.")
+            if BACKEND != "fp32" and device != "cpu":
+                raise ValueError(f"The {BACKEND} encoder backend only runs on CPU.")
+            start = time.perf_counter()
+            import torch
+            from InstructorEmbedding import INSTRUCTOR
+            if NUM_THREADS:
+                torch.set_num_threads(NUM_THREADS)
+            source = MODEL_PATH if MODEL_PATH and os.path.isdir(MODEL_PATH) else MODEL_NAME
+            log(f"Loading {MODEL_NAME} ({BACKEND}) on {device} from {source}...")
+            model = INSTRUCTOR(source)
+            model.to(device)
+            model.eval()
+            model = _apply_backend(model, BACKEND)
+            _stats["load_seconds"] = round(time.perf_counter() - start, 3)
+            _stats["device"] = device
+            _stats["model_bytes"] = model_memory_bytes(model)
+            if BACKEND == "onnx":
+                # ONNX weights (including external data files) live outside torch
+                onnx_dir = os.path.dirname(onnx_path(MODEL_NAME))
+                _stats["model_bytes"] += sum(os.path.getsize(os.path.join(onnx_dir, name)) for name in os.listdir(onnx_dir))
+            _models[key] = model
+            log(f"Model loaded in {_stats['load_seconds']}s ({_stats['model_bytes'] / 1e9:.2f} GB).")
+    return model
+def encode(texts, device=None, instruction=INSTRUCTION, **kwargs):
+    device = device or default_device()
+    model = get_model(device)
+    pairs = [[instruction, text] for text in texts]
+    kwargs.setdefault("convert_to_numpy", True)
+    with _encode_lock:
+        start = time.perf_counter()
+        embeddings = model.encode(pairs, device=device, **kwargs)
+        elapsed = time.perf_counter() - start
+        _stats["encode_calls"] += 1
+        _stats["texts_encoded"] += len(pairs)
+        _stats["encode_seconds_total"] += elapsed
+        _stats["last_encode_seconds"] = round(elapsed, 4)
+    return embeddings
+def warm_up(device=None, background=False):
+    # Loads the model and runs one tiny encode so the first real query does not pay for lazy init
+    device = device or default_device()
+    if background:
+        # Marked before the thread starts, so requests right after this call already see the warm-up
+        _warming.add(device)
+        thread = threading.Thread(target=warm_up, args=(device,), daemon=True)
+        thread.start()
+        return thread
+    _warming.add(device)
+    try:
+        encode(["warm-up"], device=device)
+    finally:
+        _warming.discard(device)
+    return get_model(device)
+def is_warming_up(device=None):
+    device = device or default_device()
+    return device in _warming and not is_loaded(device)
+def model_stats():
+    stats = dict(_stats)
+    stats["process_rss_bytes"] = process_rss_bytes()
+    if stats["encode_calls"]:
+        stats["mean_encode_seconds"] = round(stats["encode_seconds_total"] / stats["encode_calls"], 4)
+    return stats
@@ -0,0 +1,342 @@
+import os
+import json
+import time
+import queue
+import shutil
+import asyncio
+import argparse
+import threading
+from datetime import datetime
+import numpy as np
+import faiss
+import model_service
+from catalog import (
+    DEFAULT_TENANT, FILTER_INDEX_NAME, ID_MAP_NAME, INDEX_PATH, METADATA_PATH, PUBLISH_MARKER, TEXTS_PATH, assessment_id,
+)
+from clean_metadata import clean_records
+from generate_embeddings import (
+    MANIFEST_NAME, create_textual_representation, load_manifest, save_filter_index, save_id_map, save_lexical_index,
+    save_manifest, save_outputs, text_hash,
+)
+from lexical_index import LEXICAL_INDEX_NAME
+from index_factory import (
+    DEFAULT_SEARCH_PARAMS, INDEX_KINDS, INDEX_PARAMS_NAME, apply_search_params, build_index, default_build_params,
+    factory_string, save_index_params, write_index,
+)
+from startup_bundle import build_bundle
+# Index kinds that need no training and can take vectors batch by batch while the crawl is still running;
+# the others are trained once every vector has arrived
+STREAMING_KINDS = ("flat", "hnsw")
+STAGING_DIR = os.path.join("outputs", ".staging")
+METRICS_PATH = os.path.join("outputs", "refresh_metrics.json")
+_DONE = object()
+def log(msg):
+    print(f"[{datetime.now().strftime('%H:%M:%S')}] {msg}")
+class StageMetrics:
+    def __init__(self, name):
+        self.name = name
+        self.items_in = 0
+        self.items_out = 0
+        self.busy_seconds = 0.0
+        self.started = None
+        self.finished = None
+    def snapshot(self):
+        wall = ((self.finished or time.perf_counter()) - self.started) if self.started else 0.0
+        return {
+            "stage": self.name,
+            "items_in": self.items_in,
+            "items_out": self.items_out,
+            "busy_s": round(self.busy_seconds, 3),
+            "wall_s": round(wall, 3),
+            # Busy throughput is what the stage could sustain; wall throughput includes waiting on neighbours
+            "items_per_busy_s": round(self.items_in / self.busy_seconds, 2) if self.busy_seconds else None,
+            "items_per_wall_s": round(self.items_in / wall, 2) if wall else None,
+            "done": self.finished is not None,
+        }
+def _put(q, item, stop):
+    # Blocks while the next stage is behind (backpressure), but gives up once the pipeline is stopping
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+def _get(q, stop):
+    while not stop.is_set():
+        try:
+            return q.get(timeout=0.1)
+        except queue.Empty:
+            continue
+    return _DONE
+class Pipeline:
+    # Stages run on their own threads and are linked by bounded queues, so scraping, cleaning,
+    # encoding and index insertion overlap; the first failing stage stops all of them
+    def __init__(self, queue_size=256):
+        self.queue_size = queue_size
+        self.stop = threading.Event()
+        self.metrics = []
+        self.threads = []
+        self.errors = []
+    def source(self, name, produce):
+        metrics = StageMetrics(name)
+        outbox = queue.Queue(maxsize=self.queue_size)
+        def emit(item):
+            metrics.items_out += 1
+            return _put(outbox, item, self.stop)
+        def run():
+            metrics.started = time.perf_counter()
+            produce(emit)
+            metrics.items_in = metrics.items_out
+            metrics.busy_seconds = time.perf_counter() - metrics.started
+        self._start(metrics, run, outbox)
+        return outbox
+    def stage(self, name, inbox, handle, batch_size=1, finish=None):
+        # handle(batch) and finish() return lists of items for the next stage
+        metrics = StageMetrics(name)
+        outbox = queue.Queue(maxsize=self.queue_size)
+        def forward(items):
+            for item in items or []:
+                metrics.items_out += 1
+                if not _put(outbox, item, self.stop):
+                    return
+        def process(batch):
+            start = time.perf_counter()
+            results = handle(batch)
+            metrics.busy_seconds += time.perf_counter() - start
+            forward(results)
+        def run():
+            metrics.started = time.perf_counter()
+            batch = []
+            while True:
+                item = _get(inbox, self.stop)
+                if item is _DONE:
+                    break
+                metrics.items_in += 1
+                batch.append(item)
+                if len(batch) >= batch_size:
+                    process(batch)
+                    batch = []
+            if batch and not self.stop.is_set():
+                process(batch)
+            if finish is not None and not self.stop.is_set():
+                start = time.perf_counter()
+                results = finish()
+                metrics.busy_seconds += time.perf_counter() - start
+                forward(results)
+        self._start(metrics, run, outbox)
+        return outbox
+    def _start(self, metrics, run, outbox):
+        def target():
+            try:
+                run()
+            except Exception as e:
+                self.errors.append((metrics.name, e))
+                self.stop.set()
+            finally:
+                metrics.finished = time.perf_counter()
+                _put(outbox, _DONE, self.stop)
+        thread = threading.Thread(target=target, name=f"refresh-{metrics.name}", daemon=True)
+        self.metrics.append(metrics)
+        self.threads.append(thread)
+        thread.start()
+    def drain(self, outbox, report_every=5.0):
+        # Consumes the last queue while logging per-stage progress, then re-raises the first stage error
+        last_report = time.perf_counter()
+        while _get(outbox, self.stop) is not _DONE:
+            if time.perf_counter() - last_report >= report_every:
+                self.report()
+                last_report = time.perf_counter()
+        for thread in self.threads:
+            thread.join()
+        if self.errors:
+            name, error = self.errors[0]
+            raise RuntimeError(f"Refresh pipeline failed in stage '{name}': {error}") from error
+    def report(self):
+        log(" | ".join(f"{m.name}: {m.items_in} in, {m.items_out} out, {m.snapshot()['items_per_wall_s'] or 0}/s"
+                       for m in self.metrics))
+    def snapshot(self):
+        return [m.snapshot() for m in self.metrics]
+def scrape_source(concurrency=16, browsers=2, checkpoint_path=None):
+    from scraper import Checkpoint, Scraper
+    def produce(emit):
+        # on_record runs on the scraper's event loop, so a full queue pauses the crawl instead of buffering it
+        scraper = Scraper(concurrency=concurrency, browsers=browsers,
+                          checkpoint=Checkpoint(checkpoint_path) if checkpoint_path else None,
+                          on_record=lambda item: emit(dict(item)))
+        asyncio.run(scraper.run())
+    return produce
+def file_source(path):
+    def produce(emit):
+        with open(path, "r", encoding="utf-8") as f:
+            for item in json.load(f):
+                if not emit(item):
+                    return
+    return produce
+def with_tenant_libraries(source, metadata_path=METADATA_PATH):
+    # A crawl only yields SHL records; tenant libraries already merged into the published catalog are carried over
+    def produce(emit):
+        source(emit)
+        if not os.path.exists(metadata_path):
+            return
+        with open(metadata_path, "r", encoding="utf-8") as f:
+            for item in json.load(f):
+                if (item.get("Tenant") or DEFAULT_TENANT) != DEFAULT_TENANT and not emit(item):
+                    return
+    return produce
+class CatalogBuilder:
+    # Collects cleaned records and their vectors, and fills the FAISS index as batches arrive
+    def __init__(self, kind="flat", build_params=None, search_params=None, device=None, output_dir="outputs", full=False):
+        self.kind = kind
+        self.build_params = build_params or {}
+        self.search_params = search_params or {}
+        self.device = device or model_service.default_device()
+        manifest = None if full else load_manifest(output_dir)
+        self.previous = dict(zip(manifest["hashes"], manifest["vectors"])) if manifest else {}
+        self.raw_records, self.records, self.texts, self.ids, self.hashes, self.vectors = [], [], [], [], [], []
+        self.seen_ids = set()
+        self.reused = 0
+        self.index = None
+        self.config = None
+        self.embeddings = None
+        self._lock = threading.Lock()
+    def clean(self, batch):
+        cleaned = []
+        for raw, item in zip(batch, clean_records(batch)):
+            assessment = assessment_id(item)
+            with self._lock:
+                if assessment in self.seen_ids:
+                    continue
+                self.seen_ids.add(assessment)
+                self.raw_records.append(raw)
+                self.records.append(item)
+            cleaned.append((assessment, item))
+        return cleaned
+    def embed(self, batch):
+        # Only texts without a stored vector for the same text, model and instruction are encoded
+        rows = []
+        for assessment, item in batch:
+            text = create_textual_representation(item)
+            if text.strip():
+                rows.append((assessment, text, text_hash(text)))
+        missing = [i for i, (_, _, h) in enumerate(rows) if h not in self.previous]
+        fresh = model_service.encode([rows[i][1] for i in missing], device=self.device) if missing else []
+        fresh = dict(zip(missing, fresh))
+        self.reused += len(rows) - len(missing)
+        return [(assessment, text, h, np.asarray(fresh[i] if i in fresh else self.previous[h], dtype=np.float32))
+                for i, (assessment, text, h) in enumerate(rows)]
+    def insert(self, batch):
+        ids = np.array([assessment for assessment, _, _, _ in batch], dtype=np.int64)
+        vectors = np.stack([vector for _, _, _, vector in batch]).astype(np.float32)
+        faiss.normalize_L2(vectors)
+        for assessment, text, h, _ in batch:
+            self.ids.append(int(assessment))
+            self.texts.append(text)
+            self.hashes.append(h)
+        self.vectors.append(vectors)
+        if self.kind in STREAMING_KINDS:
+            if self.index is None:
+                params = dict(default_build_params(self.kind, vectors.shape[1], 0), **self.build_params)
+                description = factory_string(self.kind, params)
+                self.index = faiss.index_factory(vectors.shape[1], description, faiss.METRIC_INNER_PRODUCT)
+                self.config = {
+                    "kind": self.kind,
+                    "factory": description,
+                    "metric": "ip",
+                    "build": params,
+                    "search": dict(DEFAULT_SEARCH_PARAMS.get(self.kind, {}), **self.search_params),
+                }
+            self.index.add_with_ids(vectors, ids)
+        return batch
+    def finish(self):
+        if not self.vectors:
+            raise ValueError("No assessments reached the index stage.")
+        self.embeddings = np.concatenate(self.vectors)
+        if self.index is None:
+            self.index, self.config = build_index(self.embeddings, np.asarray(self.ids, dtype=np.int64), self.kind,
+                                                  self.build_params, self.search_params)
+        apply_search_params(self.index, self.config["search"])
+        return []
+def reset_staging(staging_dir):
+    if os.path.exists(staging_dir):
+        shutil.rmtree(staging_dir)
+    os.makedirs(staging_dir)
+def stage_outputs(builder, staging_dir):
+    # Everything the servers read is written to a staging directory first, then swapped in by publish()
+    reset_staging(staging_dir)
+    save_outputs(builder.embeddings, builder.texts, staging_dir)
+    write_index(builder.index, os.path.join(staging_dir, "faiss_index.idx"))
+    save_index_params(builder.config, staging_dir)
+    save_filter_index(builder.records, staging_dir)
+    save_lexical_index(builder.records, builder.texts, builder.ids, staging_dir)
+    save_id_map(builder.records, builder.ids, staging_dir)
+    save_manifest(builder.ids, builder.hashes, staging_dir)
+    with open(os.path.join(staging_dir, os.path.basename(METADATA_PATH)), "w", encoding="utf-8") as f:
+        json.dump(builder.records, f, indent=2, ensure_ascii=False)
+def publish(staging_dir, output_dir=os.path.dirname(INDEX_PATH), metadata_path=METADATA_PATH):
+    # Files are swapped in with os.replace, so readers that already mmap'd the old index keep a valid copy.
+    # The marker tells get_catalog() to keep serving its loaded catalog until the whole set is in place.
+    targets = {
+        "assessment_embeddings.npy": os.path.join(output_dir, "assessment_embeddings.npy"),
+        MANIFEST_NAME: os.path.join(output_dir, MANIFEST_NAME),
+        os.path.basename(TEXTS_PATH): os.path.join(output_dir, os.path.basename(TEXTS_PATH)),
+        FILTER_INDEX_NAME: os.path.join(output_dir, FILTER_INDEX_NAME),
+        LEXICAL_INDEX_NAME: os.path.join(output_dir, LEXICAL_INDEX_NAME),
+        ID_MAP_NAME: os.path.join(output_dir, ID_MAP_NAME),
+        INDEX_PARAMS_NAME: os.path.join(output_dir, INDEX_PARAMS_NAME),
+        os.path.basename(METADATA_PATH): metadata_path,
+        os.path.basename(INDEX_PATH): os.path.join(output_dir, os.path.basename(INDEX_PATH)),
+    }
+    marker = os.path.join(output_dir, PUBLISH_MARKER)
+    open(marker, "w").close()
+    try:
+        for name, target in targets.items():
+            os.replace(os.path.join(staging_dir, name), target)
+    finally:
+        os.remove(marker)
+    shutil.rmtree(staging_dir, ignore_errors=True)
+    log(f"Published {len(targets)} files to {output_dir}.")
+def run_refresh(source, kind="flat", build_params=None, search_params=None, device=None, full=False,
+                batch_size=32, queue_size=256, output_dir="outputs", metrics_path=METRICS_PATH):
+    builder = CatalogBuilder(kind, build_params, search_params, device, output_dir, full)
+    pipeline = Pipeline(queue_size=queue_size)
+    start = time.perf_counter()
+    records = pipeline.source("scrape", with_tenant_libraries(source))
+    cleaned = pipeline.stage("clean", records, builder.clean, batch_size=batch_size)
+    embedded = pipeline.stage("embed", cleaned, builder.embed, batch_size=batch_size)
+    indexed = pipeline.stage("index", embedded, builder.insert, batch_size=batch_size, finish=builder.finish)
+    pipeline.drain(indexed)
+    log(f"{len(builder.records)} assessments, {len(builder.ids)} indexed ({builder.reused} embeddings reused).")
+    staging_dir = os.path.join(output_dir, os.path.basename(STAGING_DIR))
+    stage_outputs(builder, staging_dir)
+    publish(staging_dir, output_dir)
+    build_bundle(
+        os.path.join(output_dir, os.path.basename(INDEX_PATH)),
+        os.path.join(output_dir, os.path.basename(TEXTS_PATH)),
+        METADATA_PATH,
+    )
+    metrics = {"total_s": round(time.perf_counter() - start, 3), "stages": pipeline.snapshot(),
+               "assessments": len(builder.records), "indexed": len(builder.ids), "reused_embeddings": builder.reused}
+    if metrics_path:
+        with open(metrics_path, "w", encoding="utf-8") as f:
+            json.dump(metrics, f, indent=2)
+    pipeline.report()
+    return builder, metrics
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Scrape, clean, embed and index the SHL catalog in one streaming pass.")
+    parser.add_argument("--source", default=None, help="read raw records from this JSON file instead of crawling")
+    parser.add_argument("--concurrency", type=int, default=16, help="concurrent HTTP requests while crawling")
+    parser.add_argument("--browsers", type=int, default=2, help="headless Chrome instances for JS-only pages")
+    parser.add_argument("--checkpoint", default=None, help="resume the crawl from this scraper checkpoint")
+    parser.add_argument("--index", default="flat", choices=INDEX_KINDS, help="FAISS index type")
+    parser.add_argument("--full", action="store_true", help="re-embed every assessment instead of reusing stored vectors")
+    parser.add_argument("--batch-size", type=int, default=32, help="records per encode / index insert")
+    parser.add_argument("--queue-size", type=int, default=256, help="bound on each inter-stage queue")
+    args = parser.parse_args()
+    source = file_source(args.source) if args.source else scrape_source(args.concurrency, args.browsers, args.checkpoint)
+    builder, metrics = run_refresh(source, kind=args.index, full=args.full, batch_size=args.batch_size, queue_size=args.queue_size)
+    if not args.source:
+        # Keep the raw scrape on disk as well, as scraper.py would
+        from scraper import save_metadata
+        save_metadata([item for item in builder.raw_records if not item.get("Tenant")])
+    log(f"[✓] Refresh complete in {metrics['total_s']}s.")
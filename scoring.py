@@ -0,0 +1,39 @@
+import numpy as np
+import faiss
+from catalog import types_to_mask
+# Standard reciprocal-rank-fusion constant; damps the weight of the very top ranks
+RRF_K = 60
+def to_cosine(distances, metric_type):
+    # Query and catalog vectors are unit-normalized: inner product is the cosine already,
+    # and squared L2 distance is 2 - 2cos, so legacy L2 indexes convert with 1 - d/2
+    distances = np.asarray(distances, dtype=np.float32)
+    if metric_type == faiss.METRIC_INNER_PRODUCT:
+        return distances
+    return 1.0 - distances / 2.0
+def score_candidates(distances, rows, catalog, top_k=10, required_types=None, type_penalty=0.8):
+    # Vectorized scoring for one query's candidates: cosine, soft type penalty, then re-rank.
+    # Returns (rows, similarities) sorted by adjusted similarity, at most top_k long.
+    rows = np.asarray(rows)
+    similarities = to_cosine(distances, catalog.index.metric_type)
+    valid = rows >= 0
+    rows, similarities = rows[valid], similarities[valid]
+    similarities = apply_type_penalty(similarities, rows, catalog, required_types, type_penalty)
+    order = np.argsort(-similarities, kind="stable")[:top_k]
+    return rows[order], similarities[order]
+def apply_type_penalty(scores, rows, catalog, required_types=None, type_penalty=0.8):
+    if not required_types:
+        return scores
+    mismatched = (catalog.type_masks[rows] & types_to_mask(required_types)) == 0
+    return np.where(mismatched, scores * type_penalty, scores)
+def reciprocal_rank_fusion(rankings, k=RRF_K):
+    # Each ranking is an array of metadata rows, best first; a row scores sum(1 / (k + rank)) over the
+    # rankings it appears in. Returns (rows, fused scores), best first.
+    rankings = [np.asarray(r, dtype=np.int64) for r in rankings if len(r)]
+    if not rankings:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+    rows = np.concatenate(rankings)
+    contributions = np.concatenate([1.0 / (k + np.arange(1, len(r) + 1)) for r in rankings])
+    unique_rows, inverse = np.unique(rows, return_inverse=True)
+    fused = np.bincount(inverse, weights=contributions).astype(np.float32)
+    order = np.argsort(-fused, kind="stable")
+    return unique_rows[order], fused[order]
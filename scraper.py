@@ -1,142 +1,328 @@
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.chrome.service import Service
-from webdriver_manager.chrome import ChromeDriverManager
-from bs4 import BeautifulSoup
-import pandas as pd
-import time
-import json
-from tqdm import tqdm
-import re
-import concurrent.futures
-BASE_URL = "https://www.shl.com"
-CATALOG_URL = BASE_URL + "/solutions/products/product-catalog/"
-# Setup Chrome driver (for individual driver instances)
-def init_driver():
-    options = Options()
-    options.add_argument("--headless=new")
-    options.add_argument("--disable-gpu")
-    options.add_argument("--window-size=1920,1080")
-    return webdriver.Chrome(service=Service(ChromeDriverManager().install()), options=options)
-# Scrape individual assessment detail page (run concurrently)
-def scrape_detail(url):
-    driver = init_driver()
-    try:
-        driver.get(url)
-        # Reduce sleep time for faster scraping; adjust if needed
-        time.sleep(1)
-        soup = BeautifulSoup(driver.page_source, "html.parser")
-        #Duration Extraction
-        duration = "N/A"
-        # Use a CSS selector to directly find a <p> tag with "approximate completion time" text.
-        duration_tag = soup.select_one("p:contains('approximate completion time')")
-        if not duration_tag:
-            # Fallback: search all <p> tags
-            duration_tags = soup.find_all("p")
-            for tag in duration_tags:
-                if "approximate completion time" in tag.get_text().lower():
-                    duration_tag = tag
-                    break
-        if duration_tag:
-            match = re.search(r"(\d+)", duration_tag.get_text())
-            if match:
-                duration = int(match.group(1))
-        #Test Type Extraction
-        type_mapping = {
-            "A": "Ability & Aptitude",
-            "B": "Biodata & Situational Judgement",
-            "C": "Competencies",
-            "D": "Development & 360",
-            "E": "Assessment Exercises",
-            "K": "Knowledge & Skills",
-            "P": "Personality & Behavior",
-            "S": "Simulations"
-        }
-        type_codes = []
-        type_block = soup.find(text=re.compile("test type", re.I))
-        if type_block:
-            container = type_block.find_parent()
-            if container:
-                found_codes = re.findall(r"\b([A-Z])\b", container.get_text(" ").strip())
-                for code in found_codes:
-                    if code in type_mapping:
-                        type_codes.append(type_mapping[code])
-        test_type = ", ".join(type_codes) if type_codes else "N/A"
-        #Remote / Adaptive Flags
-        text_content = soup.get_text(separator="\n").lower()
-        remote = "Yes" if "remote testing" in text_content else "No"
-        adaptive = "Yes" if "adaptive" in text_content or "irt" in text_content else "No"
-        return {
-            "Duration": duration,
-            "Test Type": test_type,
-            "Remote Testing Support": remote,
-            "Adaptive/IRT Support": adaptive
-        }
-    except Exception as e:
-        print(f"Error scraping {url}: {e}")
-        return {
-            "Duration": "N/A",
-            "Test Type": "N/A",
-            "Remote Testing Support": "No",
-            "Adaptive/IRT Support": "No"
-        }
-    finally:
-        driver.quit()
-#Scrape a single listing page to get assessment URLs and titles
-def scrape_page(url):
-    driver = init_driver()
-    driver.get(url)
-    # Lower the sleep time to speed up; adjust if your connection is slow.
-    time.sleep(2)
-    soup = BeautifulSoup(driver.page_source, "html.parser")
-    links = soup.find_all("a", href=True)
-    assessments = []
-    for link in links:
-        href = link["href"]
-        if "/product-catalog/view/" in href:
-            title = link.get_text(strip=True)
-            full_link = BASE_URL + href if href.startswith("/") else href
-            assessments.append({
-                "Assessment Name": title,
-                "URL": full_link
-            })
-    driver.quit()
-    return assessments
-#Scrape all pages (first scrape listings, then concurrently fetch details)
-def scrape_all_pages():
-    all_assessments = []
-    #Scrape type=1 pages
-    for start in tqdm(range(0, 384, 12), desc="Scraping Type 1 pages"):
-        url = f"{CATALOG_URL}?start={start}&type=1"
-        all_assessments.extend(scrape_page(url))
-    #Scrape type=2 pages
-    for start in tqdm(range(0, 144, 12), desc="Scraping Type 2 pages"):
-        url = f"{CATALOG_URL}?start={start}&type=2"
-        all_assessments.extend(scrape_page(url))
-    #Remove duplicate assessments based on URL
-    unique_assessments = {}
-    for item in all_assessments:
-        unique_assessments[item["URL"]] = item
-    all_assessments = list(unique_assessments.values())
-    #Now concurrently scrape details for each assessment
-    with concurrent.futures.ThreadPoolExecutor(max_workers=10) as executor:
-        future_to_item = {executor.submit(scrape_detail, item["URL"]): item for item in all_assessments}
-        for future in tqdm(concurrent.futures.as_completed(future_to_item), total=len(future_to_item),
-                           desc="Scraping Details"):
-            item = future_to_item[future]
-            details = future.result()
-            item.update(details)
-    return all_assessments
-#Save the scraped metadata to CSV and JSON files
-def save_metadata(data):
-    df = pd.DataFrame(data)
-    df.drop_duplicates(inplace=True)
-    df.to_csv("shl_metadata_index.csv", index=False)
-    with open("shl_metadata_index.json", "w") as f:
-        json.dump(data, f, indent=2)
-    print("Metadata saved to CSV and JSON.")
-if __name__ == "__main__":
-    print("Starting SHL scraper...")
-    all_assessments = scrape_all_pages()
-    print(f"Total assessments found: {len(all_assessments)}")
-    save_metadata(all_assessments)
+import os
+import re
+import json
+import time
+import queue
+import random
+import asyncio
+import argparse
+import threading
+from urllib.parse import parse_qs, urlencode, urljoin, urlsplit, urlunsplit
+import httpx
+from bs4 import BeautifulSoup
+import pandas as pd
+from tqdm import tqdm
+BASE_URL = "https://www.shl.com"
+CATALOG_URL = BASE_URL + "/solutions/products/product-catalog/"
+# type=1: Individual Test Solutions, type=2: Pre-packaged Job Solutions
+CATALOG_TYPES = (1, 2)
+CHECKPOINT_PATH = os.path.join("outputs", "scrape_checkpoint.jsonl")
+USER_AGENT = "Mozilla/5.0 (compatible; SHL-Assessment-Recommender/1.0)"
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+TYPE_MAPPING = {
+    "A": "Ability & Aptitude",
+    "B": "Biodata & Situational Judgement",
+    "C": "Competencies",
+    "D": "Development & 360",
+    "E": "Assessment Exercises",
+    "K": "Knowledge & Skills",
+    "P": "Personality & Behavior",
+    "S": "Simulations"
+}
+EMPTY_DETAILS = {
+    "Duration": "N/A",
+    "Test Type": "N/A",
+    "Remote Testing Support": "No",
+    "Adaptive/IRT Support": "No"
+}
+def log(msg):
+    print(f"[{time.strftime('%H:%M:%S')}] {msg}")
+#Parsing works on HTML strings only, so it can be exercised against saved pages
+def listing_url(catalog_type, start=0):
+    return f"{CATALOG_URL}?start={start}&type={catalog_type}"
+def parse_listing(html, page_url=CATALOG_URL):
+    soup = BeautifulSoup(html, "html.parser")
+    assessments = []
+    for link in soup.find_all("a", href=True):
+        href = link["href"]
+        if "/product-catalog/view/" in href:
+            assessments.append({
+                "Assessment Name": link.get_text(strip=True),
+                "URL": urljoin(page_url, href)
+            })
+    return assessments
+def discover_pages(html, page_url):
+    # Pagination only shows a window of page links, so the step between the visible offsets is used
+    # to fill in every page up to the highest offset linked for this catalog type
+    catalog_type = parse_qs(urlsplit(page_url).query).get("type", [None])[0]
+    soup = BeautifulSoup(html, "html.parser")
+    starts = {int(parse_qs(urlsplit(page_url).query).get("start", ["0"])[0])}
+    for link in soup.find_all("a", href=True):
+        query = parse_qs(urlsplit(urljoin(page_url, link["href"])).query)
+        if "start" in query and query.get("type", [None])[0] == catalog_type and query["start"][0].isdigit():
+            starts.add(int(query["start"][0]))
+    starts = sorted(starts)
+    steps = [b - a for a, b in zip(starts, starts[1:])]
+    if steps:
+        starts = range(0, starts[-1] + 1, min(steps))
+    return [_with_start(page_url, start) for start in starts]
+def _with_start(page_url, start):
+    parts = urlsplit(page_url)
+    query = {key: values[0] for key, values in parse_qs(parts.query).items()}
+    query["start"] = str(start)
+    return urlunsplit(parts._replace(query=urlencode(query)))
+def parse_detail(html):
+    soup = BeautifulSoup(html, "html.parser")
+    #Duration Extraction
+    duration = "N/A"
+    for tag in soup.find_all("p"):
+        if "approximate completion time" in tag.get_text().lower():
+            match = re.search(r"(\d+)", tag.get_text())
+            if match:
+                duration = int(match.group(1))
+            break
+    #Test Type Extraction
+    type_codes = []
+    type_block = soup.find(string=re.compile("test type", re.I))
+    if type_block:
+        container = type_block.find_parent()
+        if container:
+            found_codes = re.findall(r"\b([A-Z])\b", container.get_text(" ").strip())
+            type_codes = [TYPE_MAPPING[code] for code in found_codes if code in TYPE_MAPPING]
+    #Remote / Adaptive Flags
+    text_content = soup.get_text(separator="\n").lower()
+    return {
+        "Duration": duration,
+        "Test Type": ", ".join(type_codes) if type_codes else "N/A",
+        "Remote Testing Support": "Yes" if "remote testing" in text_content else "No",
+        "Adaptive/IRT Support": "Yes" if "adaptive" in text_content or "irt" in text_content else "No"
+    }
+def has_detail_content(html):
+    # Pages rendered client-side come back without the fact sheet; those go to the browser pool
+    text = BeautifulSoup(html, "html.parser").get_text(" ").lower()
+    return "approximate completion time" in text or "test type" in text
+class BrowserPool:
+    # A few headless Chrome instances created once and reused; only pages plain HTTP could not render use it
+    def __init__(self, size=2, page_timeout=15, acquire_timeout=120):
+        self.size = size
+        self.page_timeout = page_timeout
+        self.acquire_timeout = acquire_timeout
+        self._drivers = queue.Queue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self._driver_path = None
+    def _new_driver(self):
+        from selenium import webdriver
+        from selenium.webdriver.chrome.options import Options
+        from selenium.webdriver.chrome.service import Service
+        from webdriver_manager.chrome import ChromeDriverManager
+        if self._driver_path is None:
+            self._driver_path = ChromeDriverManager().install()
+        options = Options()
+        options.add_argument("--headless=new")
+        options.add_argument("--disable-gpu")
+        options.add_argument("--window-size=1920,1080")
+        driver = webdriver.Chrome(service=Service(self._driver_path), options=options)
+        driver.set_page_load_timeout(self.page_timeout)
+        return driver
+    def _acquire(self):
+        # A free driver, or a new one while the pool is below size. A failed launch gives its slot back, so
+        # waiting renders retry it instead of blocking on a driver that will never be returned.
+        deadline = time.monotonic() + self.acquire_timeout
+        while True:
+            with self._lock:
+                create = self._drivers.empty() and self._created < self.size
+                if create:
+                    self._created += 1
+            if create:
+                try:
+                    return self._new_driver()
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            try:
+                return self._drivers.get(timeout=min(1.0, self.acquire_timeout))
+            except queue.Empty:
+                if time.monotonic() >= deadline:
+                    raise TimeoutError(f"No browser became free within {self.acquire_timeout}s.")
+    def render(self, url):
+        from selenium.webdriver.common.by import By
+        from selenium.webdriver.support import expected_conditions
+        from selenium.webdriver.support.ui import WebDriverWait
+        driver = self._acquire()
+        try:
+            driver.get(url)
+            # Wait for content rather than sleeping a fixed time
+            WebDriverWait(driver, self.page_timeout).until(expected_conditions.presence_of_element_located((By.TAG_NAME, "main")))
+            return driver.page_source
+        finally:
+            self._drivers.put(driver)
+    def close(self):
+        while not self._drivers.empty():
+            self._drivers.get().quit()
+class Checkpoint:
+    # Append-only JSONL of finished pages and details, so an interrupted crawl resumes where it stopped
+    def __init__(self, path=CHECKPOINT_PATH, resume=True):
+        self.path = path
+        self.pages = {}
+        self.details = {}
+        if path and resume and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # A torn last line from an interrupted run
+                        continue
+                    (self.pages if entry["kind"] == "page" else self.details)[entry["url"]] = entry["data"]
+        elif path and os.path.exists(path):
+            os.remove(path)
+        self._file = None
+        if path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self._file = open(path, "a", encoding="utf-8")
+    def record(self, kind, url, data):
+        (self.pages if kind == "page" else self.details)[url] = data
+        if self._file:
+            self._file.write(json.dumps({"kind": kind, "url": url, "data": data}) + "\n")
+            self._file.flush()
+    def close(self):
+        if self._file:
+            self._file.close()
+async def fetch_html(client, url, retries=3, backoff=0.5):
+    # Exponential backoff with jitter on transport errors and 429/5xx, honouring Retry-After
+    for attempt in range(retries + 1):
+        try:
+            response = await client.get(url)
+            if response.status_code not in RETRY_STATUSES:
+                response.raise_for_status()
+                return response.text
+            delay = float(response.headers.get("Retry-After", 0) or 0)
+        except httpx.TransportError:
+            if attempt == retries:
+                raise
+            delay = 0
+        if attempt == retries:
+            response.raise_for_status()
+        await asyncio.sleep(max(delay, backoff * 2 ** attempt * (1 + random.random() / 2)))
+class Scraper:
+    def __init__(self, concurrency=16, browsers=2, retries=3, backoff=0.5, checkpoint=None, client=None, use_browser=True,
+                 on_record=None):
+        self.concurrency = concurrency
+        # Called with each finished assessment as soon as its details are in, for streaming consumers
+        self.on_record = on_record
+        self.retries = retries
+        self.backoff = backoff
+        self.checkpoint = checkpoint or Checkpoint(path=None)
+        self.client = client
+        self.browser_pool = BrowserPool(size=browsers) if use_browser and browsers > 0 else None
+        self.counters = {"http": 0, "browser": 0, "errors": 0, "resumed": 0}
+    async def _get(self, url, needs_content=None):
+        async with self._slots:
+            try:
+                html = await fetch_html(self.client, url, self.retries, self.backoff)
+                self.counters["http"] += 1
+                if needs_content is None or needs_content(html) or self.browser_pool is None:
+                    return html
+            except httpx.HTTPError as e:
+                if self.browser_pool is None:
+                    raise
+                log(f"HTTP fetch failed for {url} ({e}); falling back to a browser")
+        self.counters["browser"] += 1
+        return await asyncio.to_thread(self.browser_pool.render, url)
+    async def scrape_listings(self, catalog_types=CATALOG_TYPES):
+        # Listing pages are fetched in waves: each wave's pagination reveals the rest of the pages
+        seen, frontier, assessments = set(), [listing_url(t) for t in catalog_types], {}
+        progress = tqdm(desc="Scraping listing pages", unit="page")
+        while frontier:
+            seen.update(frontier)
+            results = await asyncio.gather(*[self._scrape_listing(url) for url in frontier])
+            next_frontier = set()
+            for items, pages in results:
+                for item in items:
+                    assessments[item["URL"]] = item
+                next_frontier.update(page for page in pages if page not in seen)
+            progress.update(len(results))
+            frontier = sorted(next_frontier)
+        progress.close()
+        return list(assessments.values())
+    async def _scrape_listing(self, url):
+        cached = self.checkpoint.pages.get(url)
+        if cached is not None:
+            self.counters["resumed"] += 1
+            return cached["items"], cached["pages"]
+        try:
+            html = await self._get(url, needs_content=lambda html: bool(parse_listing(html, url)))
+        except Exception as e:
+            self.counters["errors"] += 1
+            log(f"Error scraping {url}: {e}")
+            return [], []
+        items, pages = parse_listing(html, url), discover_pages(html, url)
+        self.checkpoint.record("page", url, {"items": items, "pages": pages})
+        return items, pages
+    async def scrape_details(self, assessments):
+        progress = tqdm(total=len(assessments), desc="Scraping Details")
+        async def scrape_one(item):
+            details = self.checkpoint.details.get(item["URL"])
+            if details is not None:
+                self.counters["resumed"] += 1
+            else:
+                try:
+                    details = parse_detail(await self._get(item["URL"], needs_content=has_detail_content))
+                    self.checkpoint.record("detail", item["URL"], details)
+                except Exception as e:
+                    self.counters["errors"] += 1
+                    log(f"Error scraping {item['URL']}: {e}")
+                    details = dict(EMPTY_DETAILS)
+            item.update(details)
+            progress.update(1)
+            if self.on_record is not None:
+                self.on_record(item)
+        await asyncio.gather(*[scrape_one(item) for item in assessments])
+        progress.close()
+        return assessments
+    async def run(self, catalog_types=CATALOG_TYPES):
+        self._slots = asyncio.Semaphore(self.concurrency)
+        owns_client = self.client is None
+        if owns_client:
+            limits = httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency)
+            self.client = httpx.AsyncClient(headers={"User-Agent": USER_AGENT}, limits=limits,
+                                            timeout=httpx.Timeout(15, connect=5), follow_redirects=True)
+        try:
+            assessments = await self.scrape_listings(catalog_types)
+            log(f"Found {len(assessments)} assessments on listing pages.")
+            return await self.scrape_details(assessments)
+        finally:
+            if owns_client:
+                await self.client.aclose()
+                self.client = None
+            if self.browser_pool is not None:
+                self.browser_pool.close()
+            self.checkpoint.close()
+#Crawl the catalog: discover listing pages, then fetch details concurrently
+def scrape_all_pages(concurrency=16, browsers=2, checkpoint_path=CHECKPOINT_PATH, resume=True):
+    scraper = Scraper(concurrency=concurrency, browsers=browsers, checkpoint=Checkpoint(checkpoint_path, resume=resume))
+    start = time.perf_counter()
+    assessments = asyncio.run(scraper.run())
+    log(f"Crawl finished in {time.perf_counter() - start:.1f}s ({scraper.counters})")
+    return assessments
+#Save the scraped metadata to CSV and JSON files
+def save_metadata(data):
+    df = pd.DataFrame(data)
+    df.drop_duplicates(inplace=True)
+    df.to_csv("shl_metadata_index.csv", index=False)
+    with open("shl_metadata_index.json", "w") as f:
+        json.dump(data, f, indent=2)
+    print("Metadata saved to CSV and JSON.")
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Scrape the SHL product catalog.")
+    parser.add_argument("--concurrency", type=int, default=16, help="Concurrent HTTP requests")
+    parser.add_argument("--browsers", type=int, default=2, help="Headless Chrome instances for JS-only pages (0 disables)")
+    parser.add_argument("--checkpoint", default=CHECKPOINT_PATH)
+    parser.add_argument("--fresh", action="store_true", help="Ignore an existing checkpoint and crawl from scratch")
+    args = parser.parse_args()
+    print("Starting SHL scraper...")
+    all_assessments = scrape_all_pages(args.concurrency, args.browsers, args.checkpoint, resume=not args.fresh)
+    print(f"Total assessments found: {len(all_assessments)}")
+    save_metadata(all_assessments)
@@ -0,0 +1,332 @@
+import os
+import json
+import argparse
+import sys
+import time
+import shutil
+import secrets
+import tempfile
+import threading
+import weakref
+import subprocess
+from datetime import datetime
+from multiprocessing.connection import Client, Listener
+import numpy as np
+import faiss
+from index_factory import RERANKED_KINDS, RerankedIndex, apply_search_params, build_index, read_index_mmap, search_ids, write_index
+# Shards live next to the full index: one FAISS file per shard, the id -> shard table and a manifest
+SHARDS_DIR_NAME = "shards"
+SHARDS_MANIFEST_NAME = "shards.json"
+SHARD_IDS_NAME = "shard_ids.npz"
+SHARD_BY = ("hash", "tenant")
+# Shared secret for shard servers. Messages are pickled, so there is no default: without it no shard server
+# listens and no coordinator connects. Local workers get a fresh random key per launch.
+AUTHKEY = os.environ.get("SHL_SHARD_AUTHKEY", "").encode("utf-8")
+def log(msg):
+    print(f"[{datetime.now().strftime('%H:%M:%S')}] {msg}")
+def shard_path(shards_dir, shard):
+    return os.path.join(shards_dir, f"shard_{shard:03d}.idx")
+def assign_shards(ids, tenants, n_shards, by="hash"):
+    # hash: ids are uniform 63-bit hashes, so id % n spreads every tenant over all shards.
+    # tenant: each tenant's vectors stay together; largest tenants go first onto the least loaded shard,
+    # so a tenant-restricted query only touches its own shard.
+    ids = np.asarray(ids, dtype=np.int64)
+    if by == "hash":
+        return (ids % n_shards).astype(np.int32), None
+    if by != "tenant":
+        raise ValueError(f"Unknown shard key '{by}'; expected one of {', '.join(SHARD_BY)}.")
+    names, inverse, counts = np.unique(np.asarray(tenants), return_inverse=True, return_counts=True)
+    loads = np.zeros(n_shards, dtype=np.int64)
+    shard_of_tenant = {}
+    for t in np.argsort(-counts, kind="stable"):
+        shard = int(np.argmin(loads))
+        shard_of_tenant[str(names[t])] = shard
+        loads[shard] += counts[t]
+    lookup = np.array([shard_of_tenant[str(name)] for name in names], dtype=np.int32)
+    return lookup[inverse], shard_of_tenant
+def write_shards(embeddings, ids, tenants, shards_dir, n_shards, by="hash", kind="flat", build_params=None,
+                 search_params=None, source=None, rerank_vectors=None):
+    # embeddings must be normalized like the full index; source: signature of the full index they mirror;
+    # rerank_vectors: file name, next to shards_dir, of the fp32 vectors reduced-precision kinds re-rank against
+    ids = np.asarray(ids, dtype=np.int64)
+    shard_of, shard_of_tenant = assign_shards(ids, tenants, n_shards, by)
+    # The set is written beside the live one and swapped in whole, like the startup bundle: workers keep the
+    # files they mmap'd, and nothing ever reads a mix of old and new shards
+    tmp_dir = f"{shards_dir}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    counts, config = [], None
+    for shard in range(n_shards):
+        members = np.flatnonzero(shard_of == shard)
+        counts.append(int(len(members)))
+        if not len(members):
+            continue
+        index, config = build_index(embeddings[members], ids[members], kind, build_params, search_params)
+        write_index(index, shard_path(tmp_dir, shard))
+    np.savez(os.path.join(tmp_dir, SHARD_IDS_NAME), ids=ids, shards=shard_of)
+    manifest = {
+        "n_shards": n_shards,
+        "by": by,
+        "kind": kind,
+        "dim": int(embeddings.shape[1]),
+        "metric": "ip",
+        "search": (config or {}).get("search", {}),
+        "counts": counts,
+        "tenants": shard_of_tenant,
+        "source": source,
+        "rerank_vectors": rerank_vectors if kind in RERANKED_KINDS else None,
+        "created": datetime.now().isoformat(timespec="seconds"),
+        # Workers report this back, so a coordinator never merges shards of two different builds
+        "build": secrets.token_hex(8),
+    }
+    with open(os.path.join(tmp_dir, SHARDS_MANIFEST_NAME), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    old_dir = f"{shards_dir}.old-{os.getpid()}"
+    if os.path.exists(shards_dir):
+        os.replace(shards_dir, old_dir)
+    os.replace(tmp_dir, shards_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+    log(f"Wrote {n_shards} shards by {by} to {shards_dir} (sizes {counts}).")
+    return manifest
+def read_shards_manifest(shards_dir):
+    path = os.path.join(shards_dir, SHARDS_MANIFEST_NAME)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+def serve(conn, shard, index_path, search_params=None, rerank=None, build=None):
+    # Request loop of one shard: ("info",), ("params", search_params) or ("search", query_vecs, k, ids or None)
+    # -> reply; ("close",) ends it. rerank: (vectors path, vector ids) for reduced-precision shards;
+    # build: the manifest build the files belong to
+    index = read_index_mmap(index_path) if os.path.exists(index_path) else None
+    if index is not None and rerank is not None:
+        index = RerankedIndex.open(index, *rerank)
+    if index is not None:
+        apply_search_params(index, search_params)
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            break
+        if message[0] == "close":
+            break
+        try:
+            if message[0] == "info":
+                conn.send(("ok", {"shard": shard, "ntotal": index.ntotal if index is not None else 0, "build": build}))
+                continue
+            if message[0] == "params":
+                if index is not None:
+                    apply_search_params(index, message[1])
+                conn.send(("ok", None))
+                continue
+            _, query_vecs, k, ids = message
+            conn.send(("ok", _search_shard(index, query_vecs, k, ids)))
+        except Exception as e:
+            conn.send(("error", f"{type(e).__name__}: {e}"))
+    conn.close()
+def _search_shard(index, query_vecs, k, ids):
+    empty = (np.empty((len(query_vecs), 0), dtype=np.float32), np.empty((len(query_vecs), 0), dtype=np.int64))
+    if index is None:
+        return empty
+    if ids is None:
+        return index.search(query_vecs, min(k, index.ntotal))
+    k = min(k, len(ids))
+    if not k:
+        return empty
+    if isinstance(index, RerankedIndex):
+        return index.search(query_vecs, k, ids)
+    return search_ids(index, query_vecs, k, ids)
+def require_authkey():
+    if not AUTHKEY:
+        raise RuntimeError("Set SHL_SHARD_AUTHKEY to a shared secret to serve or connect to shard servers.")
+    return AUTHKEY
+def parse_address(address, default_host="127.0.0.1"):
+    # "host:port" or ":port" (loopback) for TCP, anything else is a Unix socket path
+    host, sep, port = address.strip().rpartition(":")
+    if sep and port.isdigit() and os.sep not in address:
+        return (host or default_host, int(port))
+    return address
+def _connect(address, authkey, process=None, timeout=60.0):
+    # Retries until the worker listens; a local worker that died while starting is reported instead
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            conn = Client(address, authkey=authkey)
+            break
+        except (FileNotFoundError, ConnectionRefusedError):
+            if process is not None and process.poll() is not None:
+                raise RuntimeError(f"Shard worker for {address} exited with code {process.returncode}.")
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.05)
+    conn.send(("info",))
+    status, info = conn.recv()
+    if status != "ok":
+        raise RuntimeError(f"Shard worker at {address} failed: {info}")
+    return conn, info
+def _close_workers(connections, processes, workdir=None):
+    for conn in connections:
+        try:
+            conn.send(("close",))
+            conn.close()
+        except (OSError, ValueError):
+            pass
+    for process in processes:
+        try:
+            process.wait(timeout=1)
+        except subprocess.TimeoutExpired:
+            process.terminate()
+    if workdir:
+        shutil.rmtree(workdir, ignore_errors=True)
+def _check_build(manifest, info):
+    # A rebuild swapped in between reading the manifest and the worker opening its shard
+    if info.get("build") != manifest.get("build"):
+        raise RuntimeError(f"Shard {info['shard']} serves another build than '{manifest.get('build')}'; reopen the shards.")
+class ShardedIndex:
+    # Stands in for a FAISS index in the catalog: the query batch is sent to every shard holding eligible
+    # vectors, the shards search in parallel in their own processes, and the per-shard top-k lists are
+    # merged into one global top-k. Labels are the same external ids the full index uses.
+    def __init__(self, manifest, shard_ids, connections, processes=(), workdir=None):
+        self.manifest = manifest
+        self.n_shards = manifest["n_shards"]
+        self.d = manifest["dim"]
+        self.metric_type = faiss.METRIC_INNER_PRODUCT if manifest["metric"] == "ip" else faiss.METRIC_L2
+        self.ntotal = int(sum(manifest["counts"]))
+        self.connections = connections
+        order = np.argsort(shard_ids["ids"], kind="stable")
+        self._sorted_ids = shard_ids["ids"][order]
+        self._sorted_shards = shard_ids["shards"][order]
+        # One scatter-gather at a time: replies on a connection must match the request sent on it
+        self._lock = threading.Lock()
+        self._finalizer = weakref.finalize(self, _close_workers, list(connections.values()), list(processes), workdir)
+    @classmethod
+    def open(cls, shards_dir, workers="local"):
+        # workers: "local" starts one worker process per shard; otherwise a comma-separated list of shard
+        # server addresses (see `python sharded_search.py serve`)
+        manifest = read_shards_manifest(shards_dir)
+        if manifest is None:
+            raise FileNotFoundError(f"No shards in '{shards_dir}'.")
+        with np.load(os.path.join(shards_dir, SHARD_IDS_NAME)) as data:
+            shard_ids = {"ids": data["ids"], "shards": data["shards"]}
+        connections, processes, workdir = {}, [], None
+        try:
+            if workers == "local":
+                # Separate interpreters (not multiprocessing children), so nothing of the parent's __main__ is
+                # re-run; each serves one Unix socket and exits when the coordinator disconnects
+                workdir = tempfile.mkdtemp(prefix="shl-shards-")
+                authkey = secrets.token_hex(16)
+                env = dict(os.environ, SHL_SHARD_AUTHKEY=authkey)
+                started = {}
+                for shard in range(manifest["n_shards"]):
+                    if not manifest["counts"][shard]:
+                        continue
+                    address = os.path.join(workdir, f"shard-{shard}.sock")
+                    command = [sys.executable, os.path.abspath(__file__), "serve", "--shards-dir", os.path.abspath(shards_dir),
+                               "--shard", str(shard), "--address", address, "--once"]
+                    process = subprocess.Popen(command, env=env)
+                    processes.append(process)
+                    started[shard] = (address, process)
+                for shard, (address, process) in started.items():
+                    connections[shard], info = _connect(address, authkey.encode("utf-8"), process)
+                    _check_build(manifest, info)
+            else:
+                for address in workers.split(","):
+                    conn, info = _connect(parse_address(address), require_authkey())
+                    connections[info["shard"]] = conn
+                    _check_build(manifest, info)
+            missing = [s for s in range(manifest["n_shards"]) if manifest["counts"][s] and s not in connections]
+            if missing:
+                raise RuntimeError(f"No worker serves shard(s) {missing}.")
+        except Exception:
+            _close_workers(list(connections.values()), processes, workdir)
+            raise
+        return cls(manifest, shard_ids, connections, processes, workdir)
+    def shards_for_ids(self, ids):
+        ids = np.asarray(ids, dtype=np.int64)
+        pos = np.searchsorted(self._sorted_ids, ids).clip(0, max(len(self._sorted_ids) - 1, 0))
+        found = self._sorted_ids[pos] == ids
+        return np.where(found, self._sorted_shards[pos], -1)
+    def _scatter(self, requests):
+        # requests: shard -> message; sent to every shard before any reply is read, so shards work in parallel
+        with self._lock:
+            for shard, message in requests.items():
+                self.connections[shard].send(message)
+            replies = [self.connections[shard].recv() for shard in requests]
+        errors = [reply for status, reply in replies if status != "ok"]
+        if errors:
+            raise RuntimeError(f"Shard request failed: {errors[0]}")
+        return [reply for _, reply in replies]
+    def set_search_params(self, search_params):
+        self._scatter({shard: ("params", search_params) for shard in self.connections})
+    def search(self, query_vecs, k, ids=None):
+        # ids: restrict to these external ids; each shard only receives the ids it holds
+        query_vecs = np.ascontiguousarray(query_vecs, dtype=np.float32)
+        if ids is None:
+            requests = {shard: ("search", query_vecs, k, None) for shard in self.connections}
+        else:
+            ids = np.asarray(ids, dtype=np.int64)
+            shard_of = self.shards_for_ids(ids)
+            requests = {
+                shard: ("search", query_vecs, k, ids[shard_of == shard])
+                for shard in np.unique(shard_of[shard_of >= 0]).tolist()
+            }
+        return merge_topk(self._scatter(requests), k, len(query_vecs), self.metric_type)
+    def close(self):
+        self._finalizer()
+def merge_topk(results, k, n_queries, metric_type=faiss.METRIC_INNER_PRODUCT):
+    # Per-shard (D, I) lists -> global top-k per query; FAISS's -1 padding never outranks a real hit
+    results = [(D, I) for D, I in results if I.shape[1]]
+    if not results:
+        return np.empty((n_queries, 0), dtype=np.float32), np.empty((n_queries, 0), dtype=np.int64)
+    D = np.concatenate([D for D, _ in results], axis=1)
+    I = np.concatenate([I for _, I in results], axis=1)
+    worst = -np.inf if metric_type == faiss.METRIC_INNER_PRODUCT else np.inf
+    keys = np.where(I >= 0, D, worst)
+    keys = -keys if metric_type == faiss.METRIC_INNER_PRODUCT else keys
+    order = np.argsort(keys, axis=1, kind="stable")[:, :k]
+    return np.take_along_axis(D, order, axis=1).astype(np.float32), np.take_along_axis(I, order, axis=1)
+def _shard_args(shards_dir, shard):
+    manifest = read_shards_manifest(shards_dir)
+    if manifest is None:
+        raise FileNotFoundError(f"No shards in '{shards_dir}'; build them with generate_embeddings.py --shards N first.")
+    rerank = None
+    if manifest.get("rerank_vectors"):
+        # Rows of the fp32 vectors follow the id order of the full index, which the id table keeps
+        with np.load(os.path.join(shards_dir, SHARD_IDS_NAME)) as data:
+            vector_ids = data["ids"]
+        rerank = (os.path.join(os.path.dirname(os.path.abspath(shards_dir)), manifest["rerank_vectors"]), vector_ids)
+    return shard, shard_path(shards_dir, shard), manifest["search"], rerank, manifest.get("build")
+def _serve_connection(conn, shards_dir, shard):
+    # The shard is opened per connection, so coordinators that reconnect after a rebuild get the new files
+    try:
+        args = _shard_args(shards_dir, shard)
+    except (OSError, ValueError) as e:
+        conn.close()
+        log(f"Dropped a connection to shard {shard}: {e}")
+        return
+    serve(conn, *args)
+def serve_forever(shards_dir, shard, address, once=False):
+    # One shard behind a socket, e.g. on another machine; every coordinator gets its own connection and thread.
+    # once: serve a single connection and exit (local workers started by ShardedIndex.open)
+    _shard_args(shards_dir, shard)
+    authkey = require_authkey()
+    # ":port" listens on loopback only; other machines need an explicit host such as 0.0.0.0:port
+    listener = Listener(parse_address(address), authkey=authkey)
+    if once:
+        conn = listener.accept()
+        listener.close()
+        _serve_connection(conn, shards_dir, shard)
+        return
+    log(f"Serving shard {shard} of {shards_dir} on {address}...")
+    while True:
+        conn = listener.accept()
+        threading.Thread(target=_serve_connection, args=(conn, shards_dir, shard), daemon=True).start()
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve one shard of a sharded FAISS index.")
+    parser.add_argument("command", choices=["serve"])
+    parser.add_argument("--shards-dir", default=os.path.join("outputs", SHARDS_DIR_NAME))
+    parser.add_argument("--shard", type=int, required=True)
+    parser.add_argument("--address", required=True, help="host:port (:port is 127.0.0.1) to listen on, or a Unix socket path")
+    parser.add_argument("--once", action="store_true", help="exit after the first coordinator disconnects")
+    args = parser.parse_args()
+    serve_forever(args.shards_dir, args.shard, args.address, args.once)
@@ -0,0 +1,169 @@
+import os
+import json
+import shutil
+import argparse
+import numpy as np
+from datetime import datetime
+import model_service
+from catalog import (
+    INDEX_PATH, METADATA_PATH, TEXTS_PATH, USE_BUNDLE, Catalog, file_signature, open_index, watched_paths,
+)
+from index_factory import RerankedIndex, apply_search_params, load_index_params, write_index
+from lexical_index import LexicalIndex
+from sharded_search import ShardedIndex
+# Everything a serving process needs, in one directory next to the index: the FAISS index, the metadata,
+# texts, ids, filter and BM25 arrays as one uncompressed .npz, and a manifest pinning the model snapshot
+BUNDLE_DIR_NAME = "bundle"
+BUNDLE_VERSION = 2
+MANIFEST_NAME = "bundle.json"
+COLUMNS_NAME = "columns.npz"
+INDEX_NAME = "faiss_index.idx"
+STRING_COLUMNS = ("names", "urls", "texts", "tenant_names")
+def log(msg):
+    print(f"[{datetime.now().strftime('%H:%M:%S')}] {msg}")
+def bundle_dir_for(index_path=INDEX_PATH):
+    return os.path.join(os.path.dirname(index_path), BUNDLE_DIR_NAME)
+def _pack_strings(strings):
+    # Arrow-style string column: one UTF-8 buffer plus offsets, so loading is a single decode per value
+    encoded = [(s or "").encode("utf-8") for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(b) for b in encoded])
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+def _unpack_strings(data, offsets):
+    buffer = data.tobytes()
+    bounds = offsets.tolist()
+    return [buffer[start:end].decode("utf-8") for start, end in zip(bounds[:-1], bounds[1:])]
+def _sources(index_path, texts_path, metadata_path):
+    # Stat signature of the files the bundle was built from; JSON round-trips tuples as lists
+    return [list(s) if s is not None else None for s in file_signature(watched_paths(index_path, texts_path, metadata_path))]
+def write_bundle(catalog, bundle_dir, sources, model_path=None, search_params=None):
+    columns = {
+        "ids": catalog.ids,
+        "durations": catalog.durations,
+        "type_masks": catalog.type_masks,
+        "remote": catalog.remote,
+        "adaptive": catalog.adaptive,
+        "tenants": catalog.tenants,
+    }
+    texts = catalog.texts if catalog.texts is not None else [""] * len(catalog)
+    for name, values in zip(STRING_COLUMNS, (catalog.names, catalog.urls, texts, catalog.tenant_names)):
+        columns[f"{name}.data"], columns[f"{name}.offsets"] = _pack_strings(values)
+    columns.update({f"filter.{key}": value for key, value in catalog.filter_index.items()})
+    lexical = catalog.lexical_index()
+    columns.update({
+        "lexical.terms": lexical.terms, "lexical.indptr": lexical.indptr,
+        "lexical.doc_rows": lexical.doc_rows, "lexical.weights": lexical.weights,
+    })
+    rerank_vectors = None
+    if isinstance(catalog.index, RerankedIndex):
+        # Only the reduced-precision first pass is bundled; the fp32 vectors stay in the output directory
+        columns["rerank.ids"] = catalog.index.vector_ids
+        rerank_vectors = os.path.basename(catalog.index.vectors_path)
+    manifest = {
+        "version": BUNDLE_VERSION,
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "size": len(catalog),
+        "model_name": model_service.MODEL_NAME,
+        "model_path": model_path,
+        "instruction": model_service.INSTRUCTION,
+        "search_params": search_params or {},
+        "rerank_vectors": rerank_vectors,
+        "sources": sources,
+    }
+    # Written beside the live bundle and swapped in; readers seeing no bundle mid-swap fall back to the files
+    tmp_dir = f"{bundle_dir}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    write_index(catalog.index, os.path.join(tmp_dir, INDEX_NAME))
+    np.savez(os.path.join(tmp_dir, COLUMNS_NAME), **columns)
+    with open(os.path.join(tmp_dir, MANIFEST_NAME), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    old_dir = f"{bundle_dir}.old-{os.getpid()}"
+    if os.path.exists(bundle_dir):
+        os.replace(bundle_dir, old_dir)
+    os.replace(tmp_dir, bundle_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+    return manifest
+def read_manifest(bundle_dir):
+    path = os.path.join(bundle_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return manifest if manifest.get("version") == BUNDLE_VERSION else None
+def is_current(bundle_dir, index_path=INDEX_PATH, texts_path=TEXTS_PATH, metadata_path=METADATA_PATH):
+    # A bundle only stands in for the files it was built from; any later rebuild or refresh makes it stale
+    manifest = read_manifest(bundle_dir)
+    return manifest is not None and manifest["sources"] == _sources(index_path, texts_path, metadata_path)
+def open_bundle(bundle_dir, signature=None):
+    # One manifest read, one mmap'd index read and one .npz read; no JSON parsing and no pandas
+    manifest = read_manifest(bundle_dir)
+    if manifest is None:
+        raise FileNotFoundError(f"No startup bundle in '{bundle_dir}'.")
+    # With SHL_SHARDS set, the shards split from the full index next to the bundle are searched instead
+    output_dir = os.path.dirname(bundle_dir)
+    index = open_index(os.path.join(bundle_dir, INDEX_NAME), os.path.join(output_dir, os.path.basename(INDEX_PATH)))
+    with np.load(os.path.join(bundle_dir, COLUMNS_NAME)) as data:
+        columns = {key: data[key] for key in data.files}
+    if manifest.get("rerank_vectors") and not isinstance(index, ShardedIndex):
+        index = RerankedIndex.open(index, os.path.join(output_dir, manifest["rerank_vectors"]), columns["rerank.ids"])
+    if not isinstance(index, ShardedIndex):
+        apply_search_params(index, manifest.get("search_params"))
+    names, urls, texts, tenant_names = (_unpack_strings(columns[f"{name}.data"], columns[f"{name}.offsets"]) for name in STRING_COLUMNS)
+    filter_index = {key[len("filter."):]: value for key, value in columns.items() if key.startswith("filter.")}
+    lexical = LexicalIndex(
+        columns["lexical.terms"], columns["lexical.indptr"], columns["lexical.doc_rows"], columns["lexical.weights"],
+        manifest["size"],
+    )
+    return Catalog(
+        index=index,
+        texts=texts,
+        names=names,
+        urls=urls,
+        durations=columns["durations"],
+        type_masks=columns["type_masks"],
+        remote=columns["remote"],
+        adaptive=columns["adaptive"],
+        signature=signature,
+        filter_index=filter_index,
+        ids=columns["ids"],
+        lexical=lexical,
+        tenants=columns["tenants"],
+        tenant_names=tenant_names,
+    )
+def pin_model(bundle_dir=None):
+    # Called once when a process starts (API, UI, CLI), never on catalog loads: the encoder then loads from
+    # the snapshot the bundle pins instead of resolving the model name through the hub cache.
+    # SHL_MODEL_PATH or another configured model wins.
+    manifest = read_manifest(bundle_dir or bundle_dir_for()) if USE_BUNDLE else None
+    model_path = (manifest or {}).get("model_path")
+    if (model_path and model_service.MODEL_PATH is None and manifest.get("model_name") == model_service.MODEL_NAME
+            and os.path.isdir(model_path)):
+        model_service.configure(model_path=model_path)
+        return model_path
+    return None
+def build_bundle(index_path=INDEX_PATH, texts_path=TEXTS_PATH, metadata_path=METADATA_PATH, model_path=None, snapshot=False):
+    # model_path: local model directory to pin; snapshot=True resolves MODEL_NAME to its HF cache snapshot
+    sources = _sources(index_path, texts_path, metadata_path)
+    catalog = Catalog.from_files(index_path, texts_path, metadata_path)
+    if model_path is None and snapshot:
+        model_path = model_service.resolve_snapshot()
+    if model_path is None:
+        # Keep the pin of the bundle being replaced when it was for the same model
+        previous = read_manifest(bundle_dir_for(index_path))
+        if previous and previous.get("model_name") == model_service.MODEL_NAME:
+            model_path = previous.get("model_path")
+    config = load_index_params(os.path.dirname(index_path)) or {}
+    bundle_dir = bundle_dir_for(index_path)
+    manifest = write_bundle(catalog, bundle_dir, sources, model_path, config.get("search"))
+    log(f"Startup bundle written to {bundle_dir} ({manifest['size']} assessments, model {model_path or manifest['model_name']}).")
+    return manifest
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pack index, metadata and a pinned model path into the startup bundle.")
+    parser.add_argument("--model-path", help="local model directory to load the encoder from")
+    parser.add_argument("--snapshot", action="store_true", help="pin the HF cache snapshot of the configured model")
+    args = parser.parse_args()
+    build_bundle(model_path=os.path.abspath(args.model_path) if args.model_path else None, snapshot=args.snapshot)
@@ -0,0 +1,204 @@
+import os
+import sys
+import json
+import time
+import bisect
+import random
+import threading
+from collections import Counter
+from contextlib import contextmanager
+# SHL_TELEMETRY=0 turns every timer into a shared no-op context manager
+ENABLED = os.environ.get("SHL_TELEMETRY", "1") != "0"
+# One JSON line per finished request trace on stderr
+TRACE_LOG = os.environ.get("SHL_TRACE_LOG", "0") != "0"
+# Fraction of request traces that also get a sampling profile
+PROFILE_SAMPLE = float(os.environ.get("SHL_PROFILE_SAMPLE", 0))
+PROFILE_INTERVAL = float(os.environ.get("SHL_PROFILE_INTERVAL_MS", 5)) / 1000.0
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+PREFIX = "shl_"
+_lock = threading.Lock()
+_counters = {}
+_histograms = {}
+_local = threading.local()
+def _key(name, labels):
+    return name, tuple(sorted((labels or {}).items()))
+def inc(name, value=1, **labels):
+    if not ENABLED:
+        return
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+def observe(name, seconds, **labels):
+    if not ENABLED:
+        return
+    key = _key(name, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = {"buckets": [0] * (len(BUCKETS) + 1), "sum": 0.0, "count": 0}
+        histogram["buckets"][bisect.bisect_left(BUCKETS, seconds)] += 1
+        histogram["sum"] += seconds
+        histogram["count"] += 1
+def reset():
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{str(v)}"' for k, v in pairs) + "}"
+def prometheus_text():
+    # Prometheus text exposition format (version 0.0.4)
+    with _lock:
+        counters = dict(_counters)
+        histograms = {key: dict(h, buckets=list(h["buckets"])) for key, h in _histograms.items()}
+    lines = []
+    for name in sorted({name for name, _ in counters}):
+        lines.append(f"# TYPE {PREFIX}{name} counter")
+        for (metric, labels), value in sorted(counters.items()):
+            if metric == name:
+                lines.append(f"{PREFIX}{name}{_format_labels(labels)} {value}")
+    for name in sorted({name for name, _ in histograms}):
+        lines.append(f"# TYPE {PREFIX}{name} histogram")
+        for (metric, labels), h in sorted(histograms.items()):
+            if metric != name:
+                continue
+            cumulative = 0
+            for bound, count in zip(list(BUCKETS) + ["+Inf"], h["buckets"]):
+                cumulative += count
+                lines.append(f"{PREFIX}{name}_bucket{_format_labels(labels, [('le', bound)])} {cumulative}")
+            lines.append(f"{PREFIX}{name}_sum{_format_labels(labels)} {h['sum']:.6f}")
+            lines.append(f"{PREFIX}{name}_count{_format_labels(labels)} {h['count']}")
+    return "\n".join(lines) + "\n"
+class Trace:
+    # Per-request timing breakdown. Stages run while a trace is active on a thread are recorded into it,
+    # including stages run on the micro-batcher thread on the request's behalf.
+    def __init__(self, name="recommend", profile=None):
+        self.name = name
+        self.spans = []
+        self.started = time.perf_counter()
+        self.total_ms = None
+        self.profile = Counter() if (profile if profile is not None else random.random() < PROFILE_SAMPLE) else None
+        self._lock = threading.Lock()
+    def add(self, stage, seconds):
+        with self._lock:
+            self.spans.append((stage, round(seconds * 1000, 3)))
+    def finish(self):
+        self.total_ms = round((time.perf_counter() - self.started) * 1000, 3)
+        if TRACE_LOG:
+            print(json.dumps(self.to_dict(top_stacks=10)), file=sys.stderr)
+        return self
+    def breakdown(self):
+        totals = {}
+        for stage, ms in self.spans:
+            totals[stage] = round(totals.get(stage, 0.0) + ms, 3)
+        return totals
+    def to_dict(self, top_stacks=20):
+        data = {"trace": self.name, "total_ms": self.total_ms, "stages": self.breakdown()}
+        if self.profile is not None:
+            data["profile"] = self.top_stacks(top_stacks)
+        return data
+    def top_stacks(self, n=20):
+        # Collapsed stacks ("outer;inner" -> samples), the input format of flame graph tools
+        with self._lock:
+            return dict(self.profile.most_common(n))
+def _active():
+    return getattr(_local, "traces", ())
+class _Stage:
+    __slots__ = ("name", "start")
+    def __init__(self, name):
+        self.name = name
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self.start
+        observe("stage_seconds", elapsed, stage=self.name)
+        if exc_type is not None:
+            inc("stage_errors_total", stage=self.name)
+        for trace in _active():
+            trace.add(self.name, elapsed)
+        return False
+class _NoOp:
+    __slots__ = ()
+    def __enter__(self):
+        return self
+    def __exit__(self, exc_type, exc, tb):
+        return False
+_NOOP = _NoOp()
+def stage(name):
+    return _Stage(name) if ENABLED else _NOOP
+def timed(name):
+    def decorate(fn):
+        if not ENABLED:
+            return fn
+        def wrapper(*args, **kwargs):
+            with _Stage(name):
+                return fn(*args, **kwargs)
+        wrapper.__name__ = fn.__name__
+        wrapper.__doc__ = fn.__doc__
+        wrapper.__wrapped__ = fn
+        return wrapper
+    return decorate
+@contextmanager
+def activate(traces):
+    # Makes the given traces current on this thread; profiled ones get this thread sampled meanwhile
+    traces = [t for t in traces if t is not None]
+    if not ENABLED or not traces:
+        yield
+        return
+    previous = _active()
+    _local.traces = tuple(previous) + tuple(traces)
+    profiled = [t for t in traces if t.profile is not None]
+    if profiled:
+        _sampler.watch(threading.get_ident(), profiled)
+    try:
+        yield
+    finally:
+        if profiled:
+            _sampler.unwatch(threading.get_ident(), profiled)
+        _local.traces = previous
+class _Sampler:
+    # Stack sampler over sys._current_frames(); it only runs while some profiled trace is active
+    def __init__(self, interval):
+        self.interval = interval
+        self._watched = {}
+        self._lock = threading.Lock()
+        self._thread = None
+    def watch(self, thread_id, traces):
+        with self._lock:
+            self._watched.setdefault(thread_id, []).extend(traces)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="telemetry-sampler", daemon=True)
+                self._thread.start()
+    def unwatch(self, thread_id, traces):
+        with self._lock:
+            remaining = [t for t in self._watched.get(thread_id, []) if t not in traces]
+            if remaining:
+                self._watched[thread_id] = remaining
+            else:
+                self._watched.pop(thread_id, None)
+    def _run(self):
+        while True:
+            with self._lock:
+                watched = {tid: list(traces) for tid, traces in self._watched.items()}
+                if not watched:
+                    self._thread = None
+                    return
+            frames = sys._current_frames()
+            for thread_id, traces in watched.items():
+                frame = frames.get(thread_id)
+                if frame is None:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                collapsed = ";".join(reversed(stack))
+                for trace in traces:
+                    with trace._lock:
+                        trace.profile[collapsed] += 1
+            time.sleep(self.interval)
+_sampler = _Sampler(PROFILE_INTERVAL)
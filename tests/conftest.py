@@ -0,0 +1,32 @@
+import os
+import sys
+import numpy as np
+import pytest
+# The modules are flat scripts at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from catalog import Catalog, assessment_id
+from index_factory import build_index
+FIXTURE_RECORDS = [
+    {"Assessment Name": "Java Programming", "URL": "https://example.com/java", "Duration": 30, "Test Type": ["technical"]},
+    {"Assessment Name": "Python Coding", "URL": "https://example.com/python", "Duration": 20, "Test Type": ["technical"]},
+    {"Assessment Name": "SQL Server", "URL": "https://example.com/sql", "Duration": 15, "Test Type": ["technical"]},
+    {"Assessment Name": "Verbal Reasoning", "URL": "https://example.com/verbal", "Duration": 25, "Test Type": ["cognitive"]},
+    {"Assessment Name": "Occupational Personality Questionnaire", "URL": "https://example.com/opq", "Duration": 40,
+     "Test Type": ["personality"]},
+    {"Assessment Name": "Sales Simulation", "URL": "https://example.com/sales", "Duration": 60, "Test Type": ["simulation"]},
+]
+FIXTURE_TEXTS = [
+    "Java Programming | Knowledge of Java classes and the JVM",
+    "Python Coding | Writing Python scripts and data pipelines",
+    "SQL Server | Querying relational databases with SQL",
+    "Verbal Reasoning | Reading comprehension and verbal logic",
+    "Occupational Personality Questionnaire | Workplace behaviour and personality",
+    "Sales Simulation | Role play of a customer sales call",
+]
+@pytest.fixture
+def fixture_catalog():
+    # Six assessments with one-hot vectors: a query for row r is vector r, so dense ranks are known in advance
+    vectors = np.eye(len(FIXTURE_RECORDS), 8, dtype=np.float32)
+    ids = np.array([assessment_id(r) for r in FIXTURE_RECORDS], dtype=np.int64)
+    index, _ = build_index(vectors, ids, "flat")
+    return Catalog.from_records(index, list(FIXTURE_TEXTS), [dict(r) for r in FIXTURE_RECORDS], ids=ids)
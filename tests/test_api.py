@@ -0,0 +1,126 @@
+import asyncio
+import threading
+import httpx
+import pytest
+import api
+from micro_batcher import MicroBatcher
+RESULTS = [("Java Programming", "https://example.com/java", 0.0325, 0.9)]
+def _client(app):
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test")
+@pytest.fixture
+def release():
+    # Requests handled by the stub batcher block until the test sets this event
+    event = threading.Event()
+    yield event
+    event.set()
+@pytest.fixture
+def app(monkeypatch, release):
+    batcher = MicroBatcher(lambda items: [release.wait(5) and RESULTS for _ in items], max_wait_ms=1)
+    monkeypatch.setattr(api, "get_batcher", lambda: batcher)
+    monkeypatch.setattr(api, "recommend_batch", lambda texts, filters, traces=None: [RESULTS for _ in texts])
+    app = api.create_app(warm_up=False)
+    app.state.service["serving"] = app.state.service["ready"] = True
+    yield app
+    release.set()
+    batcher.close()
+def test_recommend_returns_results(app, release):
+    release.set()
+    async def run():
+        async with _client(app) as client:
+            return await client.post("/recommend", json={"query": "java developer"})
+    response = asyncio.run(run())
+    assert response.status_code == 200
+    assert response.json()["results"] == [
+        {"name": "Java Programming", "url": "https://example.com/java", "score": 0.0325, "similarity": 0.9},
+    ]
+def test_blank_query_is_rejected(app):
+    async def run():
+        async with _client(app) as client:
+            single = await client.post("/recommend", json={"query": "  \n\t"})
+            batch = await client.post("/recommend/batch", json={"requests": [{"query": " "}]})
+            return single, batch
+    single, batch = asyncio.run(run())
+    assert single.status_code == 422
+    assert batch.status_code == 422
+def test_requests_beyond_capacity_get_429(app, release, monkeypatch):
+    monkeypatch.setattr(api, "MAX_IN_FLIGHT", 2)
+    async def run():
+        async with _client(app) as client:
+            held = [asyncio.create_task(client.post("/recommend", json={"query": f"query {i}"})) for i in range(2)]
+            while app.state.service["in_flight"] < 2:
+                await asyncio.sleep(0.01)
+            rejected = await client.post("/recommend", json={"query": "one too many"})
+            release.set()
+            return rejected, await asyncio.gather(*held)
+    rejected, held = asyncio.run(run())
+    assert rejected.status_code == 429
+    assert [r.status_code for r in held] == [200, 200]
+    assert app.state.service["in_flight"] == 0
+def test_batch_counts_every_query_against_capacity(app, monkeypatch):
+    monkeypatch.setattr(api, "MAX_IN_FLIGHT", 2)
+    async def run():
+        async with _client(app) as client:
+            return await client.post("/recommend/batch", json={"requests": [{"query": f"q{i}"} for i in range(3)]})
+    assert asyncio.run(run()).status_code == 429
+def test_slow_requests_time_out_with_504(app, monkeypatch):
+    monkeypatch.setattr(api, "REQUEST_TIMEOUT", 0.1)
+    async def run():
+        async with _client(app) as client:
+            return await client.post("/recommend", json={"query": "never answered"})
+    response = asyncio.run(run())
+    assert response.status_code == 504
+def test_timed_out_work_keeps_its_slot_until_it_finishes(app, release, monkeypatch):
+    # The 504 is sent while the batcher is still computing; that work counts against capacity until it is done
+    monkeypatch.setattr(api, "REQUEST_TIMEOUT", 0.2)
+    monkeypatch.setattr(api, "MAX_IN_FLIGHT", 1)
+    async def run():
+        async with _client(app) as client:
+            timed_out = await client.post("/recommend", json={"query": "slow"})
+            still_busy = await client.post("/recommend", json={"query": "next"})
+            held = app.state.service["in_flight"]
+            release.set()
+            while app.state.service["in_flight"]:
+                await asyncio.sleep(0.01)
+            after = await client.post("/recommend", json={"query": "next"})
+            return timed_out, still_busy, held, after
+    timed_out, still_busy, held, after = asyncio.run(run())
+    assert timed_out.status_code == 504
+    assert still_busy.status_code == 429
+    assert held == 1
+    assert after.status_code == 200
+def test_batch_slot_is_held_by_the_running_batch(app, monkeypatch):
+    finished = threading.Event()
+    def slow_batch(texts, filters, traces=None):
+        finished.wait(5)
+        return [RESULTS for _ in texts]
+    monkeypatch.setattr(api, "recommend_batch", slow_batch)
+    monkeypatch.setattr(api, "REQUEST_TIMEOUT", 0.2)
+    monkeypatch.setattr(api, "MAX_IN_FLIGHT", 2)
+    async def run():
+        async with _client(app) as client:
+            timed_out = await client.post("/recommend/batch", json={"requests": [{"query": "a"}, {"query": "b"}]})
+            rejected = await client.post("/recommend", json={"query": "c"})
+            finished.set()
+            while app.state.service["in_flight"]:
+                await asyncio.sleep(0.01)
+            return timed_out, rejected
+    timed_out, rejected = asyncio.run(run())
+    assert (timed_out.status_code, rejected.status_code) == (504, 429)
+def test_queries_wait_for_the_catalog(app):
+    app.state.service["serving"] = app.state.service["ready"] = False
+    async def run():
+        async with _client(app) as client:
+            return await client.post("/recommend", json={"query": "java"}), await client.get("/ready")
+    query, ready = asyncio.run(run())
+    assert query.status_code == 503
+    assert ready.status_code == 503
+def test_ready_waits_for_the_model_while_serving_lexically(app):
+    # Catalog loaded, model still warming up: queries are admitted (BM25 fallback) but /ready is not ready yet
+    app.state.service["ready"] = False
+    async def run():
+        async with _client(app) as client:
+            return await client.get("/ready")
+    response = asyncio.run(run())
+    assert response.status_code == 503
+    body = response.json()
+    assert body["serving"] is True and body["ready"] is False and body["dense"] is False
@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+import embedding_cache
+from embedding_cache import EmbeddingCache, cache_key
+class Clock:
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+    def __call__(self):
+        return self.now
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(embedding_cache.time, "time", clock)
+    return clock
+def vec(value):
+    return np.full(4, value, dtype=np.float32)
+def test_key_ignores_whitespace_and_unicode_forms_but_not_model():
+    assert cache_key("Java  developer\n", "instr", "m") == cache_key("Java developer", "instr", "m")
+    assert cache_key("ｊａｖａ", "instr", "m") == cache_key("java", "instr", "m")
+    assert cache_key("java", "instr", "m") != cache_key("java", "instr", "other-model")
+def test_least_recently_used_entry_is_evicted(clock):
+    cache = EmbeddingCache(max_entries=2, ttl_seconds=None)
+    cache.put("a", vec(1))
+    cache.put("b", vec(2))
+    assert cache.get("a") is not None
+    cache.put("c", vec(3))
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
+    assert cache.stats()["evictions"] == 1
+def test_entries_expire_after_the_ttl(clock):
+    cache = EmbeddingCache(ttl_seconds=60)
+    cache.put("a", vec(1))
+    clock.now += 59
+    assert cache.get("a") is not None
+    clock.now += 2
+    assert cache.get("a") is None
+    stats = cache.stats()
+    assert stats["expirations"] == 1 and stats["entries"] == 0
+def test_cached_vectors_are_read_only_copies(clock):
+    cache = EmbeddingCache()
+    original = vec(1)
+    cache.put("a", original)
+    original[:] = 5
+    cached = cache.get("a")
+    np.testing.assert_array_equal(cached, vec(1))
+    with pytest.raises(ValueError):
+        cached[0] = 2
+def test_sqlite_tier_survives_a_restart(tmp_path, clock):
+    path = str(tmp_path / "cache" / "embeddings.sqlite")
+    EmbeddingCache(persist_path=path).put("a", vec(1))
+    restarted = EmbeddingCache(persist_path=path)
+    np.testing.assert_array_equal(restarted.get("a"), vec(1))
+    assert restarted.get("a") is not None
+    stats = restarted.stats()
+    assert stats["disk_hits"] == 1 and stats["hits"] == 1 and stats["hit_rate"] == 1.0
+def test_sqlite_tier_respects_the_ttl_and_purge(tmp_path, clock):
+    path = str(tmp_path / "embeddings.sqlite")
+    cache = EmbeddingCache(ttl_seconds=60, persist_path=path)
+    cache.put("old", vec(1))
+    clock.now += 30
+    cache.put("new", vec(2))
+    clock.now += 40
+    assert EmbeddingCache(ttl_seconds=60, persist_path=path).get("old") is None
+    cache.purge_expired()
+    rows = cache._db.execute("SELECT key FROM embeddings").fetchall()
+    assert rows == [("new",)]
+    assert cache.get("new") is not None
+def test_evicted_entries_come_back_from_disk(tmp_path, clock):
+    cache = EmbeddingCache(max_entries=1, persist_path=str(tmp_path / "embeddings.sqlite"))
+    cache.put("a", vec(1))
+    cache.put("b", vec(2))
+    np.testing.assert_array_equal(cache.get("a"), vec(1))
+    assert cache.stats()["disk_hits"] == 1
@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+from handle_query import hybrid_rank
+from scoring import RRF_K, reciprocal_rank_fusion
+def test_rows_ranked_by_both_lists_come_first():
+    rows, scores = reciprocal_rank_fusion([[5, 1, 2], [7, 1, 2]])
+    assert rows.tolist() == [1, 2, 5, 7]
+    assert scores[0] == pytest.approx(2 / (RRF_K + 2))
+    assert scores[-1] == pytest.approx(1 / (RRF_K + 1))
+def test_scores_sum_reciprocal_ranks():
+    rows, scores = reciprocal_rank_fusion([[1, 2, 3], [3, 1]])
+    assert rows.tolist() == [1, 3, 2]
+    expected = {1: 1 / 61 + 1 / 62, 3: 1 / 63 + 1 / 61, 2: 1 / 62}
+    assert scores.tolist() == pytest.approx([expected[r] for r in rows.tolist()])
+def test_ties_keep_ascending_row_order():
+    rows, _ = reciprocal_rank_fusion([[4, 9], [9, 4]])
+    assert rows.tolist() == [4, 9]
+def test_empty_rankings_are_ignored():
+    rows, scores = reciprocal_rank_fusion([[], np.array([3, 1])])
+    assert rows.tolist() == [3, 1]
+    rows, scores = reciprocal_rank_fusion([[], []])
+    assert len(rows) == 0 and len(scores) == 0
+def test_hybrid_rank_adds_lexical_matches_with_their_cosines(fixture_catalog):
+    # Dense search only returns "Java Programming"; BM25 adds "SQL Server", whose similarity is its own cosine
+    query = np.zeros(8, dtype=np.float32)
+    query[0], query[2] = 1.0, 0.5
+    query /= np.linalg.norm(query)
+    D, I = fixture_catalog.search(query.reshape(1, -1), 1)
+    results = hybrid_rank(D[0], I[0], query, "relational SQL databases", fixture_catalog, top_k=5)
+    assert [name for name, _, _, _ in results] == ["Java Programming", "SQL Server"]
+    assert [similarity for _, _, _, similarity in results] == pytest.approx([query[0], query[2]])
+    # The score is the fused one: each was ranked first by one side only
+    assert [score for _, _, score, _ in results] == pytest.approx([1 / (RRF_K + 1)] * 2)
+def test_hybrid_rank_respects_the_hard_filter(fixture_catalog):
+    # "Sales Simulation" (60 minutes) matches the text but is outside max_duration, so it never appears
+    allowed = fixture_catalog.allowed_rows(max_duration=30)
+    query = np.eye(1, 8, 1, dtype=np.float32)
+    D, I = fixture_catalog.search(query, 3, allowed)
+    results = hybrid_rank(D[0], I[0], query[0], "sales call role play", fixture_catalog, top_k=5, allowed=allowed)
+    names = [name for name, _, _, _ in results]
+    assert names[0] == "Python Coding"
+    assert "Sales Simulation" not in names
+    scores = [score for _, _, score, _ in results]
+    assert scores == sorted(scores, reverse=True)
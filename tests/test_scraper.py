@@ -0,0 +1,84 @@
+import os
+import asyncio
+import httpx
+import pytest
+import scraper
+from scraper import BrowserPool, Checkpoint, Scraper, discover_pages, listing_url, parse_detail, parse_listing
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+def fixture(name):
+    with open(os.path.join(FIXTURES, name), "r", encoding="utf-8") as f:
+        return f.read()
+def site(failures=None, calls=None):
+    # Serves the saved pages for catalog type 1; failures: url -> status codes returned before the page
+    pages = {listing_url(1, start): fixture(f"listing_start{start}.html") for start in (0, 12, 24)}
+    def handle(request):
+        url = str(request.url)
+        if calls is not None:
+            calls.append(url)
+        pending = (failures or {}).get(url)
+        if pending:
+            return httpx.Response(pending.pop(0))
+        if "/view/" in url:
+            return httpx.Response(200, text=fixture("detail.html"))
+        if url in pages:
+            return httpx.Response(200, text=pages[url])
+        return httpx.Response(404)
+    return httpx.AsyncClient(transport=httpx.MockTransport(handle))
+def crawl(client, checkpoint=None):
+    engine = Scraper(concurrency=4, backoff=0, client=client, use_browser=False, checkpoint=checkpoint)
+    return asyncio.run(engine.run(catalog_types=(1,))), engine
+def test_parse_listing_resolves_product_links():
+    items = parse_listing(fixture("listing_start0.html"), listing_url(1))
+    assert items == [
+        {"Assessment Name": "Java 8 (New)", "URL": scraper.BASE_URL + "/solutions/products/product-catalog/view/java-8-new/"},
+        {"Assessment Name": "Python (New)", "URL": scraper.BASE_URL + "/solutions/products/product-catalog/view/python-new/"},
+    ]
+def test_discover_pages_fills_the_pagination_window_for_its_type():
+    pages = discover_pages(fixture("listing_start0.html"), listing_url(1))
+    assert [page.split("?")[1] for page in pages] == ["start=0&type=1", "start=12&type=1", "start=24&type=1"]
+def test_parse_detail_reads_the_fact_sheet():
+    assert parse_detail(fixture("detail.html")) == {
+        "Duration": 18,
+        "Test Type": "Knowledge & Skills, Personality & Behavior",
+        "Remote Testing Support": "Yes",
+        "Adaptive/IRT Support": "No",
+    }
+def test_crawl_discovers_every_page_and_retries_transient_errors():
+    flaky, calls = listing_url(1, 12), []
+    assessments, engine = crawl(site(failures={flaky: [503, 429]}, calls=calls))
+    assert sorted(a["Assessment Name"] for a in assessments) == [
+        "Java 8 (New)", "Python (New)", "SQL Server (New)", "Verify - Verbal Ability",
+    ]
+    assert all(a["Duration"] == 18 for a in assessments)
+    assert calls.count(flaky) == 3
+    assert engine.counters["errors"] == 0
+def test_crawl_resumes_from_the_checkpoint(tmp_path):
+    path = str(tmp_path / "checkpoint.jsonl")
+    first, _ = crawl(site(), Checkpoint(path))
+    calls = []
+    resumed, engine = crawl(site(calls=calls), Checkpoint(path, resume=True))
+    assert calls == []
+    assert engine.counters["resumed"] == 3 + len(first)
+    assert sorted(a["URL"] for a in resumed) == sorted(a["URL"] for a in first)
+class FlakyPool(BrowserPool):
+    # Launches fail until the test allows them; a "driver" is just a token
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.failing = True
+    def _new_driver(self):
+        if self.failing:
+            raise OSError("chrome did not start")
+        return object()
+def test_failed_browser_launches_give_their_slot_back():
+    pool = FlakyPool(size=2, acquire_timeout=0.2)
+    for _ in range(3):
+        with pytest.raises(OSError):
+            pool._acquire()
+    pool.failing = False
+    assert pool._acquire() is not None
+def test_waiting_for_a_busy_browser_times_out():
+    pool = FlakyPool(size=1, acquire_timeout=0.2)
+    pool.failing = False
+    pool._acquire()
+    with pytest.raises(TimeoutError):
+        pool._acquire()
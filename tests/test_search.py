@@ -0,0 +1,50 @@
+import os
+import numpy as np
+import pytest
+from catalog import ID_MAP_NAME, assessment_id, write_id_map
+from handle_query import search_similar_fuzzy
+from index_factory import RerankedIndex, build_index, search_ids
+@pytest.fixture(scope="module")
+def vectors():
+    rng = np.random.default_rng(0)
+    x = rng.standard_normal((5000, 16)).astype(np.float32)
+    x /= np.linalg.norm(x, axis=1, keepdims=True)
+    ids = np.arange(len(x), dtype=np.int64) * 3 + 1
+    queries = rng.standard_normal((20, 16)).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    # A selective filter: 30 eligible ids plus two that are not in the index at all
+    eligible = np.concatenate([ids[rng.choice(len(ids), 30, replace=False)], [2, 5]])
+    return x, ids, queries, eligible
+@pytest.mark.parametrize("kind, search_params", [("hnsw", {"efSearch": 16}), ("ivf_flat", {"nprobe": 1})])
+def test_selective_filter_still_returns_the_exact_top_k(vectors, kind, search_params):
+    x, ids, queries, eligible = vectors
+    exact, _ = build_index(x.copy(), ids, "flat")
+    _, expected = search_ids(exact, queries, 10, eligible)
+    index, _ = build_index(x.copy(), ids, kind, search_params=search_params)
+    _, found = search_ids(index, queries, 10, eligible)
+    assert (found >= 0).all()
+    assert [set(row) for row in found.tolist()] == [set(row) for row in expected.tolist()]
+def test_reranked_index_survives_the_vectors_being_republished(vectors, tmp_path):
+    x, ids, queries, _ = vectors
+    path = str(tmp_path / "assessment_embeddings.npy")
+    np.save(path, x)
+    index, _ = build_index(x.copy(), ids, "sq8")
+    reranked = RerankedIndex.open(index, path, ids)
+    _, before = reranked.search(queries, 10)
+    # A rebuild publishes new vectors with os.replace; the open mapping keeps reading the old file
+    staged = str(tmp_path / "staged.npy")
+    np.save(staged, np.zeros_like(x))
+    os.replace(staged, path)
+    _, after = reranked.search(queries, 10)
+    assert after.tolist() == before.tolist()
+def test_plain_metadata_list_is_matched_through_the_id_map(tmp_path, monkeypatch):
+    # The index is labelled with hashed assessment ids; a bare list of records must not be read positionally
+    from conftest import FIXTURE_RECORDS
+    records = [dict(r) for r in FIXTURE_RECORDS]
+    ids = np.array([assessment_id(r) for r in records], dtype=np.int64)
+    index, _ = build_index(np.eye(len(records), 8, dtype=np.float32), ids, "flat")
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "outputs").mkdir()
+    write_id_map(ids, ids, str(tmp_path / "outputs" / ID_MAP_NAME))
+    results = search_similar_fuzzy(np.eye(1, 8, 2, dtype=np.float32), index, records, top_k=2)
+    assert results[0][:2] == ("SQL Server", "https://example.com/sql")
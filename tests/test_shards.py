@@ -0,0 +1,26 @@
+import os
+import numpy as np
+from sharded_search import ShardedIndex, read_shards_manifest, write_shards
+def build(shards_dir, seed):
+    rng = np.random.default_rng(seed)
+    x = rng.standard_normal((200, 8)).astype(np.float32)
+    x /= np.linalg.norm(x, axis=1, keepdims=True)
+    ids = np.arange(len(x), dtype=np.int64) * 7 + seed
+    write_shards(x, ids, ["shl"] * len(ids), shards_dir, 2)
+    return x, ids
+def test_rebuild_swaps_the_shard_set_under_running_workers(tmp_path):
+    shards_dir = str(tmp_path / "shards")
+    x, ids = build(shards_dir, 1)
+    index = ShardedIndex.open(shards_dir)
+    _, before = index.search(x[:3], 5)
+    first_build = read_shards_manifest(shards_dir)["build"]
+    x_new, ids_new = build(shards_dir, 2)
+    assert sorted(os.listdir(tmp_path)) == ["shards"]
+    assert read_shards_manifest(shards_dir)["build"] != first_build
+    # Workers started before the rebuild keep answering from the set they opened
+    _, still = index.search(x[:3], 5)
+    assert still.tolist() == before.tolist()
+    assert set(before.ravel()) <= set(ids.tolist())
+    reopened = ShardedIndex.open(shards_dir)
+    _, after = reopened.search(x_new[:3], 1)
+    assert after.ravel().tolist() == ids_new[:3].tolist()
@@ -0,0 +1,16 @@
+import model_service
+from startup_bundle import open_bundle, pin_model, write_bundle
+def test_opening_a_bundle_leaves_the_model_alone_until_pinned(fixture_catalog, tmp_path, monkeypatch):
+    monkeypatch.setattr(model_service, "MODEL_PATH", None)
+    monkeypatch.setattr(model_service, "_stats", dict(model_service._stats))
+    snapshot = tmp_path / "snapshot"
+    snapshot.mkdir()
+    bundle_dir = str(tmp_path / "outputs" / "bundle")
+    write_bundle(fixture_catalog, bundle_dir, [], model_path=str(snapshot))
+    catalog = open_bundle(bundle_dir)
+    assert catalog.names == fixture_catalog.names
+    assert model_service.MODEL_PATH is None
+    assert pin_model(bundle_dir) == str(snapshot)
+    assert model_service.MODEL_PATH == str(snapshot)
+    # A second start-up call keeps the pin it already has
+    assert pin_model(bundle_dir) is None
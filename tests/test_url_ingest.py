@@ -0,0 +1,90 @@
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+from url_ingest import UrlIngestor
+JOB_PAGE = b"""<html><head><title>Java Developer</title></head><body><article>
+<h1>Java Developer</h1>
+<p>We are hiring a Java developer to build and maintain backend services for our assessment platform.</p>
+<p>You will work closely with business teams, write clean and tested code, and review pull requests from colleagues.</p>
+<p>Experience with Spring, SQL databases and cloud deployments is expected for this full-time role.</p>
+</article></body></html>"""
+class StandIn(BaseHTTPRequestHandler):
+    # /job carries an ETag, /plain has no validators, /slow records how many requests overlap, anything else 404s
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests.append((self.path, self.headers.get("If-None-Match")))
+        if self.path == "/slow":
+            with server.lock:
+                server.active += 1
+                server.peak = max(server.peak, server.active)
+            time.sleep(0.1)
+            with server.lock:
+                server.active -= 1
+        if self.path == "/job" and self.headers.get("If-None-Match") == '"v1"':
+            self.send_response(304)
+            self.end_headers()
+            return
+        if self.path not in ("/job", "/plain", "/slow"):
+            self.send_response(404)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(JOB_PAGE)))
+        if self.path == "/job":
+            self.send_header("ETag", '"v1"')
+        self.end_headers()
+        self.wfile.write(JOB_PAGE)
+    def log_message(self, *args):
+        pass
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), StandIn)
+    httpd.lock, httpd.requests, httpd.active, httpd.peak = threading.Lock(), [], 0, 0
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    httpd.url = f"http://127.0.0.1:{httpd.server_address[1]}"
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+@pytest.fixture
+def make_ingestor():
+    ingestors = []
+    def make(**kwargs):
+        ingestor = UrlIngestor(**kwargs)
+        ingestors.append(ingestor)
+        return ingestor
+    yield make
+    for ingestor in ingestors:
+        ingestor.close()
+def test_fresh_cache_hit_skips_the_network(server, make_ingestor):
+    ingestor = make_ingestor(fresh_seconds=300)
+    first = ingestor.fetch_text(server.url + "/job")
+    assert "Java developer" in first
+    assert ingestor.fetch_text(server.url + "/job") == first
+    assert len(server.requests) == 1
+    assert ingestor.stats()["fresh_hits"] == 1 and ingestor.stats()["extractions"] == 1
+def test_stale_entry_is_revalidated_with_its_etag(server, make_ingestor):
+    ingestor = make_ingestor(fresh_seconds=0)
+    first = ingestor.fetch_text(server.url + "/job")
+    assert ingestor.fetch_text(server.url + "/job") == first
+    assert server.requests == [("/job", None), ("/job", '"v1"')]
+    stats = ingestor.stats()
+    assert stats["not_modified"] == 1 and stats["extractions"] == 1
+def test_unchanged_body_is_not_extracted_again(server, make_ingestor):
+    ingestor = make_ingestor(fresh_seconds=0)
+    first = ingestor.fetch_text(server.url + "/plain")
+    assert ingestor.fetch_text(server.url + "/plain") == first
+    stats = ingestor.stats()
+    assert stats["fetches"] == 2 and stats["unchanged_body"] == 1 and stats["extractions"] == 1
+def test_per_host_limit_bounds_concurrent_fetches(server, make_ingestor):
+    ingestor = make_ingestor(max_workers=4, per_host=1, fresh_seconds=0)
+    urls = [f"{server.url}/slow" for _ in range(4)]
+    assert all(ingestor.fetch_many(urls, timeout=10))
+    assert server.peak == 1
+def test_failed_fetch_returns_empty_text(server, make_ingestor):
+    ingestor = make_ingestor()
+    assert ingestor.fetch_text(server.url + "/missing") == ""
+    assert ingestor.stats()["errors"] == 1
@@ -0,0 +1,96 @@
+import os
+import json
+import time
+import argparse
+import numpy as np
+import pandas as pd
+import faiss
+from benchmark_eval import load_eval_set, log, score_retrieval
+from catalog import ID_MAP_NAME, get_catalog, load_id_map
+from handle_query import embed_queries_instructor
+from index_factory import INDEX_KINDS, RERANKED_KINDS, RerankedIndex, apply_search_params, build_index, index_memory_bytes
+import model_service
+# Search-time knob values swept for each index kind
+SWEEPS = {
+    "flat": {},
+    "hnsw": {"efSearch": [16, 32, 64, 128, 256]},
+    "ivf_flat": {"nprobe": [1, 2, 4, 8, 16, 32]},
+    "ivf_pq": {"nprobe": [1, 2, 4, 8, 16, 32]},
+    "opq_ivf_pq": {"nprobe": [1, 2, 4, 8, 16, 32]},
+    # Candidates re-ranked against the fp32 vectors; below k it is k (first-pass order, exact scores)
+    "sq_fp16": {"rerank": [10, 25, 50, 100, 200, 400]},
+    "sq8": {"rerank": [10, 25, 50, 100, 200, 400]},
+    "binary": {"rerank": [10, 25, 50, 100, 200, 400]},
+}
+def load_stored_vectors(catalog, output_dir="outputs"):
+    embeddings = np.load(os.path.join(output_dir, "assessment_embeddings.npy")).astype(np.float32)
+    faiss.normalize_L2(embeddings)
+    _, vector_ids = load_id_map(os.path.join(output_dir, ID_MAP_NAME), len(catalog))
+    ids = vector_ids if vector_ids is not None else np.arange(len(embeddings), dtype=np.int64)
+    return embeddings, ids
+def evaluate_index(index, catalog, query_vecs, eval_set, k, exact=None):
+    # exact: fp32 flat top-k ids per query; Overlap@k is the share of them the index also returns
+    latencies, recalls, aps, overlaps = [], [], [], []
+    for i, entry in enumerate(eval_set):
+        start = time.perf_counter()
+        _, I = index.search(query_vecs[i:i + 1], k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        names = [catalog.names[row] for row in catalog.rows_for_ids(I[0]) if row >= 0]
+        recall, ap = score_retrieval(names, set(entry["relevant_ids"]), k)
+        recalls.append(recall)
+        aps.append(ap)
+        if exact is not None:
+            overlaps.append(len(set(I[0].tolist()) & set(exact[i].tolist())) / k)
+    return {
+        f"Recall@{k}": round(float(np.mean(recalls)), 4),
+        f"MAP@{k}": round(float(np.mean(aps)), 4),
+        f"Overlap@{k}": round(float(np.mean(overlaps)), 4) if overlaps else None,
+        "p50_ms": round(float(np.percentile(latencies, 50)), 3),
+        "p99_ms": round(float(np.percentile(latencies, 99)), 3),
+    }
+def sweep(kinds, k=5, output_path="outputs/index_tuning.json"):
+    catalog = get_catalog()
+    eval_set = load_eval_set("query_eval_set.json")
+    embeddings, ids = load_stored_vectors(catalog)
+    log(f"Embedding {len(eval_set)} evaluation queries...")
+    query_vecs = embed_queries_instructor([q["query"] for q in eval_set], device=model_service.default_device())
+    # Reference for memory saved and result overlap: exact search over the fp32 vectors
+    reference, _ = build_index(embeddings.copy(), ids, "flat")
+    reference_bytes = index_memory_bytes(reference)
+    _, exact = reference.search(query_vecs, k)
+    rows = []
+    for kind in kinds:
+        log(f"Building {kind} index over {len(embeddings)} vectors...")
+        start = time.perf_counter()
+        try:
+            index, config = build_index(embeddings.copy(), ids, kind)
+        except ValueError as e:
+            log(f"Skipping {kind}: {e}")
+            continue
+        build_seconds = round(time.perf_counter() - start, 3)
+        if kind in RERANKED_KINDS:
+            index = RerankedIndex(index, embeddings, ids)
+        # Resident memory only; re-ranked kinds read their fp32 vectors memory-mapped when serving
+        memory_bytes = index_memory_bytes(index)
+        memory_mb = round(memory_bytes / 1e6, 3)
+        saving = round(reference_bytes / memory_bytes, 1)
+        knobs = SWEEPS.get(kind, {})
+        settings = [{name: value} for name, values in knobs.items() for value in values] or [{}]
+        for setting in settings:
+            apply_search_params(index, setting)
+            row = {"kind": kind, "factory": config["factory"], **setting, "memory_mb": memory_mb, "memory_saving": saving,
+                   "build_s": build_seconds}
+            row.update(evaluate_index(index, catalog, query_vecs, eval_set, k, exact))
+            rows.append(row)
+    with open(output_path, "w", encoding="utf-8") as f:
+        json.dump(rows, f, indent=2)
+    log(f"Tuning results saved to {output_path}")
+    return rows
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sweep FAISS index types and search knobs against query_eval_set.json.")
+    parser.add_argument("--kinds", nargs="+", default=list(INDEX_KINDS), choices=INDEX_KINDS)
+    parser.add_argument("-k", type=int, default=5)
+    parser.add_argument("--output", default="outputs/index_tuning.json")
+    args = parser.parse_args()
+    results = sweep(args.kinds, k=args.k, output_path=args.output)
+    print(pd.DataFrame(results).fillna("").to_string(index=False))
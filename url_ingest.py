@@ -0,0 +1,124 @@
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+# requests and trafilatura are imported on first use, so importing the query path stays cheap
+USER_AGENT = "Mozilla/5.0 (compatible; SHL-Assessment-Recommender/1.0)"
+class UrlIngestor:
+    # Fetches job-description pages on a bounded thread pool over one keep-alive session,
+    # with a per-host concurrency limit and an extracted-text cache revalidated by ETag/Last-Modified.
+    def __init__(self, max_workers=8, per_host=2, connect_timeout=5, read_timeout=15,
+                 cache_size=512, fresh_seconds=300, session=None):
+        self.per_host = per_host
+        self.timeout = (connect_timeout, read_timeout)
+        self.cache_size = cache_size
+        self.fresh_seconds = fresh_seconds
+        self.session = session or self._build_session(max_workers)
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="url-ingest")
+        self._host_slots = {}
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = {"fetches": 0, "fresh_hits": 0, "not_modified": 0, "unchanged_body": 0, "extractions": 0, "errors": 0}
+    def _build_session(self, max_workers):
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+        session = requests.Session()
+        retries = Retry(total=2, backoff_factor=0.3, status_forcelist=(429, 500, 502, 503, 504), allowed_methods=("GET",))
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers, max_retries=retries)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        session.headers["User-Agent"] = USER_AGENT
+        return session
+    def _host_slot(self, url):
+        host = urlsplit(url).netloc.lower()
+        with self._lock:
+            slot = self._host_slots.get(host)
+            if slot is None:
+                slot = self._host_slots[host] = threading.BoundedSemaphore(self.per_host)
+        return slot
+    def _cached(self, url):
+        with self._lock:
+            entry = self._cache.get(url)
+            if entry is not None:
+                self._cache.move_to_end(url)
+            return entry
+    def _store(self, url, entry):
+        with self._lock:
+            self._cache[url] = entry
+            self._cache.move_to_end(url)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+    def fetch_text(self, url):
+        entry = self._cached(url)
+        if entry is not None and time.time() - entry["checked_at"] < self.fresh_seconds:
+            self._count("fresh_hits")
+            return entry["text"]
+        headers = {}
+        if entry is not None:
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+        import requests
+        with self._host_slot(url):
+            self._count("fetches")
+            try:
+                response = self.session.get(url, headers=headers, timeout=self.timeout)
+            except requests.RequestException:
+                self._count("errors")
+                return entry["text"] if entry is not None else ""
+        if response.status_code == 304 and entry is not None:
+            self._count("not_modified")
+            self._store(url, dict(entry, checked_at=time.time()))
+            return entry["text"]
+        if response.status_code != 200:
+            self._count("errors")
+            return ""
+        body_hash = hashlib.sha1(response.content).hexdigest()
+        if entry is not None and entry["body_hash"] == body_hash:
+            self._count("unchanged_body")
+            text = entry["text"]
+        else:
+            self._count("extractions")
+            import trafilatura
+            text = trafilatura.extract(response.text, url=url) or ""
+        self._store(url, {
+            "text": text,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "body_hash": body_hash,
+            "checked_at": time.time(),
+        })
+        return text
+    def submit(self, url):
+        return self._pool.submit(self.fetch_text, url)
+    def fetch_many(self, urls, timeout=None):
+        futures = [self.submit(url) for url in urls]
+        return [future.result(timeout=timeout) for future in futures]
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats["cached_urls"] = len(self._cache)
+        return stats
+    def close(self):
+        self._pool.shutdown(wait=False)
+        self.session.close()
+_ingestor = None
+_ingestor_lock = threading.Lock()
+def get_ingestor():
+    global _ingestor
+    with _ingestor_lock:
+        if _ingestor is None:
+            _ingestor = UrlIngestor(
+                max_workers=int(os.environ.get("SHL_FETCH_WORKERS", 8)),
+                per_host=int(os.environ.get("SHL_FETCH_PER_HOST", 2)),
+                read_timeout=float(os.environ.get("SHL_FETCH_TIMEOUT", 15)),
+            )
+    return _ingestor